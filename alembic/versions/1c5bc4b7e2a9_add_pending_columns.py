@@ -0,0 +1,35 @@
+"""Add pending columns to company and customer
+
+Revision ID: 1c5bc4b7e2a9
+Revises: 3c76fb0d6937
+Create Date: 2014-02-10 15:21:07.342000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1c5bc4b7e2a9'
+down_revision = '3c76fb0d6937'
+
+from alembic import op
+from sqlalchemy import Column
+from sqlalchemy import Boolean
+from sqlalchemy.sql import false
+
+
+def upgrade():
+    op.add_column(
+        'company',
+        Column('pending', Boolean, nullable=False, server_default=false()),
+    )
+    op.add_column(
+        'customer',
+        Column('pending', Boolean, nullable=False, server_default=false()),
+    )
+
+
+def downgrade():
+    # ouch.. SQLlite doens't support alter column syntax,
+    bind = op.get_bind()
+    if bind is None or bind.engine.name != 'sqlite':
+        op.drop_column('company', 'pending')
+        op.drop_column('customer', 'pending')
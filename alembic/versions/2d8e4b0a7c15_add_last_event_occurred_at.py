@@ -0,0 +1,61 @@
+"""Add last_event_occurred_at column to transaction
+
+Revision ID: 2d8e4b0a7c15
+Revises: 4a1d2f6c9b3e
+Create Date: 2014-02-14 17:42:19.508000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2d8e4b0a7c15'
+down_revision = '4a1d2f6c9b3e'
+
+from alembic import op
+from sqlalchemy import Column
+from sqlalchemy import Unicode
+from sqlalchemy import DateTime
+from sqlalchemy.sql import table
+from sqlalchemy.sql import select
+from sqlalchemy.sql import func
+
+
+transaction = table(
+    'transaction',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('last_event_occurred_at', DateTime),
+)
+
+
+transaction_event = table(
+    'transaction_event',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('transaction_guid', Unicode(64)),
+    Column('occurred_at', DateTime),
+)
+
+
+def upgrade():
+    op.add_column(
+        'transaction',
+        Column('last_event_occurred_at', DateTime),
+    )
+    op.execute((
+        transaction.update()
+        .values(
+            last_event_occurred_at=(
+                select([func.max(transaction_event.c.occurred_at)])
+                .where(
+                    transaction_event.c.transaction_guid ==
+                    transaction.c.guid
+                )
+                .as_scalar()
+            )
+        )
+    ))
+
+
+def downgrade():
+    # ouch.. SQLlite doens't support alter column syntax,
+    bind = op.get_bind()
+    if bind is None or bind.engine.name != 'sqlite':
+        op.drop_column('transaction', 'last_event_occurred_at')
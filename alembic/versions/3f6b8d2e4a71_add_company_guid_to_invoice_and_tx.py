@@ -0,0 +1,145 @@
+"""Add company_guid column to invoice and transaction
+
+Revision ID: 3f6b8d2e4a71
+Revises: 5e7a9c3d1f28
+Create Date: 2014-02-19 14:08:33.216000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3f6b8d2e4a71'
+down_revision = '5e7a9c3d1f28'
+
+from alembic import op
+from sqlalchemy import Column
+from sqlalchemy import Unicode
+from sqlalchemy.sql import table
+from sqlalchemy.sql import select
+from sqlalchemy.schema import ForeignKey
+
+
+invoice = table(
+    'invoice',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('company_guid', Unicode(64)),
+)
+
+customer_invoice = table(
+    'customer_invoice',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('customer_guid', Unicode(64)),
+)
+
+subscription_invoice = table(
+    'subscription_invoice',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('subscription_guid', Unicode(64)),
+)
+
+customer = table(
+    'customer',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('company_guid', Unicode(64)),
+)
+
+subscription = table(
+    'subscription',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('plan_guid', Unicode(64)),
+)
+
+plan = table(
+    'plan',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('company_guid', Unicode(64)),
+)
+
+transaction = table(
+    'transaction',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('invoice_guid', Unicode(64)),
+    Column('company_guid', Unicode(64)),
+)
+
+
+def upgrade():
+    for table_name in ['invoice', 'transaction']:
+        op.add_column(
+            table_name,
+            Column(
+                'company_guid',
+                Unicode(64),
+                ForeignKey(
+                    'company.guid',
+                    ondelete='CASCADE', onupdate='CASCADE'
+                ),
+            ),
+        )
+
+    # invoices of customers
+    op.execute((
+        invoice.update()
+        .where(invoice.c.guid.in_(select([customer_invoice.c.guid])))
+        .values(
+            company_guid=(
+                select([customer.c.company_guid])
+                .where(customer.c.guid == customer_invoice.c.customer_guid)
+                .where(customer_invoice.c.guid == invoice.c.guid)
+                .as_scalar()
+            )
+        )
+    ))
+    # invoices of subscriptions
+    op.execute((
+        invoice.update()
+        .where(invoice.c.guid.in_(select([subscription_invoice.c.guid])))
+        .values(
+            company_guid=(
+                select([plan.c.company_guid])
+                .where(plan.c.guid == subscription.c.plan_guid)
+                .where(
+                    subscription.c.guid ==
+                    subscription_invoice.c.subscription_guid
+                )
+                .where(subscription_invoice.c.guid == invoice.c.guid)
+                .as_scalar()
+            )
+        )
+    ))
+    op.execute((
+        transaction.update()
+        .values(
+            company_guid=(
+                select([invoice.c.company_guid])
+                .where(invoice.c.guid == transaction.c.invoice_guid)
+                .as_scalar()
+            )
+        )
+    ))
+
+    op.create_index(
+        'ix_invoice_company_guid_created_at_guid',
+        'invoice',
+        ['company_guid', 'created_at', 'guid'],
+    )
+    op.create_index(
+        'ix_transaction_company_guid_created_at_guid',
+        'transaction',
+        ['company_guid', 'created_at', 'guid'],
+    )
+
+    # ouch.. SQLlite doens't support alter column syntax,
+    bind = op.get_bind()
+    if bind is None or bind.engine.name != 'sqlite':
+        op.alter_column('invoice', 'company_guid', nullable=False)
+        op.alter_column('transaction', 'company_guid', nullable=False)
+
+
+def downgrade():
+    op.drop_index('ix_invoice_company_guid_created_at_guid', 'invoice')
+    op.drop_index('ix_transaction_company_guid_created_at_guid', 'transaction')
+    # ouch.. SQLlite doens't support alter column syntax,
+    bind = op.get_bind()
+    if bind is None or bind.engine.name != 'sqlite':
+        op.drop_column('invoice', 'company_guid')
+        op.drop_column('transaction', 'company_guid')
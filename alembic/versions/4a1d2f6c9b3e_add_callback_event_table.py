@@ -0,0 +1,56 @@
+"""Add callback event table
+
+Revision ID: 4a1d2f6c9b3e
+Revises: 1c5bc4b7e2a9
+Create Date: 2014-02-12 11:04:38.117000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4a1d2f6c9b3e'
+down_revision = '1c5bc4b7e2a9'
+
+from alembic import op
+from sqlalchemy import Column
+from sqlalchemy import Enum
+from sqlalchemy import Unicode
+from sqlalchemy import UnicodeText
+from sqlalchemy import DateTime
+from sqlalchemy.schema import ForeignKey
+from sqlalchemy.schema import UniqueConstraint
+
+
+def upgrade():
+    op.create_table(
+        'callback_event',
+        Column('guid', Unicode(64), primary_key=True),
+        Column(
+            'company_guid',
+            Unicode(64),
+            ForeignKey(
+                'company.guid',
+                ondelete='CASCADE', onupdate='CASCADE'
+            ),
+            index=True,
+            nullable=False,
+        ),
+        Column('processor_id', Unicode(128), nullable=False),
+        Column('payload', UnicodeText, nullable=False),
+        Column(
+            'status',
+            Enum(
+                'RECEIVED', 'PROCESSED', 'IGNORED', 'FAILED',
+                name='ck_callback_event_status',
+            ),
+            index=True,
+            nullable=False,
+        ),
+        Column('error_message', UnicodeText),
+        Column('created_at', DateTime, index=True),
+        Column('updated_at', DateTime),
+        UniqueConstraint('company_guid', 'processor_id'),
+    )
+
+
+def downgrade():
+    op.drop_table('callback_event')
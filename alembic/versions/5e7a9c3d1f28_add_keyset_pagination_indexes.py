@@ -0,0 +1,41 @@
+"""Add composite indexes for keyset pagination
+
+Revision ID: 5e7a9c3d1f28
+Revises: 2d8e4b0a7c15
+Create Date: 2014-02-17 10:26:51.723000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5e7a9c3d1f28'
+down_revision = '2d8e4b0a7c15'
+
+from alembic import op
+
+
+INDEXES = [
+    ('ix_customer_company_guid_created_at_guid', 'customer',
+     ['company_guid', 'created_at', 'guid']),
+    ('ix_plan_company_guid_created_at_guid', 'plan',
+     ['company_guid', 'created_at', 'guid']),
+    ('ix_subscription_plan_guid_created_at_guid', 'subscription',
+     ['plan_guid', 'created_at', 'guid']),
+    ('ix_subscription_customer_guid_created_at_guid', 'subscription',
+     ['customer_guid', 'created_at', 'guid']),
+    ('ix_invoice_created_at_guid', 'invoice',
+     ['created_at', 'guid']),
+    ('ix_transaction_created_at_guid', 'transaction',
+     ['created_at', 'guid']),
+    ('ix_transaction_invoice_guid_created_at_guid', 'transaction',
+     ['invoice_guid', 'created_at', 'guid']),
+]
+
+
+def upgrade():
+    for name, table_name, columns in INDEXES:
+        op.create_index(name, table_name, columns)
+
+
+def downgrade():
+    for name, table_name, _ in INDEXES:
+        op.drop_index(name, table_name)
@@ -0,0 +1,88 @@
+"""Add stored adjustment amounts to invoice
+
+Revision ID: 6b2c5e8f0d94
+Revises: 3f6b8d2e4a71
+Create Date: 2014-02-21 16:55:02.481000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6b2c5e8f0d94'
+down_revision = '3f6b8d2e4a71'
+
+from alembic import op
+from sqlalchemy import Column
+from sqlalchemy import Integer
+from sqlalchemy import Unicode
+from sqlalchemy.sql import table
+from sqlalchemy.sql import select
+from sqlalchemy.sql import func
+
+
+invoice = table(
+    'invoice',
+    Column('guid', Unicode(64), primary_key=True),
+    Column('amount', Integer),
+    Column('total_adjustment_amount', Integer),
+    Column('effective_amount', Integer),
+)
+
+
+adjustment = table(
+    'adjustment',
+    Column('adjustment_id', Integer, primary_key=True),
+    Column('invoice_guid', Unicode(64)),
+    Column('amount', Integer),
+)
+
+
+def upgrade():
+    op.add_column(
+        'invoice',
+        Column(
+            'total_adjustment_amount',
+            Integer,
+            nullable=False,
+            server_default='0',
+        ),
+    )
+    op.add_column(
+        'invoice',
+        Column('effective_amount', Integer),
+    )
+    op.execute((
+        invoice.update()
+        .values(
+            total_adjustment_amount=(
+                select([func.coalesce(func.sum(adjustment.c.amount), 0)])
+                .where(adjustment.c.invoice_guid == invoice.c.guid)
+                .as_scalar()
+            )
+        )
+    ))
+    op.execute((
+        invoice.update()
+        .values(
+            effective_amount=(
+                invoice.c.amount + invoice.c.total_adjustment_amount
+            )
+        )
+    ))
+    op.create_index(
+        'ix_invoice_effective_amount',
+        'invoice',
+        ['effective_amount'],
+    )
+    # ouch.. SQLlite doens't support alter column syntax,
+    bind = op.get_bind()
+    if bind is None or bind.engine.name != 'sqlite':
+        op.alter_column('invoice', 'effective_amount', nullable=False)
+
+
+def downgrade():
+    op.drop_index('ix_invoice_effective_amount', 'invoice')
+    # ouch.. SQLlite doens't support alter column syntax,
+    bind = op.get_bind()
+    if bind is None or bind.engine.name != 'sqlite':
+        op.drop_column('invoice', 'total_adjustment_amount')
+        op.drop_column('invoice', 'effective_amount')
@@ -0,0 +1,46 @@
+"""Add billing run table
+
+Revision ID: 7d3a6f1c8e52
+Revises: 6b2c5e8f0d94
+Create Date: 2014-02-24 10:32:17.520000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7d3a6f1c8e52'
+down_revision = '6b2c5e8f0d94'
+
+from alembic import op
+from sqlalchemy import Column
+from sqlalchemy import Integer
+from sqlalchemy import Float
+from sqlalchemy import Unicode
+from sqlalchemy import UnicodeText
+from sqlalchemy import DateTime
+
+
+def upgrade():
+    op.create_table(
+        'billing_run',
+        Column('guid', Unicode(64), primary_key=True),
+        Column('reconcile_seconds', Float, nullable=False),
+        Column('callback_seconds', Float, nullable=False),
+        Column('yield_seconds', Float, nullable=False),
+        Column('process_seconds', Float, nullable=False),
+        Column('invoices_yielded', Integer, nullable=False),
+        Column('transactions_attempted', Integer, nullable=False),
+        Column('transactions_succeeded', Integer, nullable=False),
+        Column('transactions_retried', Integer, nullable=False),
+        Column('transactions_failed', Integer, nullable=False),
+        Column('processor_seconds', Float, nullable=False),
+        Column('db_statements', Integer, nullable=False),
+        Column('db_seconds', Float, nullable=False),
+        Column('profile_path', UnicodeText),
+        Column('error_message', UnicodeText),
+        Column('started_at', DateTime, index=True),
+        Column('finished_at', DateTime),
+    )
+
+
+def downgrade():
+    op.drop_table('billing_run')
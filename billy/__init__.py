@@ -4,8 +4,13 @@ from pyramid.config import Configurator
 from pyramid.authorization import ACLAuthorizationPolicy
 
 from billy.models import setup_database
+from billy.models.executor import TransactionExecutor
+from billy.utils.cache import TTLCache
 from billy.request import APIRequest
 from billy.api.auth import AuthenticationPolicy
+from billy.api.utils import get_processor_factory
+from billy.api.utils import get_processing_mode
+from billy.api.utils import PROCESSING_BACKGROUND
 
 
 def main(global_config, **settings):
@@ -14,6 +19,23 @@ def main(global_config, **settings):
     """
     # setup database
     settings = setup_database(global_config, **settings)
+    # setup background transaction executor
+    if (
+        get_processing_mode(settings) == PROCESSING_BACKGROUND and
+        'transaction_executor' not in settings
+    ):
+        settings['transaction_executor'] = TransactionExecutor(
+            session=settings['session'],
+            processor_factory=get_processor_factory(settings),
+            settings=settings,
+            workers=int(settings.get('billy.transaction.executor_workers', 1)),
+        )
+    # backlog exposed at /metrics is counted at most once in the ttl
+    if 'metrics_backlog_cache' not in settings:
+        settings['metrics_backlog_cache'] = TTLCache(
+            max_size=1,
+            ttl=float(settings.get('billy.metrics.backlog_ttl', 30)),
+        )
     config = Configurator(
         settings=settings,
         request_factory=APIRequest,
@@ -25,6 +47,14 @@ def main(global_config, **settings):
     config.add_tween('.api.auth.basic_auth_tween_factory')
     # add access-control-allow-origin header setting
     config.add_tween('.api.allow_origin.allow_origin_tween_factory')
+    # add gzip/deflate compression of response bodies
+    config.add_tween('.api.compression.compression_tween_factory')
+    # count SQL statements and database time of requests
+    config.add_tween('.api.query_stats.query_stats_tween_factory')
+    # observe request latency by view
+    config.add_tween('.api.metrics.metrics_tween_factory')
+    # trace requests by view
+    config.add_tween('.api.tracing.tracing_tween_factory')
     # provides table entity to json renderers
     config.include('.renderers')
     # provides api views
@@ -44,4 +44,5 @@ class RootResource(object):
 
 def includeme(config):
     config.add_route('server_info', '/')
+    config.add_route('metrics', '/metrics')
     config.set_root_factory(RootResource)
@@ -5,14 +5,24 @@ from pyramid.security import Everyone
 from pyramid.security import Authenticated
 
 
+# marks the authenticated company is not looked up yet in a request
+_NOT_LOOKED_UP = object()
+
+
 class AuthenticationPolicy(object):
 
     def authenticated_userid(self, request):
+        # Notice: this gets called by effective_principals and views many
+        # times in a request, so we only look up the company once
+        company = getattr(request, '_authenticated_company', _NOT_LOOKED_UP)
+        if company is not _NOT_LOOKED_UP:
+            return company
+        company = None
         api_key = self.unauthenticated_userid(request)
-        if api_key is None:
-            return None
-        company_model = request.model_factory.create_company_model()
-        company = company_model.get_by_api_key(api_key)
+        if api_key is not None:
+            company_model = request.model_factory.create_company_model()
+            company = company_model.get_by_api_key_cached(api_key)
+        request._authenticated_company = company
         return company
 
     def unauthenticated_userid(self, request):
@@ -0,0 +1,180 @@
+from __future__ import unicode_literals
+import json
+import logging
+from multiprocessing.pool import ThreadPool
+
+from pyramid.httpexceptions import HTTPBadRequest
+
+from billy.api.utils import json_formdata
+from billy.api.utils import submit_transactions
+
+
+def parse_bulk_items(request):
+    """Parse items for bulk creation from request body, which can be either a
+    JSON array or JSON lines, each item should be an object with the same
+    parameters as the single creation API
+
+    """
+    settings = request.registry.settings
+    max_items = int(settings.get('billy.bulk.max_items', 1000))
+    try:
+        body = request.body.decode('utf8').strip()
+        if body.startswith('['):
+            items = json.loads(body)
+        else:
+            items = [json.loads(line) for line in body.splitlines()
+                     if line.strip()]
+    except ValueError:
+        raise HTTPBadRequest('Body should be a JSON array or JSON lines')
+    if not items:
+        raise HTTPBadRequest('No items given')
+    for item in items:
+        if not isinstance(item, dict):
+            raise HTTPBadRequest('Items should be JSON objects')
+    if len(items) > max_items:
+        raise HTTPBadRequest(
+            'Cannot create more than {} items at once'.format(max_items)
+        )
+    return items
+
+
+def validate_item(form_cls, request, item):
+    """Validate an item with given form, return the form and None, or None
+    and the error message if the item is invalid
+
+    """
+    form = form_cls(json_formdata(item))
+    # Notice: this make validators can query to database
+    form.model_factory = request.model_factory
+    if form.validate():
+        return form, None
+    messages = []
+    for key, errors in sorted(form.errors.iteritems()):
+        messages.append('{}: {}'.format(key, ' '.join(errors)))
+    return None, '; '.join(messages)
+
+
+def created_result(index, guid):
+    """Make the result of an item which is created successfully
+
+    """
+    return dict(index=index, guid=guid)
+
+
+def error_result(index, error_class, error_message):
+    """Make the result of an item which failed to be created
+
+    """
+    return dict(
+        index=index,
+        error_class=error_class,
+        error_message=error_message,
+    )
+
+
+def exception_result(index, error):
+    """Make the result of an item which failed with given exception
+
+    """
+    message = getattr(error, 'msg', None)
+    if message is None:
+        # HTTP exceptions of pyramid
+        message = getattr(error, 'detail', None)
+    if message is None:
+        message = unicode(error)
+    return error_result(index, error.__class__.__name__, message)
+
+
+def fail_chunk(session, results, indexes, error):
+    """Make results of items in a chunk which failed as a whole with given
+    exception, items already have results (e.g. rejected before inserting)
+    are kept as they are
+
+    Notice: the session is rolled back here, as aborting the transaction
+    doesn't roll back the session which is kept by the zope transaction
+    extension, otherwise what the chunk inserted would be committed with the
+    next chunk
+
+    """
+    logger = logging.getLogger(__name__)
+    session.rollback()
+    logger.error('Failed to create chunk of items %s', indexes,
+                 exc_info=True)
+    for index in indexes:
+        if results[index] is None:
+            results[index] = exception_result(index, error)
+
+
+def call_concurrently(request, funcs):
+    """Call given functions in a thread pool of `billy.bulk.workers` size,
+    and return a list of (result, exception) tuples in the same order
+
+    The functions are supposed to talk to the processor only, they should
+    never touch the database
+
+    """
+    settings = request.registry.settings
+    workers = int(settings.get('billy.bulk.workers', 8))
+
+    def call(func):
+        try:
+            return func(), None
+        except (SystemExit, KeyboardInterrupt):
+            raise
+        except Exception, e:
+            return None, e
+
+    funcs = list(funcs)
+    if workers <= 1 or len(funcs) <= 1:
+        return [call(func) for func in funcs]
+    pool = ThreadPool(min(workers, len(funcs)))
+    try:
+        return pool.map(call, funcs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def validate_funding_instruments(request, company, funding_instrument_uris):
+    """Validate given funding instruments of the company in the processor
+    concurrently, return a dict maps invalid URIs to their errors
+
+    """
+    processor_key = company.processor_key
+    uris = sorted(set(uri for uri in funding_instrument_uris
+                      if uri is not None))
+
+    def make_validator(uri):
+        def validate():
+            processor = request.model_factory.create_processor()
+            processor.configure_api_key(processor_key)
+            processor.validate_funding_instrument(uri)
+        return validate
+
+    outcomes = call_concurrently(request, map(make_validator, uris))
+    return dict(
+        (uri, error) for uri, (_, error) in zip(uris, outcomes)
+        if error is not None
+    )
+
+
+def iter_chunks(request, items):
+    """Split items into chunks of `billy.bulk.chunk_size`, each chunk is
+    supposed to be inserted in a database transaction
+
+    """
+    settings = request.registry.settings
+    chunk_size = max(int(settings.get('billy.bulk.chunk_size', 100)), 1)
+    for begin in range(0, len(items), chunk_size):
+        yield items[begin:begin + chunk_size]
+
+
+def submit_in_chunks(request, transactions):
+    """Submit transactions of created items chunk by chunk, so that in
+    inline processing mode, each chunk of processor calls is done and
+    committed in its own database transaction rather than all of them in
+    one
+
+    """
+    for chunk in iter_chunks(request, list(transactions)):
+        submit_transactions(request, chunk)
@@ -1,12 +1,15 @@
 from __future__ import unicode_literals
 
 import transaction as db_transaction
+from sqlalchemy.exc import IntegrityError
 from pyramid.view import view_config
+from pyramid.settings import asbool
 from pyramid.security import NO_PERMISSION_REQUIRED
 from pyramid.security import Allow
 from pyramid.security import Everyone
 
 from billy.models.company import CompanyModel
+from billy.models.callback_event import DuplicateCallbackEventError
 from billy.api.utils import validate_form
 from billy.api.resources import BaseResource
 from billy.api.resources import URLMapResource
@@ -24,6 +27,10 @@ class CompanyResource(EntityResource):
     def company(self):
         return self.entity
 
+    @property
+    def company_guid(self):
+        return self.entity.guid
+
     def __getitem__(self, item):
         if item == 'callbacks':
             return CallbackIndex(self.company, self.request, self)
@@ -82,8 +89,20 @@ class CompanyIndexView(IndexView):
         with db_transaction.manager:
             company = model.create(
                 processor_key=processor_key,
-                make_callback_url=make_url,
+                pending=True,
             )
+            guid = company.guid
+            provision = model.prepare_provision(company, make_url)
+        # Notice: we talk to the processor out of the database transaction,
+        # so that we won't hold a DB connection and locks during the round trip
+        try:
+            update_db = provision()
+        except Exception:
+            with db_transaction.manager:
+                model.discard_pending(guid)
+            raise
+        with db_transaction.manager:
+            company = update_db(request.model_factory)
         return company
 
 
@@ -92,7 +111,7 @@ class CompanyView(EntityView):
 
     @view_config(request_method='GET')
     def get(self):
-        return self.context.entity
+        return self.conditional_get()
 
 
 @api_view_defaults(context=Callback, permission='callback')
@@ -101,6 +120,9 @@ class CallbackView(BaseView):
     @view_config(request_method='POST')
     def post(self):
         company = self.context.company
+        settings = self.request.registry.settings
+        if asbool(settings.get('billy.callback.deferred', False)):
+            return self._enqueue(company)
         processor = self.request.model_factory.create_processor()
         processor.configure_api_key(company.processor_key)
         update_db = processor.callback(company, self.request.json)
@@ -109,3 +131,25 @@ class CallbackView(BaseView):
                 update_db(self.request.model_factory)
             return dict(code='ok')
         return dict(code='ignore')
+
+    def _enqueue(self, company):
+        """Put the callback payload into the inbox, it will be verified and
+        applied later by the callback event consumer
+
+        """
+        payload = self.request.json
+        processor = self.request.model_factory.create_processor()
+        processor_id = processor.get_callback_event_id(payload)
+        model = self.request.model_factory.create_callback_event_model()
+        try:
+            with db_transaction.manager:
+                model.create(
+                    company=company,
+                    processor_id=processor_id,
+                    payload=payload,
+                )
+        # Notice: IntegrityError happens when the same event was received by
+        # another request concurrently
+        except (DuplicateCallbackEventError, IntegrityError):
+            return dict(code='duplicate')
+        return dict(code='queued')
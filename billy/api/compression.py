@@ -0,0 +1,114 @@
+from __future__ import unicode_literals
+import zlib
+
+from pyramid.settings import asbool
+
+#: supported content codings in order of preference, mapped to zlib wbits
+ENCODINGS = (
+    ('gzip', 16 + zlib.MAX_WBITS),
+    ('deflate', zlib.MAX_WBITS),
+)
+
+#: content types worth compressing
+COMPRESSIBLE_TYPES = (
+    'application/json',
+    'application/x-ndjson',
+    'text/',
+)
+
+
+def choose_encoding(accept_encoding):
+    """Choose a supported content coding from Accept-Encoding header value,
+    return (name, wbits) or None if none of them is acceptable
+
+    """
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for part in accept_encoding.split(','):
+        params = part.strip().split(';')
+        name = params[0].strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+    best = None
+    for name, wbits in ENCODINGS:
+        quality = qualities.get(name, qualities.get('*', 0.0))
+        if quality > 0 and (best is None or quality > best[0]):
+            best = (quality, name, wbits)
+    if best is None:
+        return None
+    return best[1], best[2]
+
+
+def iter_compressed(app_iter, level, wbits):
+    """Compress chunks of an app_iter, each chunk is flushed, so that
+    clients can start decoding a streaming response right away
+
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+    try:
+        for chunk in app_iter:
+            if not chunk:
+                continue
+            data = compressor.compress(chunk)
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            yield data
+        yield compressor.flush(zlib.Z_FINISH)
+    finally:
+        close = getattr(app_iter, 'close', None)
+        if close is not None:
+            close()
+
+
+def compression_tween_factory(handler, registry):
+    """Compress response bodies with gzip or deflate as the client accepts
+
+    """
+    def compression_tween(request):
+        response = handler(request)
+        settings = request.registry.settings
+        if not asbool(settings.get('api.compression.enabled', True)):
+            return response
+        content_type = response.content_type or ''
+        if (
+            request.method == 'HEAD' or
+            response.status_int in (204, 304) or
+            response.content_encoding or
+            not content_type.startswith(COMPRESSIBLE_TYPES)
+        ):
+            return response
+        response.vary = tuple(response.vary or ()) + ('Accept-Encoding', )
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+        name, wbits = encoding
+        level = int(settings.get('api.compression.level', 6))
+        min_size = int(settings.get('api.compression.min_size', 1024))
+
+        # Notice: streaming responses have no content length, they are
+        # compressed chunk by chunk as they are written
+        if response.content_length is None:
+            response.app_iter = iter_compressed(
+                response.app_iter,
+                level,
+                wbits,
+            )
+            response.content_encoding = name
+            return response
+        if response.content_length < min_size:
+            return response
+        compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+        body = compressor.compress(response.body) + compressor.flush()
+        response.body = body
+        response.content_encoding = name
+        return response
+    return compression_tween
@@ -11,6 +11,14 @@ from billy.models.subscription import SubscriptionModel
 from billy.models.transaction import TransactionModel
 from billy.api.utils import validate_form
 from billy.api.utils import list_by_context
+from billy.api.bulk import parse_bulk_items
+from billy.api.bulk import validate_item
+from billy.api.bulk import created_result
+from billy.api.bulk import error_result
+from billy.api.bulk import exception_result
+from billy.api.bulk import call_concurrently
+from billy.api.bulk import iter_chunks
+from billy.api.bulk import fail_chunk
 from billy.api.resources import IndexResource
 from billy.api.resources import EntityResource
 from billy.api.views import IndexView
@@ -29,6 +37,7 @@ class CustomerIndexResource(IndexResource):
     MODEL_CLS = CustomerModel
     ENTITY_NAME = 'customer'
     ENTITY_RESOURCE = CustomerResource
+    VIEW_NAMES = ('bulk', )
 
 
 @api_view_defaults(context=CustomerIndexResource)
@@ -55,16 +64,93 @@ class CustomerIndexView(IndexView):
             customer = model.create(
                 processor_uri=processor_uri,
                 company=company,
+                pending=True,
             )
+            guid = customer.guid
+            provision = model.prepare_provision(customer)
+        # Notice: we talk to the processor out of the database transaction,
+        # so that we won't hold a DB connection and locks during the round trip
+        try:
+            update_db = provision()
+        except Exception:
+            with db_transaction.manager:
+                model.discard_pending(guid)
+            raise
+        with db_transaction.manager:
+            customer = update_db(request.model_factory)
         return customer
 
+    @view_config(name='bulk', request_method='POST', permission='create')
+    def bulk(self):
+        """Create customers in bulk and return result of each item
+
+        """
+        request = self.request
+        company = authenticated_userid(request)
+        items = parse_bulk_items(request)
+        model = request.model_factory.create_customer_model()
+
+        results = [None] * len(items)
+        valid_items = []
+        for index, item in enumerate(items):
+            form, error = validate_item(CustomerCreateForm, request, item)
+            if error is not None:
+                results[index] = error_result(index, 'ValidationError', error)
+                continue
+            valid_items.append((index, form.data.get('processor_uri')))
+
+        for chunk in iter_chunks(request, valid_items):
+            pending = []
+            created = []
+            try:
+                with db_transaction.manager:
+                    for index, processor_uri in chunk:
+                        customer = model.create(
+                            processor_uri=processor_uri,
+                            company=company,
+                            pending=True,
+                        )
+                        provision = model.prepare_provision(customer)
+                        pending.append((index, customer.guid, provision))
+                # Notice: provision customers in the processor concurrently,
+                # out of the database transaction
+                outcomes = call_concurrently(
+                    request,
+                    [item[2] for item in pending],
+                )
+                with db_transaction.manager:
+                    for (index, guid, _), (update_db, error) in zip(
+                        pending,
+                        outcomes,
+                    ):
+                        if error is not None:
+                            model.discard_pending(guid)
+                            results[index] = exception_result(index, error)
+                            continue
+                        update_db(request.model_factory)
+                        created.append((index, guid))
+            except Exception, e:
+                # customers left in pending state are given up by
+                # process_billy_tx later
+                fail_chunk(
+                    model.session,
+                    results,
+                    [item[0] for item in chunk],
+                    e,
+                )
+                continue
+            # only created once the chunk is committed
+            for index, guid in created:
+                results[index] = created_result(index, guid)
+        return dict(items=results)
+
 
 @api_view_defaults(context=CustomerResource)
 class CustomerView(EntityView):
 
     @view_config(request_method='GET')
     def get(self):
-        return self.context.entity
+        return self.conditional_get()
 
     @view_config(request_method='DELETE')
     def delete(self):
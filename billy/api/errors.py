@@ -5,6 +5,7 @@ from pyramid.renderers import render_to_response
 from pyramid.security import NO_PERMISSION_REQUIRED
 
 from billy.errors import BillyError
+from billy.models.base import InvalidCursorError
 from billy.models.subscription import SubscriptionCanceledError
 from billy.models.invoice import InvalidOperationError
 from billy.models.invoice import DuplicateExternalIDError
@@ -18,6 +19,7 @@ ERROR_STATUS_MAP = {
     InvalidOperationError: 400,
     DuplicateExternalIDError: 409,
     InvalidURIFormat: 400,
+    InvalidCursorError: 400,
 }
 
 
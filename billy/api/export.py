@@ -0,0 +1,139 @@
+from __future__ import unicode_literals
+import io
+import csv
+import json
+import datetime
+import collections
+
+import iso8601
+from pyramid.httpexceptions import HTTPBadRequest
+
+from billy.db.enum import EnumSymbol
+from billy.renderers import enum_symbol
+
+#: content types of supported export formats
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def parse_export_params(request):
+    """Parse and return (format, since, until) export parameters from the
+    request, since and until are ISO8601 datetime bounds of created_at
+
+    """
+    export_format = request.params.get('format', 'csv')
+    if export_format not in EXPORT_CONTENT_TYPES:
+        raise HTTPBadRequest(
+            'Invalid format {}, should be one of {}'
+            .format(export_format, sorted(EXPORT_CONTENT_TYPES))
+        )
+    bounds = []
+    for key in ['since', 'until']:
+        value = request.params.get(key)
+        if value:
+            try:
+                value = iso8601.parse_date(value)
+            except (iso8601.ParseError, TypeError, ValueError):
+                raise HTTPBadRequest(
+                    'Invalid ISO8601 datetime {} {}'.format(key, value)
+                )
+        else:
+            value = None
+        bounds.append(value)
+    since, until = bounds
+    return export_format, since, until
+
+
+def format_value(value):
+    """Format a value of exported row as a JSON compatible value
+
+    """
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, EnumSymbol):
+        return enum_symbol(value)
+    return value
+
+
+def iter_row_chunks(engine, query, chunk_size):
+    """Execute the query in a connection of its own with a server-side cursor
+    if the database supports it, and yield rows chunk by chunk
+
+    """
+    connection = engine.connect()
+    try:
+        trans = connection.begin()
+        try:
+            result = (
+                connection
+                .execution_options(stream_results=True)
+                .execute(query)
+            )
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            trans.rollback()
+    finally:
+        connection.close()
+
+
+def iter_csv(keys, chunks):
+    def encode(value):
+        value = format_value(value)
+        if value is None:
+            return b''
+        return unicode(value).encode('utf8')
+
+    def dump(rows):
+        output = io.BytesIO()
+        writer = csv.writer(output)
+        for row in rows:
+            writer.writerow(map(encode, row))
+        return output.getvalue()
+
+    yield dump([keys])
+    for rows in chunks:
+        yield dump(rows)
+
+
+def iter_jsonl(keys, chunks):
+    for rows in chunks:
+        lines = []
+        for row in rows:
+            record = collections.OrderedDict(
+                (key, format_value(value)) for key, value in zip(keys, row)
+            )
+            lines.append(json.dumps(record) + '\n')
+        yield ''.join(lines).encode('utf8')
+
+
+def export_response(request, query, export_format, name):
+    """Set the response to stream rows of the query in given format and
+    return it
+
+    """
+    settings = request.registry.settings
+    chunk_size = int(settings.get('billy.export.chunk_size', 1000))
+    engine = settings['engine']
+    # exports are read-only reports, run them on the replica if there is one
+    replica = settings.get('replica')
+    if replica is not None and replica.usable():
+        engine = replica.engine
+    keys = [column.key for column in query.columns]
+
+    response = request.response
+    response.content_type = EXPORT_CONTENT_TYPES[export_format]
+    response.content_disposition = (
+        'attachment; filename="{}.{}"'.format(name, export_format)
+    )
+    chunks = iter_row_chunks(engine, query, chunk_size)
+    if export_format == 'csv':
+        response.app_iter = iter_csv(keys, chunks)
+    else:
+        response.app_iter = iter_jsonl(keys, chunks)
+    return response
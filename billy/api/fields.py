@@ -0,0 +1,131 @@
+from __future__ import unicode_literals
+
+from pyramid.httpexceptions import HTTPBadRequest
+
+from billy.db import tables
+
+#: relationships can be expanded in responses with `expand` parameter, maps
+#  names to relationship paths to be loaded in a batch for list responses
+EXPANSIONS = {
+    tables.Invoice: dict(
+        transactions=('transactions', 'transactions.failures'),
+    ),
+    tables.Subscription: dict(
+        customer=('customer', ),
+        # plan is joined-loaded by the list query already
+        plan=(),
+    ),
+}
+
+#: response fields rendered from relationships loaded by list queries, a
+#  relationship is not loaded if none of its fields is asked for
+RELATIONSHIP_FIELDS = dict(
+    items=('items', ),
+    adjustments=('adjustments', ),
+    failures=('failures', 'failure_count'),
+)
+
+
+def _split_param(request, key):
+    value = request.params.get(key)
+    if value is None:
+        return None
+    return frozenset(
+        name.strip() for name in value.split(',') if name.strip()
+    )
+
+
+def get_response_shape(request):
+    """Parse `fields` and `expand` parameters of the request and return
+    (fields, expand), fields is None if all fields are asked for
+
+    """
+    shape = getattr(request, '_response_shape', None)
+    if shape is None:
+        fields = _split_param(request, 'fields')
+        expand = _split_param(request, 'expand') or frozenset()
+        shape = (fields, expand)
+        request._response_shape = shape
+    return shape
+
+
+def wants_field(request, name):
+    """Return whether given field is asked for in the response
+
+    """
+    fields, _ = get_response_shape(request)
+    return fields is None or name in fields
+
+
+def expansions_of(record_or_table):
+    """Return expandable relationships of a record or a table
+
+    """
+    for table, expansions in EXPANSIONS.iteritems():
+        if (
+            record_or_table is table or
+            isinstance(record_or_table, table) or
+            (
+                isinstance(record_or_table, type) and
+                issubclass(record_or_table, table)
+            )
+        ):
+            return expansions
+    return {}
+
+
+def check_expand(request, table):
+    """Raise HTTPBadRequest if any relationship in `expand` parameter cannot
+    be expanded for the table, otherwise return the expand names
+
+    """
+    _, expand = get_response_shape(request)
+    expansions = expansions_of(table)
+    invalid = sorted(name for name in expand if name not in expansions)
+    if invalid:
+        raise HTTPBadRequest(
+            'Cannot expand {}, should be in {}'
+            .format(', '.join(invalid), sorted(expansions))
+        )
+    return expand
+
+
+def list_relationships(request, model):
+    """Return relationship paths to be loaded in a batch by list query of
+    the model according to `fields` and `expand` parameters, or None if the
+    model loads no relationship
+
+    """
+    expand = check_expand(request, model.TABLE)
+    expansions = expansions_of(model.TABLE)
+    if not model.LIST_RELATIONSHIPS and not expansions:
+        return None
+    paths = []
+    for name in model.LIST_RELATIONSHIPS:
+        field_names = RELATIONSHIP_FIELDS.get(name, (name, ))
+        if any(wants_field(request, field) for field in field_names):
+            paths.append(name)
+    for name in sorted(expand):
+        paths.extend(expansions[name])
+    return paths
+
+
+def related_records(record, request):
+    """Return records of the expanded relationships of a record, for making
+    ETag of the response
+
+    """
+    _, expand = get_response_shape(request)
+    expansions = expansions_of(record)
+    records = []
+    for name in sorted(expand):
+        if name not in expansions:
+            continue
+        related = getattr(record, name)
+        if related is None:
+            continue
+        if isinstance(related, list):
+            records.extend(related)
+        else:
+            records.append(related)
+    return records
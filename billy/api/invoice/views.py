@@ -1,4 +1,5 @@
 from __future__ import unicode_literals
+import re
 
 import transaction as db_transaction
 from pyramid.view import view_config
@@ -7,9 +8,23 @@ from pyramid.httpexceptions import HTTPForbidden
 from pyramid.httpexceptions import HTTPBadRequest
 
 from billy.models.invoice import InvoiceModel
+from billy.models.invoice import DuplicateExternalIDError
 from billy.models.transaction import TransactionModel
 from billy.api.utils import validate_form
+from billy.api.utils import json_formdata
 from billy.api.utils import list_by_context
+from billy.api.utils import submit_transactions
+from billy.api.export import parse_export_params
+from billy.api.export import export_response
+from billy.api.bulk import parse_bulk_items
+from billy.api.bulk import validate_item
+from billy.api.bulk import created_result
+from billy.api.bulk import error_result
+from billy.api.bulk import exception_result
+from billy.api.bulk import validate_funding_instruments
+from billy.api.bulk import iter_chunks
+from billy.api.bulk import fail_chunk
+from billy.api.bulk import submit_in_chunks
 from billy.api.resources import IndexResource
 from billy.api.resources import EntityResource
 from billy.api.views import IndexView
@@ -38,38 +53,131 @@ def parse_items(request, prefix, keywords):
     ]
 
     """
-    # TODO: humm.. maybe it is not the best method to deals with multiple
-    # value parameters, but here we just make it works and make it better
-    # later
     # TODO: what about format checking? length limitation? is amount integer?
+    pattern = re.compile(r'^{}({})(\d+)$'.format(
+        re.escape(prefix),
+        '|'.join(re.escape(keyword) for keyword in keywords),
+    ))
     items = {}
-    for key in request.params:
-        for keyword in keywords:
-            prefixed_keyword = prefix + keyword
-            suffix = key[len(prefixed_keyword):]
-            if not key.startswith(prefixed_keyword):
-                continue
-            try:
-                item_num = int(suffix)
-            except ValueError:
-                continue
-            item = items.setdefault(item_num, {})
-            item[keyword] = request.params[key]
-    keys = list(items)
-    keys = sorted(keys)
-    return [items[key] for key in keys]
+    for key, value in request.params.items():
+        match = pattern.match(key)
+        if match is None:
+            continue
+        keyword, item_num = match.groups()
+        items.setdefault(int(item_num), {})[keyword] = value
+    return [items[key] for key in sorted(items)]
+
+
+ITEM_KEYWORDS = ('type', 'name', 'volume', 'amount', 'unit', 'quantity')
+ITEM_INTEGERS = ('amount', 'quantity', 'volume')
+ADJUSTMENT_KEYWORDS = ('amount', 'reason')
+ADJUSTMENT_INTEGERS = ('amount', )
+
+
+def clean_integer(keyword, value):
+    """Convert value given as an integer in JSON or a string in form to an
+    integer, raise ValueError if it is not one
+
+    """
+    integer_types = (int, long, basestring)
+    if isinstance(value, bool) or not isinstance(value, integer_types):
+        raise ValueError('{} should be an integer'.format(keyword))
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError('{} should be an integer'.format(keyword))
+
+
+def clean_entries(entries, keywords, required, integers=()):
+    """Clean items or adjustments given as a list of objects, raise
+    ValueError if they are invalid
+
+    """
+    if not entries:
+        return None
+    if not isinstance(entries, list):
+        raise ValueError('Expected a list of objects')
+    cleaned = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            raise ValueError('Expected a list of objects')
+        for keyword in required:
+            if entry.get(keyword) is None:
+                raise ValueError('{} is required'.format(keyword))
+        entry = dict(
+            (keyword, entry[keyword]) for keyword in keywords
+            if entry.get(keyword) is not None
+        )
+        for keyword in integers:
+            if keyword in entry:
+                entry[keyword] = clean_integer(keyword, entry[keyword])
+        cleaned.append(entry)
+    return cleaned
+
+
+def clean_items_and_adjustments(items, adjustments):
+    """Clean items and adjustments of an invoice, return them as a tuple,
+    raise ValueError if they are invalid
+
+    """
+    return (
+        clean_entries(
+            items,
+            keywords=ITEM_KEYWORDS,
+            required=('name', 'amount'),
+            integers=ITEM_INTEGERS,
+        ),
+        clean_entries(
+            adjustments,
+            keywords=ADJUSTMENT_KEYWORDS,
+            required=('amount', ),
+            integers=ADJUSTMENT_INTEGERS,
+        ),
+    )
+
+
+def invoice_create_kwargs(form):
+    """Get keyword arguments for creating an invoice from a validated form
+
+    """
+    kwargs = dict(amount=form.data['amount'])
+    for key in [
+        'funding_instrument_uri',
+        'title',
+        'external_id',
+        'appears_on_statement_as',
+    ]:
+        kwargs[key] = form.data.get(key) or None
+    return kwargs
+
+
+def check_customer(company, customer):
+    """Return an error response if the company cannot create invoices for
+    the customer, otherwise None
+
+    """
+    if customer.company_guid != company.guid:
+        return HTTPForbidden('Can only create an invoice for your own customer')
+    if customer.deleted:
+        return HTTPBadRequest('Cannot create an invoice for a deleted customer')
+    if customer.pending:
+        return HTTPBadRequest(
+            'Cannot create an invoice for a customer still being provisioned'
+        )
+    return None
 
 
 class InvoiceResource(EntityResource):
     @property
     def company(self):
-        return self.entity.customer.company
+        return self.entity.company
 
 
 class InvoiceIndexResource(IndexResource):
     MODEL_CLS = InvoiceModel
     ENTITY_NAME = 'invoice'
     ENTITY_RESOURCE = InvoiceResource
+    VIEW_NAMES = ('bulk', 'export')
 
 
 @api_view_defaults(context=InvoiceIndexResource)
@@ -81,51 +189,84 @@ class InvoiceIndexView(IndexView):
         company = authenticated_userid(request)
         return list_by_context(request, InvoiceModel, company)
 
+    @view_config(name='export', request_method='GET', permission='view')
+    def export(self):
+        """Export all invoices created in given range as CSV or JSON lines
+
+        """
+        request = self.request
+        company = authenticated_userid(request)
+        export_format, since, until = parse_export_params(request)
+        model = request.model_factory.create_invoice_model()
+        query = model.export_query(
+            company_guid=company.guid,
+            since=since,
+            until=until,
+        )
+        return export_response(request, query, export_format, 'invoices')
+
+    def _parse_json_body(self):
+        """Parse invoice creation parameters from a JSON object body, return
+        validated form, items and adjustments
+
+        """
+        request = self.request
+        try:
+            body = request.json_body
+        except ValueError:
+            raise HTTPBadRequest('Body should be a JSON object')
+        if not isinstance(body, dict):
+            raise HTTPBadRequest('Body should be a JSON object')
+        form = validate_form(
+            InvoiceCreateForm,
+            request,
+            formdata=json_formdata(body),
+        )
+        try:
+            items, adjustments = clean_items_and_adjustments(
+                body.get('items'),
+                body.get('adjustments'),
+            )
+        except ValueError, e:
+            raise HTTPBadRequest(unicode(e))
+        return form, items, adjustments
+
     @view_config(request_method='POST', permission='create')
     def post(self):
         request = self.request
 
-        form = validate_form(InvoiceCreateForm, request)
+        if request.content_type == 'application/json':
+            form, items, adjustments = self._parse_json_body()
+        else:
+            form = validate_form(InvoiceCreateForm, request)
+            try:
+                items, adjustments = clean_items_and_adjustments(
+                    parse_items(
+                        request=request,
+                        prefix='item_',
+                        keywords=ITEM_KEYWORDS,
+                    ),
+                    parse_items(
+                        request=request,
+                        prefix='adjustment_',
+                        keywords=ADJUSTMENT_KEYWORDS,
+                    ),
+                )
+            except ValueError, e:
+                raise HTTPBadRequest(unicode(e))
         model = request.model_factory.create_invoice_model()
         customer_model = request.model_factory.create_customer_model()
-        tx_model = request.model_factory.create_transaction_model()
         company = authenticated_userid(request)
-       
+
         customer_guid = form.data['customer_guid']
-        amount = form.data['amount']
-        funding_instrument_uri = form.data.get('funding_instrument_uri')
-        if not funding_instrument_uri:
-            funding_instrument_uri = None
-        title = form.data.get('title')
-        if not title:
-            title = None
-        external_id = form.data.get('external_id')
-        if not external_id:
-            external_id = None
-        appears_on_statement_as = form.data.get('appears_on_statement_as')
-        if not appears_on_statement_as:
-            appears_on_statement_as = None
-        items = parse_items(
-            request=request,
-            prefix='item_',
-            keywords=('type', 'name', 'volume', 'amount', 'unit', 'quantity'),
-        )
-        if not items:
-            items = None
-        adjustments = parse_items(
-            request=request,
-            prefix='adjustment_',
-            keywords=('amount', 'reason'),
-        )
-        if not adjustments:
-            adjustments = None
+        kwargs = invoice_create_kwargs(form)
+        funding_instrument_uri = kwargs['funding_instrument_uri']
         # TODO: what about negative effective amount?
 
-        customer = customer_model.get(customer_guid)
-        if customer.company != company:
-            return HTTPForbidden('Can only create an invoice for your own customer')
-        if customer.deleted:
-            return HTTPBadRequest('Cannot create an invoice for a deleted customer')
+        customer = customer_model.get_cached(customer_guid)
+        error = check_customer(company, customer)
+        if error is not None:
+            return error
        
         # Notice: I think it is better to validate the funding instrument URI
         # even before the record is created. Otherwse, the user can only knows
@@ -141,29 +282,129 @@ class InvoiceIndexView(IndexView):
         with db_transaction.manager:
             invoice = model.create(
                 customer=customer,
-                amount=amount,
-                funding_instrument_uri=funding_instrument_uri,
-                title=title,
                 items=items,
                 adjustments=adjustments,
-                external_id=external_id,
-                appears_on_statement_as=appears_on_statement_as,
+                **kwargs
             )
         # funding_instrument_uri is set, just process all transactions right away
         if funding_instrument_uri is not None:
-            transactions = list(invoice.transactions)
-            if transactions:
-                with db_transaction.manager:
-                    tx_model.process_transactions(transactions)
+            submit_transactions(request, invoice.transactions)
         return invoice
 
+    @view_config(name='bulk', request_method='POST', permission='create')
+    def bulk(self):
+        """Create invoices in bulk and return result of each item
+
+        """
+        request = self.request
+        company = authenticated_userid(request)
+        items = parse_bulk_items(request)
+        model = request.model_factory.create_invoice_model()
+        customer_model = request.model_factory.create_customer_model()
+
+        # load all customers at once for the validators and this view
+        customer_model.prefetch(item.get('customer_guid') for item in items)
+
+        results = [None] * len(items)
+        valid_items = []
+        # items are fully validated and converted one by one here, so that
+        # a malformed item gets its own error instead of failing the chunk
+        # it would be inserted with
+        for index, item in enumerate(items):
+            form, error = validate_item(InvoiceCreateForm, request, item)
+            if error is None:
+                try:
+                    invoice_items, adjustments = clean_items_and_adjustments(
+                        item.get('items'),
+                        item.get('adjustments'),
+                    )
+                except ValueError, e:
+                    error = unicode(e)
+            if error is not None:
+                results[index] = error_result(index, 'ValidationError', error)
+                continue
+            customer = customer_model.get_cached(form.data['customer_guid'])
+            http_error = check_customer(company, customer)
+            if http_error is not None:
+                results[index] = exception_result(index, http_error)
+                continue
+            kwargs = invoice_create_kwargs(form)
+            kwargs.update(items=invoice_items, adjustments=adjustments)
+            valid_items.append((index, customer, kwargs))
+
+        # reject duplicate external IDs before inserting anything, so that
+        # one duplicate won't fail a whole chunk
+        existing = model.list_existing_external_ids(
+            customer_guids=[item[1].guid for item in valid_items],
+            external_ids=[item[2]['external_id'] for item in valid_items
+                          if item[2]['external_id'] is not None],
+        )
+        unique_items = []
+        for index, customer, kwargs in valid_items:
+            if kwargs['external_id'] is not None:
+                key = (customer.guid, kwargs['external_id'])
+                if key in existing:
+                    results[index] = exception_result(
+                        index,
+                        DuplicateExternalIDError(
+                            'Invoice {} with external_id {} already exists'
+                            .format(customer.guid, kwargs['external_id'])
+                        ),
+                    )
+                    continue
+                existing.add(key)
+            unique_items.append((index, customer, kwargs))
+
+        uri_errors = validate_funding_instruments(
+            request,
+            company,
+            [item[2]['funding_instrument_uri'] for item in unique_items],
+        )
+
+        transactions = []
+        for chunk in iter_chunks(request, unique_items):
+            created = []
+            chunk_transactions = []
+            try:
+                with db_transaction.manager:
+                    for index, customer, kwargs in chunk:
+                        uri = kwargs['funding_instrument_uri']
+                        if uri in uri_errors:
+                            results[index] = exception_result(
+                                index,
+                                uri_errors[uri],
+                            )
+                            continue
+                        invoice = model.create(customer=customer, **kwargs)
+                        created.append((index, invoice.guid))
+                        if uri is not None:
+                            chunk_transactions.extend(invoice.transactions)
+            except Exception, e:
+                # the whole chunk is rolled back, e.g. someone else created
+                # the same external ID in the meantime
+                fail_chunk(
+                    model.session,
+                    results,
+                    [item[0] for item in chunk],
+                    e,
+                )
+                continue
+            # only created once the chunk is committed
+            for index, guid in created:
+                results[index] = created_result(index, guid)
+            transactions.extend(chunk_transactions)
+
+        # funding_instrument_uri is set, just process all transactions right away
+        submit_in_chunks(request, transactions)
+        return dict(items=results)
+
 
 @api_view_defaults(context=InvoiceResource)
 class InvoiceView(EntityView):
 
     @view_config(request_method='GET')
     def get(self):
-        return self.context.entity
+        return self.conditional_get()
 
     @view_config(request_method='PUT')
     def put(self):
@@ -172,7 +413,6 @@ class InvoiceView(EntityView):
         invoice = self.context.entity
         form = validate_form(InvoiceUpdateForm, request)
         model = request.model_factory.create_invoice_model()
-        tx_model = request.model_factory.create_transaction_model()
 
         funding_instrument_uri = form.data.get('funding_instrument_uri')
        
@@ -183,9 +423,8 @@ class InvoiceView(EntityView):
             )
 
         # funding_instrument_uri is set, just process all transactions right away
-        if funding_instrument_uri and transactions:
-            with db_transaction.manager:
-                tx_model.process_transactions(transactions)
+        if funding_instrument_uri:
+            submit_transactions(request, transactions)
 
         return invoice
 
@@ -198,7 +437,6 @@ class InvoiceView(EntityView):
         invoice = self.context.entity
         form = validate_form(InvoiceRefundForm, request)
         invoice_model = request.model_factory.create_invoice_model()
-        tx_model = request.model_factory.create_transaction_model()
 
         amount = form.data['amount']
 
@@ -208,10 +446,7 @@ class InvoiceView(EntityView):
                 amount=amount,
             )
 
-        # funding_instrument_uri is set, just process all transactions right away
-        if transactions:
-            with db_transaction.manager:
-                tx_model.process_transactions(transactions)
+        submit_transactions(request, transactions)
         return invoice
 
     @view_config(name='cancel', request_method='POST')
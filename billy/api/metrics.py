@@ -0,0 +1,76 @@
+from __future__ import unicode_literals
+import time
+
+from pyramid.view import view_config
+from pyramid.settings import asbool
+from pyramid.security import NO_PERMISSION_REQUIRED
+from pyramid.httpexceptions import HTTPNotFound
+
+from billy.metrics import REGISTRY
+from billy.metrics import REQUEST_DURATION
+from billy.metrics import collect_backlog
+from billy.metrics import collect_pool_stats
+
+#: content type of Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+def view_label(request):
+    """Name the view handled the request for labelling metrics, it's the
+    route name for views of routes, otherwise the context resource class
+    name with the view name
+
+    """
+    route = getattr(request, 'matched_route', None)
+    if route is not None:
+        return route.name
+    context = getattr(request, 'context', None)
+    if context is None:
+        return 'unknown'
+    view = type(context).__name__
+    if getattr(request, 'view_name', None):
+        view = '{}.{}'.format(view, request.view_name)
+    return view
+
+
+def metrics_tween_factory(handler, registry):
+    """Observe latency of requests by view and method
+
+    """
+    def metrics_tween(request):
+        start = time.time()
+        try:
+            return handler(request)
+        finally:
+            REQUEST_DURATION.observe(
+                time.time() - start,
+                view=view_label(request),
+                method=request.method,
+            )
+    return metrics_tween
+
+
+@view_config(
+    route_name='metrics',
+    request_method='GET',
+    permission=NO_PERMISSION_REQUIRED,
+)
+def metrics(request):
+    """Expose metrics in Prometheus text format, the endpoint requires no
+    authentication, so it is not found unless `billy.metrics.enabled` is set
+
+    """
+    settings = request.registry.settings
+    if not asbool(settings.get('billy.metrics.enabled', False)):
+        raise HTTPNotFound()
+    # counting the backlog groups all transactions, do it at most once in
+    # the ttl rather than for every scrape
+    backlog_cache = settings['metrics_backlog_cache']
+    if backlog_cache.get('backlog') is None:
+        collect_backlog(request.model_factory.create_transaction_model())
+        backlog_cache.set('backlog', True)
+    collect_pool_stats(settings.get('pool_stats', {}))
+    response = request.response
+    response.content_type = CONTENT_TYPE
+    response.text = REGISTRY.render()
+    return response
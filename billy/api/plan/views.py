@@ -73,7 +73,7 @@ class PlanView(EntityView):
 
     @view_config(request_method='GET')
     def get(self):
-        return self.context.entity
+        return self.conditional_get()
 
     @view_config(request_method='DELETE')
     def delete(self):
@@ -0,0 +1,57 @@
+from __future__ import unicode_literals
+import logging
+
+from pyramid.settings import asbool
+
+from billy.models.query_stats import record_queries
+from billy.models.query_stats import log_query_stats
+from billy.models.query_stats import query_thresholds
+
+
+def view_description(request):
+    """Describe the request and the view which handled it for logging
+
+    """
+    context = getattr(request, 'context', None)
+    view = type(context).__name__ if context is not None else None
+    if getattr(request, 'view_name', None):
+        view = '{}.{}'.format(view, request.view_name)
+    return '{} {} ({})'.format(request.method, request.path, view)
+
+
+def query_stats_tween_factory(handler, registry):
+    """Count SQL statements and total database time of each request, add
+    them to response headers if enabled, and log requests exceed the
+    thresholds with their statements
+
+    Notice: statements executed while streaming the response body after
+    the view returns are not counted
+
+    """
+    logger = logging.getLogger(__name__)
+
+    def query_stats_tween(request):
+        settings = request.registry.settings
+        if not asbool(settings.get('billy.query_stats.enabled', False)):
+            return handler(request)
+        with record_queries() as stats:
+            response = handler(request)
+        if asbool(settings.get('billy.query_stats.headers', False)):
+            response.headers[b'X-Billy-Query-Count'] = str(stats.count)
+            response.headers[b'X-Billy-DB-Time'] = (
+                str('{:.3f}'.format(stats.seconds * 1000))
+            )
+        max_count, max_seconds = query_thresholds(
+            settings,
+            'billy.query_stats.',
+        )
+        if stats.exceeds(max_count, max_seconds):
+            log_query_stats(
+                logger,
+                view_description(request),
+                stats,
+                max_count,
+                max_seconds,
+            )
+        return response
+    return query_stats_tween
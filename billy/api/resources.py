@@ -31,6 +31,9 @@ class IndexResource(BaseResource):
     #: entity resource
     ENTITY_RESOURCE = None
 
+    #: names of views on the index, they are not looked up as entities
+    VIEW_NAMES = ()
+
     def __init__(self, request, parent=None, name=None):
         super(IndexResource, self).__init__(request, parent, name)
         assert self.MODEL_CLS is not None
@@ -38,20 +41,31 @@ class IndexResource(BaseResource):
         assert self.ENTITY_RESOURCE is not None
 
     def __getitem__(self, key):
+        # Notice: raising KeyError tells traversal the key is a view name
+        if key in self.VIEW_NAMES:
+            raise KeyError(key)
         model = self.MODEL_CLS(self.request.model_factory)
-        entity = model.get(key)
-        if entity is None:
+        # Notice: records on the path to the company are loaded in the same
+        # query, so that building the ACL costs no extra query
+        entity = model.get_joined(key, self.ENTITY_RESOURCE.COMPANY_PATH)
+        # records left pending by a crashed provisioning are not visible,
+        # the reconciler will mark them as deleted later
+        if entity is None or getattr(entity, 'pending', False):
             raise HTTPNotFound('No such {} {}'.format(self.ENTITY_NAME, key))
         return self.ENTITY_RESOURCE(self.request, entity, parent=self, name=key)
 
 
 class EntityResource(BaseResource):
 
+    #: relationships from the entity to the record with company_guid column
+    #  of the owner company, they are joined when loading the entity
+    COMPANY_PATH = ()
+
     def __init__(self, request, entity, parent=None, name=None):
         super(EntityResource, self).__init__(request, parent, name)
         self.entity = entity
         # make sure only the owner company can access the entity
-        company_principal = 'company:{}'.format(self.company.guid)
+        company_principal = 'company:{}'.format(self.company_guid)
         self.__acl__ = [
             #       principal, action
             (Allow, company_principal, 'view'),
@@ -65,6 +79,13 @@ class EntityResource(BaseResource):
     def company(self):
         raise NotImplemented()
 
+    @property
+    def company_guid(self):
+        record = self.entity
+        for name in self.COMPANY_PATH:
+            record = getattr(record, name)
+        return record.company_guid
+
 
 class URLMapResource(BaseResource):
 
@@ -11,6 +11,16 @@ from billy.models.invoice import InvoiceModel
 from billy.models.transaction import TransactionModel
 from billy.api.utils import validate_form
 from billy.api.utils import list_by_context
+from billy.api.utils import submit_transactions
+from billy.api.bulk import parse_bulk_items
+from billy.api.bulk import validate_item
+from billy.api.bulk import created_result
+from billy.api.bulk import error_result
+from billy.api.bulk import exception_result
+from billy.api.bulk import validate_funding_instruments
+from billy.api.bulk import iter_chunks
+from billy.api.bulk import fail_chunk
+from billy.api.bulk import submit_in_chunks
 from billy.api.resources import IndexResource
 from billy.api.resources import EntityResource
 from billy.api.views import IndexView
@@ -19,7 +29,44 @@ from billy.api.views import api_view_defaults
 from .forms import SubscriptionCreateForm
 
 
+def subscription_create_kwargs(form):
+    """Get keyword arguments for creating a subscription from a validated
+    form
+
+    """
+    return dict(
+        amount=form.data.get('amount'),
+        funding_instrument_uri=form.data.get('funding_instrument_uri') or None,
+        appears_on_statement_as=(
+            form.data.get('appears_on_statement_as') or None
+        ),
+        started_at=form.data.get('started_at'),
+    )
+
+
+def check_customer_and_plan(company, customer, plan):
+    """Return an error response if the company cannot subscribe the customer
+    to the plan, otherwise None
+
+    """
+    if customer.company_guid != company.guid:
+        return HTTPForbidden('Can only subscribe to your own customer')
+    if customer.deleted:
+        return HTTPBadRequest('Cannot subscript to a deleted customer')
+    if customer.pending:
+        return HTTPBadRequest(
+            'Cannot subscript to a customer still being provisioned'
+        )
+    if plan.company_guid != company.guid:
+        return HTTPForbidden('Can only subscribe to your own plan')
+    if plan.deleted:
+        return HTTPBadRequest('Cannot subscript to a deleted plan')
+    return None
+
+
 class SubscriptionResource(EntityResource):
+    COMPANY_PATH = ('plan', )
+
     @property
     def company(self):
         return self.entity.plan.company
@@ -29,6 +76,7 @@ class SubscriptionIndexResource(IndexResource):
     MODEL_CLS = SubscriptionModel
     ENTITY_NAME = 'subscription'
     ENTITY_RESOURCE = SubscriptionResource
+    VIEW_NAMES = ('bulk', )
 
 
 @api_view_defaults(context=SubscriptionIndexResource)
@@ -49,30 +97,19 @@ class SubscriptionIndexView(IndexView):
 
         customer_guid = form.data['customer_guid']
         plan_guid = form.data['plan_guid']
-        amount = form.data.get('amount')
-        funding_instrument_uri = form.data.get('funding_instrument_uri')
-        if not funding_instrument_uri:
-            funding_instrument_uri = None
-        appears_on_statement_as = form.data.get('appears_on_statement_as')
-        if not appears_on_statement_as:
-            appears_on_statement_as = None
-        started_at = form.data.get('started_at')
+        kwargs = subscription_create_kwargs(form)
+        funding_instrument_uri = kwargs['funding_instrument_uri']
+        started_at = kwargs['started_at']
 
         sub_model = request.model_factory.create_subscription_model()
         plan_model = request.model_factory.create_plan_model()
         customer_model = request.model_factory.create_customer_model()
-        tx_model = request.model_factory.create_transaction_model()
-
-        customer = customer_model.get(customer_guid)
-        if customer.company_guid != company.guid:
-            return HTTPForbidden('Can only subscribe to your own customer')
-        if customer.deleted:
-            return HTTPBadRequest('Cannot subscript to a deleted customer')
-        plan = plan_model.get(plan_guid)
-        if plan.company_guid != company.guid:
-            return HTTPForbidden('Can only subscribe to your own plan')
-        if plan.deleted:
-            return HTTPBadRequest('Cannot subscript to a deleted plan')
+
+        customer = customer_model.get_cached(customer_guid)
+        plan = plan_model.get_cached(plan_guid)
+        error = check_customer_and_plan(company, customer, plan)
+        if error is not None:
+            return error
 
         if funding_instrument_uri is not None:
             processor = request.model_factory.create_processor()
@@ -84,26 +121,103 @@ class SubscriptionIndexView(IndexView):
             subscription = sub_model.create(
                 customer=customer,
                 plan=plan,
-                amount=amount,
-                funding_instrument_uri=funding_instrument_uri,
-                appears_on_statement_as=appears_on_statement_as,
-                started_at=started_at,
+                **kwargs
             )
             invoices = subscription.invoices
         # this is not a deferred subscription, just process transactions right away
         if started_at is None:
-            with db_transaction.manager:
-                tx_model.process_transactions(invoices[0].transactions)
+            submit_transactions(request, invoices[0].transactions)
 
         return subscription
 
+    @view_config(name='bulk', request_method='POST', permission='create')
+    def bulk(self):
+        """Create subscriptions in bulk and return result of each item
+
+        """
+        request = self.request
+        company = authenticated_userid(request)
+        items = parse_bulk_items(request)
+        sub_model = request.model_factory.create_subscription_model()
+        plan_model = request.model_factory.create_plan_model()
+        customer_model = request.model_factory.create_customer_model()
+
+        # load all customers and plans at once for the validators and this
+        # view
+        customer_model.prefetch(item.get('customer_guid') for item in items)
+        plan_model.prefetch(item.get('plan_guid') for item in items)
+
+        results = [None] * len(items)
+        valid_items = []
+        for index, item in enumerate(items):
+            form, error = validate_item(SubscriptionCreateForm, request, item)
+            if error is not None:
+                results[index] = error_result(index, 'ValidationError', error)
+                continue
+            customer = customer_model.get_cached(form.data['customer_guid'])
+            plan = plan_model.get_cached(form.data['plan_guid'])
+            http_error = check_customer_and_plan(company, customer, plan)
+            if http_error is not None:
+                results[index] = exception_result(index, http_error)
+                continue
+            kwargs = subscription_create_kwargs(form)
+            valid_items.append((index, customer, plan, kwargs))
+
+        uri_errors = validate_funding_instruments(
+            request,
+            company,
+            [item[3]['funding_instrument_uri'] for item in valid_items],
+        )
+
+        transactions = []
+        for chunk in iter_chunks(request, valid_items):
+            created = []
+            chunk_transactions = []
+            try:
+                with db_transaction.manager:
+                    for index, customer, plan, kwargs in chunk:
+                        uri = kwargs['funding_instrument_uri']
+                        if uri in uri_errors:
+                            results[index] = exception_result(
+                                index,
+                                uri_errors[uri],
+                            )
+                            continue
+                        subscription = sub_model.create(
+                            customer=customer,
+                            plan=plan,
+                            **kwargs
+                        )
+                        created.append((index, subscription.guid))
+                        # not a deferred subscription, process transactions
+                        # right away
+                        if kwargs['started_at'] is None:
+                            chunk_transactions.extend(
+                                subscription.invoices[0].transactions
+                            )
+            except Exception, e:
+                fail_chunk(
+                    sub_model.session,
+                    results,
+                    [item[0] for item in chunk],
+                    e,
+                )
+                continue
+            # only created once the chunk is committed
+            for index, guid in created:
+                results[index] = created_result(index, guid)
+            transactions.extend(chunk_transactions)
+
+        submit_in_chunks(request, transactions)
+        return dict(items=results)
+
 
 @api_view_defaults(context=SubscriptionResource)
 class SubscriptionView(EntityView):
 
     @view_config(request_method='GET')
     def get(self):
-        return self.context.entity
+        return self.conditional_get()
 
     @view_config(name='cancel', request_method='POST')
     def cancel(self):
@@ -0,0 +1,27 @@
+from __future__ import unicode_literals
+
+from billy.api.metrics import view_label
+
+
+def tracing_tween_factory(handler, registry):
+    """Run requests in root spans named by their views, the tween is left out
+    if tracing is disabled
+
+    """
+    tracer = registry.settings.get('tracer')
+    if tracer is None or not tracer.enabled:
+        return handler
+
+    def tracing_tween(request):
+        with tracer.span(
+            'request',
+            method=request.method,
+            path=request.path,
+        ) as span:
+            try:
+                response = handler(request)
+                span.set_attribute('status', response.status_int)
+                return response
+            finally:
+                span.name = view_label(request)
+    return tracing_tween
@@ -3,9 +3,10 @@ from __future__ import unicode_literals
 from pyramid.view import view_config
 from pyramid.security import authenticated_userid
 
-from billy.models.invoice import InvoiceModel
 from billy.models.transaction import TransactionModel
 from billy.api.utils import list_by_context
+from billy.api.export import parse_export_params
+from billy.api.export import export_response
 from billy.api.resources import IndexResource
 from billy.api.resources import EntityResource
 from billy.api.views import IndexView
@@ -16,18 +17,14 @@ from billy.api.views import api_view_defaults
 class TransactionResource(EntityResource):
     @property
     def company(self):
-        # make sure only the owner company can access the customer
-        if self.entity.invoice.invoice_type == InvoiceModel.types.SUBSCRIPTION:
-            company = self.entity.invoice.subscription.plan.company
-        else:
-            company = self.entity.invoice.customer.company
-        return company
+        return self.entity.company
 
 
 class TransactionIndexResource(IndexResource):
     MODEL_CLS = TransactionModel
     ENTITY_NAME = 'transaction'
     ENTITY_RESOURCE = TransactionResource
+    VIEW_NAMES = ('export', )
 
 
 @api_view_defaults(context=TransactionIndexResource)
@@ -39,10 +36,27 @@ class TransactionIndexView(IndexView):
         company = authenticated_userid(request)
         return list_by_context(request, TransactionModel, company)
 
+    @view_config(name='export', request_method='GET', permission='view')
+    def export(self):
+        """Export all transactions created in given range as CSV or JSON
+        lines
+
+        """
+        request = self.request
+        company = authenticated_userid(request)
+        export_format, since, until = parse_export_params(request)
+        model = request.model_factory.create_transaction_model()
+        query = model.export_query(
+            company_guid=company.guid,
+            since=since,
+            until=until,
+        )
+        return export_response(request, query, export_format, 'transactions')
+
 
 @api_view_defaults(context=TransactionResource)
 class TransactionView(EntityView):
 
     @view_config(request_method='GET')
     def get(self):
-        return self.context.entity
+        return self.conditional_get()
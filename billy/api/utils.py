@@ -1,12 +1,34 @@
 from __future__ import unicode_literals
+from __future__ import absolute_import
 import re
+import logging
+import hashlib
 
+import transaction as db_transaction
 from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.httpexceptions import HTTPNotModified
+from pyramid.settings import asbool
 from pyramid.path import DottedNameResolver
+from webob.multidict import MultiDict
+
+from billy.models.base import encode_cursor
+from billy.api.fields import list_relationships
 
 # the minimum amount in a transaction
 MINIMUM_AMOUNT = 50
 
+# process transactions right away in the request
+PROCESSING_INLINE = 'inline'
+# process transactions in background threads of API server
+PROCESSING_BACKGROUND = 'background'
+# leave transactions to process_billy_tx
+PROCESSING_DEFERRED = 'deferred'
+PROCESSING_MODES = (
+    PROCESSING_INLINE,
+    PROCESSING_BACKGROUND,
+    PROCESSING_DEFERRED,
+)
+
 # regular expression for appears_on_statement_as field
 # this basically accepts
 #    ASCII letters (a-z and A-Z)
@@ -41,11 +63,27 @@ def form_errors_to_bad_request(errors):
     return HTTPBadRequest(message)
 
 
-def validate_form(form_cls, request):
-    """Validate form and raise exception if necessary
+def json_formdata(data):
+    """Convert a JSON object into form data, nested values are not form
+    fields, they are left to the view
+
+    """
+    formdata = MultiDict()
+    for key, value in data.iteritems():
+        if value is None or isinstance(value, (list, dict)):
+            continue
+        formdata[key] = unicode(value)
+    return formdata
+
+
+def validate_form(form_cls, request, formdata=None):
+    """Validate form and raise exception if necessary, the form is
+    validated against request parameters unless formdata is given
 
     """
-    form = form_cls(request.params)
+    if formdata is None:
+        formdata = request.params
+    form = form_cls(formdata)
     # Notice: this make validators can query to database
     form.model_factory = request.model_factory
     validation_result = form.validate()
@@ -63,37 +101,272 @@ class RecordExistValidator(object):
         self.model_cls = model_cls
 
     def __call__(self, form, field):
-        # Notice: we should set form.model_factory before we call validate
+        # Notice: we should set form.model_factory before we call validate,
+        # the record is kept in the loader of the factory for the view
         model = self.model_cls(form.model_factory)
-        if model.get(field.data) is None:
+        if model.get_cached(field.data) is None:
             msg = field.gettext('No such {} record {}'
                                 .format(self.model_cls.TABLE.__name__,
                                         field.data))
             raise ValueError(msg)
 
 
+def make_etag(*parts):
+    """Make an opaque ETag value out of given parts
+
+    """
+    token = '|'.join(unicode(part) for part in parts)
+    return hashlib.sha1(token.encode('utf8')).hexdigest()
+
+
+def not_modified_response(request, etag):
+    """Set the weak ETag to the response, and return a 304 Not Modified
+    response if the client has this version already, otherwise None
+
+    """
+    request.response.etag = (etag, False)
+    if etag in request.if_none_match:
+        response = HTTPNotModified()
+        response.etag = (etag, False)
+        return response
+    return None
+
+
+def request_params_etag_parts(request):
+    """Return query parameters of the request as ETag parts, so that
+    different representations of the same record get different ETags
+
+    """
+    return ['{}={}'.format(key, value)
+            for key, value in sorted(request.GET.items())]
+
+
+def entity_etag(request, entity, related=()):
+    """Make ETag of an entity from GUID and last update time of it and the
+    related records expanded in the response
+
+    """
+    parts = [entity.guid, entity.updated_at.isoformat()]
+    for record in related:
+        parts.append(
+            '{}@{}'.format(record.guid, record.updated_at.isoformat())
+        )
+    parts.extend(request_params_etag_parts(request))
+    return make_etag(*parts)
+
+
+class RecordStream(object):
+    """Records of a list response which are fetched chunk by chunk, so that
+    the json renderer can write a large page without holding all of it in
+    memory
+
+    The first chunk is fetched right away in the request, so that errors
+    like invalid cursor can still be reported. Following chunks are fetched
+    lazily, each in its own database transaction, while the response body
+    is being written. They always continue from the last record of the
+    previous chunk by cursor, even in offset mode, so that records inserted
+    or deleted in the meantime won't make items duplicated or skipped, and
+    a chunk never scans the records before it again. Records are ordered
+    in the cursor order for this, offset mode included
+
+    """
+
+    def __init__(
+        self,
+        request,
+        model,
+        context,
+        offset,
+        limit,
+        chunk_size,
+        **kwargs
+    ):
+        settings = request.registry.settings
+        self.model = model
+        self.context_cls = type(context)
+        self.context_guid = context.guid
+        self.offset = offset
+        self.limit = limit
+        self.chunk_size = chunk_size
+        self.cursor = kwargs.pop('cursor', None)
+        self.kwargs = kwargs
+        self.session_cleanup = asbool(
+            settings.get('db_session_cleanup', True)
+        )
+        #: cursor of next page, available after all chunks are iterated
+        self.next_cursor = None
+        # an empty cursor orders records as cursors do without skipping
+        # any, so that the offset applies to the same order
+        self.head = self._fetch(
+            context,
+            offset=offset,
+            limit=min(limit, chunk_size),
+            cursor=self.cursor if self.cursor is not None else '',
+        )
+        # Notice: records will be expired or even detached once the request
+        # transaction is committed, so we remember where to continue now
+        self.last_cursor = None
+        if self.head:
+            self.last_cursor = encode_cursor(self.head[-1])
+
+    def _fetch(self, context, offset, limit, cursor):
+        kwargs = dict(self.kwargs)
+        if cursor is not None:
+            kwargs['cursor'] = cursor
+        return list(self.model.list_by_context(
+            context=context,
+            offset=offset,
+            limit=limit,
+            **kwargs
+        ))
+
+    def iter_chunks(self):
+        """Iterate over lists of records, the first one is fetched already,
+        the rest are fetched when they are asked for
+
+        """
+        records = self.head
+        count = len(records)
+        # a short chunk means there is no more records
+        exhausted = count < min(self.limit, self.chunk_size)
+        self.head = None
+        yield records
+        del records
+        session = self.model.session
+        try:
+            while not exhausted and count < self.limit:
+                size = min(self.limit - count, self.chunk_size)
+                with db_transaction.manager:
+                    context = (
+                        session.query(self.context_cls)
+                        .get(self.context_guid)
+                    )
+                    # continue from the last record
+                    records = self._fetch(
+                        context,
+                        offset=0,
+                        limit=size,
+                        cursor=self.last_cursor,
+                    )
+                    exhausted = len(records) < size
+                    if not records:
+                        break
+                    count += len(records)
+                    yield records
+                    self.last_cursor = encode_cursor(records[-1])
+                    del records
+        finally:
+            if self.session_cleanup:
+                session.remove()
+        if count >= self.limit:
+            self.next_cursor = self.last_cursor
+
+
 def list_by_context(request, model_cls, context):
     """List records by a given context
 
+    When the limit is greater than `api.json.stream_chunk_size` setting,
+    the records are returned as a `RecordStream` instead of a list. A 304 Not
+    Modified response is returned instead if the client has the same page
+    already, unless relationships are expanded
+
+    Only relationships needed by `fields` and `expand` parameters are loaded
+
     """
+    settings = request.registry.settings
     model = model_cls(request.model_factory)
     offset = int(request.params.get('offset', 0))
     limit = int(request.params.get('limit', 20))
+    chunk_size = int(settings.get('api.json.stream_chunk_size', 100))
     kwargs = {}
     if 'external_id' in request.params:
         kwargs['external_id'] = request.params['external_id']
     if 'processor_uri' in request.params:
         kwargs['processor_uri'] = request.params['processor_uri']
-    items = model.list_by_context(
+    relationships = list_relationships(request, model)
+    if relationships is not None:
+        kwargs['relationships'] = relationships
+    # Notice: cursor takes the place of offset when it is given, an empty
+    # cursor means the first page
+    if 'cursor' in request.params:
+        kwargs['cursor'] = request.params['cursor']
+        offset = 0
+
+    # Notice: the ETag is made of GUID and last update time of records on
+    # the page. Expanded records may change without touching records on the
+    # page, so there is no ETag for them
+    etag_enabled = not request.params.get('expand')
+    streamed = chunk_size and limit > chunk_size
+
+    def page_etag(versions):
+        fingerprint = request_params_etag_parts(request)
+        for guid, updated_at in versions:
+            fingerprint.append('{}@{}'.format(guid, updated_at.isoformat()))
+        return make_etag(*fingerprint)
+
+    # When the client has a version of the page, or the page is streamed so
+    # that headers are written before records are loaded, we tell whether
+    # the page is modified by fetching these two columns only, without
+    # loading the records with their children and rendering them.
+    # Otherwise the ETag is made of the loaded records
+    if etag_enabled and (streamed or 'If-None-Match' in request.headers):
+        page_kwargs = dict(kwargs)
+        if streamed:
+            # in the same order as the records are streamed
+            page_kwargs.setdefault('cursor', '')
+        table = model.TABLE
+        page_query = model.list_by_context(
+            context=context,
+            offset=offset,
+            limit=limit,
+            **page_kwargs
+        )
+        not_modified = not_modified_response(
+            request,
+            page_etag(page_query.with_entities(
+                table.guid,
+                table.updated_at,
+            )),
+        )
+        if not_modified is not None:
+            return not_modified
+        etag_enabled = False
+
+    if streamed:
+        items = RecordStream(
+            request,
+            model,
+            context,
+            offset=offset,
+            limit=limit,
+            chunk_size=chunk_size,
+            **kwargs
+        )
+        return dict(
+            items=items,
+            offset=offset,
+            limit=limit,
+            next_cursor=None,
+        )
+    items = list(model.list_by_context(
         context=context,
         offset=offset,
         limit=limit,
         **kwargs
-    )
+    ))
+    if etag_enabled:
+        request.response.etag = (
+            page_etag((item.guid, item.updated_at) for item in items),
+            False,
+        )
+    next_cursor = None
+    if items and len(items) >= limit:
+        next_cursor = encode_cursor(items[-1])
     result = dict(
-        items=list(items),
+        items=items,
         offset=offset,
         limit=limit,
+        next_cursor=next_cursor,
     )
     return result
 
@@ -106,3 +379,47 @@ def get_processor_factory(settings):
     processor_factory = settings['billy.processor_factory']
     processor_factory = resolver.maybe_resolve(processor_factory)
     return processor_factory
+
+
+def get_processing_mode(settings):
+    """Get transaction processing mode from settings and return
+
+    """
+    mode = settings.get('billy.transaction.processing_mode', PROCESSING_INLINE)
+    if mode not in PROCESSING_MODES:
+        raise ValueError(
+            'Invalid billy.transaction.processing_mode {}, should be one of {}'
+            .format(mode, PROCESSING_MODES)
+        )
+    return mode
+
+
+def submit_transactions(request, transactions):
+    """Submit transactions to the payment processor according to the
+    `billy.transaction.processing_mode` setting
+
+        - inline: process them right away in current request
+        - background: hand them over to the transaction executor
+        - deferred: do nothing, process_billy_tx will process them later
+
+    Notice: transactions should be committed in STAGED status before calling
+    this function, so that they won't get lost for background and deferred
+    modes
+
+    """
+    logger = logging.getLogger(__name__)
+    settings = request.registry.settings
+    mode = get_processing_mode(settings)
+    transactions = list(transactions)
+    if not transactions:
+        return
+    if mode == PROCESSING_INLINE:
+        tx_model = request.model_factory.create_transaction_model()
+        with db_transaction.manager:
+            tx_model.process_transactions(transactions)
+    elif mode == PROCESSING_BACKGROUND:
+        executor = settings['transaction_executor']
+        executor.submit(transaction.guid for transaction in transactions)
+    else:
+        logger.debug('Deferred processing transactions %s',
+                     [transaction.guid for transaction in transactions])
@@ -3,6 +3,11 @@ import functools
 
 from pyramid.view import view_defaults
 
+from billy.api.fields import check_expand
+from billy.api.fields import related_records
+from billy.api.utils import entity_etag
+from billy.api.utils import not_modified_response
+
 api_view_defaults = functools.partial(view_defaults, renderer='json')
 
 
@@ -19,4 +24,22 @@ class IndexView(BaseView):
    
 
 class EntityView(BaseView):
-    pass
+
+    def conditional_get(self):
+        """Return the entity of context, or a 304 Not Modified response if
+        the client has the same version of it already
+
+        """
+        entity = self.context.entity
+        check_expand(self.request, type(entity))
+        not_modified = not_modified_response(
+            self.request,
+            entity_etag(
+                self.request,
+                entity,
+                related_records(entity, self.request),
+            ),
+        )
+        if not_modified is not None:
+            return not_modified
+        return entity
@@ -2,6 +2,8 @@
 from __future__ import unicode_literals
 
 from .base import *
+from .billing_run import *
+from .callback_event import *
 from .company import *
 from .customer import *
 from .invoice import *
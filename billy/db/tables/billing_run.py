@@ -0,0 +1,51 @@
+from __future__ import unicode_literals
+
+from sqlalchemy import Column
+from sqlalchemy import Integer
+from sqlalchemy import Float
+from sqlalchemy import Unicode
+from sqlalchemy import UnicodeText
+
+from .base import DeclarativeBase
+from .base import UTCDateTime
+from .base import now_func
+
+
+class BillingRun(DeclarativeBase):
+    """A billing run is the summary of one process_billy_tx run, for tracking
+    how long runs take and where the time goes
+
+    """
+    __tablename__ = 'billing_run'
+
+    guid = Column(Unicode(64), primary_key=True)
+    #: wall time of each phase in seconds
+    reconcile_seconds = Column(Float, nullable=False, default=0)
+    callback_seconds = Column(Float, nullable=False, default=0)
+    yield_seconds = Column(Float, nullable=False, default=0)
+    process_seconds = Column(Float, nullable=False, default=0)
+    #: count of invoices yielded from subscriptions
+    invoices_yielded = Column(Integer, nullable=False, default=0)
+    #: count of transactions submitted to the processor, and the ones
+    #  succeeded, to be retried and failed
+    transactions_attempted = Column(Integer, nullable=False, default=0)
+    transactions_succeeded = Column(Integer, nullable=False, default=0)
+    transactions_retried = Column(Integer, nullable=False, default=0)
+    transactions_failed = Column(Integer, nullable=False, default=0)
+    #: seconds spent in calling the payment processor
+    processor_seconds = Column(Float, nullable=False, default=0)
+    #: count of SQL statements executed and seconds spent in the database
+    db_statements = Column(Integer, nullable=False, default=0)
+    db_seconds = Column(Float, nullable=False, default=0)
+    #: path of the pstats file if the run was profiled
+    profile_path = Column(UnicodeText)
+    #: error message if the run was aborted by an error
+    error_message = Column(UnicodeText)
+    #: the datetime this run started
+    started_at = Column(UTCDateTime, default=now_func, index=True)
+    #: the datetime this run finished
+    finished_at = Column(UTCDateTime, default=now_func)
+
+__all__ = [
+    BillingRun.__name__,
+]
@@ -0,0 +1,63 @@
+from __future__ import unicode_literals
+
+from sqlalchemy import Column
+from sqlalchemy import Unicode
+from sqlalchemy import UnicodeText
+from sqlalchemy.schema import ForeignKey
+from sqlalchemy.schema import UniqueConstraint
+from sqlalchemy.orm import relationship
+
+from .base import DeclarativeBase
+from .base import UTCDateTime
+from .base import now_func
+from ..enum import DeclEnum
+
+
+class CallbackEventStatus(DeclEnum):
+
+    RECEIVED = 'RECEIVED', 'Received'
+    PROCESSED = 'PROCESSED', 'Processed'
+    IGNORED = 'IGNORED', 'Ignored'
+    FAILED = 'FAILED', 'Failed'
+
+
+class CallbackEvent(DeclarativeBase):
+    """A callback event is a raw callback payload from payment processor
+    waiting in the inbox to be verified and applied
+
+    """
+    __tablename__ = 'callback_event'
+    # ensure one event will only be received once for the company
+    __table_args__ = (UniqueConstraint('company_guid', 'processor_id'), )
+
+    guid = Column(Unicode(64), primary_key=True)
+    #: the guid of company which receives this callback
+    company_guid = Column(
+        Unicode(64),
+        ForeignKey(
+            'company.guid',
+            ondelete='CASCADE', onupdate='CASCADE'
+        ),
+        index=True,
+        nullable=False,
+    )
+    #: the id of event record in payment processing system
+    processor_id = Column(Unicode(128), nullable=False)
+    #: the raw callback payload in JSON
+    payload = Column(UnicodeText, nullable=False)
+    #: current status of this callback event
+    status = Column(CallbackEventStatus.db_type(), index=True, nullable=False)
+    #: error message when failed to apply this event
+    error_message = Column(UnicodeText)
+    #: the created datetime of this callback event
+    created_at = Column(UTCDateTime, default=now_func, index=True)
+    #: the updated datetime of this callback event
+    updated_at = Column(UTCDateTime, default=now_func)
+
+    #: the company which receives this callback
+    company = relationship('Company')
+
+__all__ = [
+    CallbackEventStatus.__name__,
+    CallbackEvent.__name__,
+]
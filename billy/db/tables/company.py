@@ -27,6 +27,8 @@ class Company(DeclarativeBase):
     name = Column(Unicode(128))
     #: is this company deleted?
     deleted = Column(Boolean, default=False, nullable=False)
+    #: is this company still waiting for being provisioned in processor?
+    pending = Column(Boolean, default=False, nullable=False)
     #: the created datetime of this company
     created_at = Column(UTCDateTime, default=now_func)
     #: the updated datetime of this company
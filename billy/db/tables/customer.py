@@ -4,6 +4,7 @@ from sqlalchemy import Column
 from sqlalchemy import Unicode
 from sqlalchemy import Boolean
 from sqlalchemy.schema import ForeignKey
+from sqlalchemy.schema import Index
 from sqlalchemy.orm import relationship
 
 from .base import DeclarativeBase
@@ -16,6 +17,11 @@ class Customer(DeclarativeBase):
 
     """
     __tablename__ = 'customer'
+    # for keyset pagination of customers in a company
+    __table_args__ = (
+        Index('ix_customer_company_guid_created_at_guid',
+              'company_guid', 'created_at', 'guid'),
+    )
 
     guid = Column(Unicode(64), primary_key=True)
     #: the guid of company which owns this customer
@@ -32,6 +38,8 @@ class Customer(DeclarativeBase):
     processor_uri = Column(Unicode(128), index=True)
     #: is this company deleted?
     deleted = Column(Boolean, default=False, nullable=False)
+    #: is this customer still waiting for being provisioned in processor?
+    pending = Column(Boolean, default=False, nullable=False)
     #: the created datetime of this company
     created_at = Column(UTCDateTime, default=now_func)
     #: the updated datetime of this company
@@ -4,9 +4,9 @@ from sqlalchemy import Column
 from sqlalchemy import Integer
 from sqlalchemy import Unicode
 from sqlalchemy.schema import ForeignKey
+from sqlalchemy.schema import Index
 from sqlalchemy.schema import UniqueConstraint
 from sqlalchemy.orm import relationship
-from sqlalchemy.orm import object_session
 
 from .base import DeclarativeBase
 from .base import UTCDateTime
@@ -40,11 +40,27 @@ class Invoice(DeclarativeBase):
 
     """
     __tablename__ = 'invoice'
+    # for keyset pagination of invoices
+    __table_args__ = (
+        Index('ix_invoice_created_at_guid', 'created_at', 'guid'),
+        Index('ix_invoice_company_guid_created_at_guid',
+              'company_guid', 'created_at', 'guid'),
+    )
     __mapper_args__ = {
         'polymorphic_on': 'invoice_type',
     }
 
     guid = Column(Unicode(64), primary_key=True)
+    #: the guid of company which owns this invoice (denormalized from
+    #  customer or plan, so that we can query invoices of a company directly)
+    company_guid = Column(
+        Unicode(64),
+        ForeignKey(
+            'company.guid',
+            ondelete='CASCADE', onupdate='CASCADE'
+        ),
+        nullable=False,
+    )
     # type of invoice, could be 0=subscription, 1=customer
     invoice_type = Column(InvoiceType.db_type(), index=True, nullable=False)
     #: what kind of transaction it is, could be DEBIT or CREDIT
@@ -55,6 +71,10 @@ class Invoice(DeclarativeBase):
     funding_instrument_uri = Column(Unicode(128), index=True)
     #: the total amount of this invoice
     amount = Column(Integer, nullable=False)
+    #: sum of total adjustment amount
+    total_adjustment_amount = Column(Integer, default=0, nullable=False)
+    #: effective amount of this invoice (amount + total_adjustment_amount)
+    effective_amount = Column(Integer, index=True, nullable=False)
     #: current status of this invoice, could be
     #   - STAGED
     #   - PROCESSING
@@ -72,6 +92,9 @@ class Invoice(DeclarativeBase):
     #  bank account or credit card)
     appears_on_statement_as = Column(Unicode(32))
 
+    #: the company which owns this invoice
+    company = relationship('Company')
+
     #: transactions of this invoice
     transactions = relationship(
         'Transaction',
@@ -96,26 +119,6 @@ class Invoice(DeclarativeBase):
         order_by='Adjustment.adjustment_id',
     )
 
-    @property
-    def total_adjustment_amount(self):
-        """Sum of total adjustment amount
-
-        """
-        from sqlalchemy import func
-        session = object_session(self)
-        return (
-            session.query(func.coalesce(func.sum(Adjustment.amount), 0))
-            .filter(Adjustment.invoice_guid == self.guid)
-            .scalar()
-        )
-
-    @property
-    def effective_amount(self):
-        """Effective amount of this invoice (amount + total_adjustment_amount)
-
-        """
-        return self.total_adjustment_amount + self.amount
-
 
 class SubscriptionInvoice(Invoice):
     """An invoice generated from subscription (recurring charge or payout)
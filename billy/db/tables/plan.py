@@ -6,6 +6,7 @@ from sqlalchemy import Unicode
 from sqlalchemy import UnicodeText
 from sqlalchemy import Boolean
 from sqlalchemy.schema import ForeignKey
+from sqlalchemy.schema import Index
 from sqlalchemy.orm import relationship
 
 from .base import DeclarativeBase
@@ -33,6 +34,11 @@ class Plan(DeclarativeBase):
 
     """
     __tablename__ = 'plan'
+    # for keyset pagination of plans in a company
+    __table_args__ = (
+        Index('ix_plan_company_guid_created_at_guid',
+              'company_guid', 'created_at', 'guid'),
+    )
 
     guid = Column(Unicode(64), primary_key=True)
     #: the guid of company which owns this plan
@@ -5,18 +5,39 @@ from sqlalchemy import Integer
 from sqlalchemy import Unicode
 from sqlalchemy import Boolean
 from sqlalchemy.schema import ForeignKey
+from sqlalchemy.schema import Index
 from sqlalchemy.orm import relationship
+from sqlalchemy.orm import column_property
+from sqlalchemy.sql.expression import func
+from sqlalchemy.sql.expression import table
+from sqlalchemy.sql.expression import column
+from sqlalchemy.sql.expression import select
 
 from .base import DeclarativeBase
 from .base import UTCDateTime
 from .base import now_func
 
+# the subscription_invoice table for counting invoices of subscriptions, it
+# is defined in the invoice module, which depends on this module
+_subscription_invoice = table(
+    'subscription_invoice',
+    column('guid'),
+    column('subscription_guid'),
+)
+
 
 class Subscription(DeclarativeBase):
     """A subscription relationship between Customer and Plan
 
     """
     __tablename__ = 'subscription'
+    # for keyset pagination of subscriptions in a plan or customer
+    __table_args__ = (
+        Index('ix_subscription_plan_guid_created_at_guid',
+              'plan_guid', 'created_at', 'guid'),
+        Index('ix_subscription_customer_guid_created_at_guid',
+              'customer_guid', 'created_at', 'guid'),
+    )
 
     guid = Column(Unicode(64), primary_key=True)
     #: the guid of customer who subscribes
@@ -62,6 +83,16 @@ class Subscription(DeclarativeBase):
     #: the updated datetime of this subscription
     updated_at = Column(UTCDateTime, default=now_func)
 
+    #: how many invoice has been generated for the subscription
+    # Notice: it is deferred, undefer it when querying a batch of
+    # subscriptions, so that they can be counted in one query
+    invoice_count = column_property(
+        select([func.count(_subscription_invoice.c.guid)])
+        .where(_subscription_invoice.c.subscription_guid == guid)
+        .label('invoice_count'),
+        deferred=True,
+    )
+
     #: invoices of this subscription
     invoices = relationship(
         'SubscriptionInvoice',
@@ -81,13 +112,6 @@ class Subscription(DeclarativeBase):
             return self.plan.amount
         return self.amount
 
-    @property
-    def invoice_count(self):
-        """How many invoice has been generated
-
-        """
-        return self.invoices.count()
-
 __all__ = [
     Subscription.__name__,
 ]
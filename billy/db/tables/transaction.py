@@ -5,6 +5,7 @@ from sqlalchemy import Integer
 from sqlalchemy import Unicode
 from sqlalchemy import UnicodeText
 from sqlalchemy.schema import ForeignKey
+from sqlalchemy.schema import Index
 from sqlalchemy.schema import UniqueConstraint
 from sqlalchemy.orm import backref
 from sqlalchemy.orm import relationship
@@ -45,6 +46,14 @@ class Transaction(DeclarativeBase):
 
     """
     __tablename__ = 'transaction'
+    # for keyset pagination of transactions
+    __table_args__ = (
+        Index('ix_transaction_created_at_guid', 'created_at', 'guid'),
+        Index('ix_transaction_invoice_guid_created_at_guid',
+              'invoice_guid', 'created_at', 'guid'),
+        Index('ix_transaction_company_guid_created_at_guid',
+              'company_guid', 'created_at', 'guid'),
+    )
 
     guid = Column(Unicode(64), primary_key=True)
     #: the guid of invoice which owns this transaction
@@ -57,6 +66,16 @@ class Transaction(DeclarativeBase):
         index=True,
         nullable=False,
     )
+    #: the guid of company which owns this transaction (denormalized from
+    #  invoice, so that we can query transactions of a company directly)
+    company_guid = Column(
+        Unicode(64),
+        ForeignKey(
+            'company.guid',
+            ondelete='CASCADE', onupdate='CASCADE'
+        ),
+        nullable=False,
+    )
     #: the guid of target transaction to refund/reverse to
     reference_to_guid = Column(
         Unicode(64),
@@ -82,11 +101,16 @@ class Transaction(DeclarativeBase):
     amount = Column(Integer, nullable=False)
     #: the funding instrument URI
     funding_instrument_uri = Column(Unicode(128), index=True)
+    #: occurred datetime of the latest event of this transaction
+    last_event_occurred_at = Column(UTCDateTime)
     #: the created datetime of this transaction
     created_at = Column(UTCDateTime, default=now_func)
     #: the updated datetime of this transaction
     updated_at = Column(UTCDateTime, default=now_func)
 
+    #: the company which owns this transaction
+    company = relationship('Company')
+
     #: target transaction of refund/reverse transaction
     reference_to = relationship(
         'Transaction',
@@ -113,7 +137,6 @@ class Transaction(DeclarativeBase):
         cascade='all, delete-orphan',
         backref='transaction',
         order_by='TransactionFailure.created_at',
-        lazy='dynamic',  # so that we can query count on it
     )
 
     @property
@@ -121,19 +144,8 @@ class Transaction(DeclarativeBase):
         """Count of failures
 
         """
-        return self.failures.count()
+        return len(self.failures)
 
-    @property
-    def company(self):
-        """Owner company of this transaction
-
-        """
-        from .invoice import InvoiceType
-        if self.invoice.invoice_type == InvoiceType.SUBSCRIPTION:
-            company = self.invoice.subscription.plan.company
-        else:
-            company = self.invoice.customer.company
-        return company
 
 
 class TransactionEvent(DeclarativeBase):
@@ -0,0 +1,96 @@
+from __future__ import unicode_literals
+
+from billy.utils.metrics import REGISTRY
+
+REQUEST_DURATION = REGISTRY.histogram(
+    'billy_request_duration_seconds',
+    'Latency of API requests by view',
+    labels=('view', 'method'),
+)
+
+PROCESSOR_CALL_DURATION = REGISTRY.histogram(
+    'billy_processor_call_duration_seconds',
+    'Latency of payment processor calls by operation',
+    labels=('operation', ),
+)
+
+PROCESSOR_ERRORS = REGISTRY.counter(
+    'billy_processor_errors_total',
+    'Payment processor calls failed with an error by operation',
+    labels=('operation', ),
+)
+
+TRANSACTIONS_PROCESSED = REGISTRY.counter(
+    'billy_transactions_processed_total',
+    'Transactions submitted to the processor by result '
+    '(succeeded, retried or failed)',
+    labels=('result', ),
+)
+
+INVOICES_YIELDED = REGISTRY.counter(
+    'billy_invoices_yielded_total',
+    'Invoices yielded from subscriptions',
+)
+
+TRANSACTION_BACKLOG = REGISTRY.gauge(
+    'billy_transaction_backlog',
+    'Transactions waiting to be processed by submit status',
+    labels=('submit_status', ),
+)
+
+DB_POOL_IN_USE = REGISTRY.gauge(
+    'billy_db_pool_in_use',
+    'Database connections checked out from the pool',
+    labels=('pool', ),
+)
+
+DB_POOL_CHECKOUTS = REGISTRY.gauge(
+    'billy_db_pool_checkouts',
+    'Database connections checked out from the pool since start',
+    labels=('pool', ),
+)
+
+DB_POOL_CHECKOUT_SECONDS = REGISTRY.gauge(
+    'billy_db_pool_checkout_seconds',
+    'Seconds waited for checking out database connections since start',
+    labels=('pool', ),
+)
+
+DB_POOL_OVERFLOWS = REGISTRY.gauge(
+    'billy_db_pool_overflows',
+    'Database connections opened beyond the pool size since start',
+    labels=('pool', ),
+)
+
+DB_POOL_TIMEOUTS = REGISTRY.gauge(
+    'billy_db_pool_timeouts',
+    'Checkouts timed out waiting for a database connection since start',
+    labels=('pool', ),
+)
+
+
+def collect_pool_stats(pool_stats):
+    """Update connection pool metrics from `PoolStats` by pool name
+
+    """
+    for name, stats in pool_stats.iteritems():
+        snapshot = stats.snapshot()
+        DB_POOL_IN_USE.set(snapshot['in_use'], pool=name)
+        DB_POOL_CHECKOUTS.set(snapshot['checkouts'], pool=name)
+        DB_POOL_CHECKOUT_SECONDS.set(snapshot['checkout_seconds'], pool=name)
+        DB_POOL_OVERFLOWS.set(snapshot['overflows'], pool=name)
+        DB_POOL_TIMEOUTS.set(snapshot['timeouts'], pool=name)
+
+
+def collect_backlog(transaction_model):
+    """Update the backlog metric with counts of STAGED and RETRYING
+    transactions
+
+    """
+    statuses = transaction_model.submit_statuses
+    counts = transaction_model.count_by_submit_status([
+        statuses.STAGED,
+        statuses.RETRYING,
+    ])
+    for status, count in counts.iteritems():
+        TRANSACTION_BACKLOG.set(count, submit_status=str(status).lower())
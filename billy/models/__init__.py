@@ -1,28 +1,77 @@
 from __future__ import unicode_literals
 import datetime
 
-from sqlalchemy import engine_from_config
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
 from zope.sqlalchemy import ZopeTransactionExtension
   
 from billy.db import tables
+from billy.models.pool import engine_from_settings
+from billy.models.query_stats import instrument_engine
+from billy.models.replica import Replica
+from billy.models.replica import RoutingSession
+from billy.models.tracing import trace_engine
+from billy.models.tracing import tracer_from_settings
+from billy.utils.cache import TTLCache
 
 
 def setup_database(global_config, **settings):
     """Setup database
    
     """
+    # statistics of connection pools, by engine name
+    pool_stats = settings.setdefault('pool_stats', {})
     if 'engine' not in settings:
-        settings['engine'] = (
-            engine_from_config(settings, 'sqlalchemy.')
+        settings['engine'], pool_stats['primary'] = engine_from_settings(
+            settings,
+            'sqlalchemy.',
+            'primary',
         )
  
+    # optional read-only replica, safe reads can be sent to it with
+    # RoutingSession.use_replica
+    if 'replica' not in settings and 'sqlalchemy_replica.url' in settings:
+        replica_engine, pool_stats['replica'] = engine_from_settings(
+            settings,
+            'sqlalchemy_replica.',
+            'replica',
+        )
+        settings['replica'] = Replica(
+            replica_engine,
+            max_lag=float(settings.get('billy.replica.max_lag', 5)),
+            check_interval=float(
+                settings.get('billy.replica.check_interval', 1)
+            ),
+        )
+
+    # SQL statements are recorded for query statistics of requests and
+    # batch runs
+    instrument_engine(settings['engine'])
+    if 'replica' in settings:
+        instrument_engine(settings['replica'].engine)
+
+    # tracing of requests, model methods, SQL statements and processor calls
+    if 'tracer' not in settings:
+        settings['tracer'] = tracer_from_settings(settings)
+    if settings['tracer'].enabled:
+        trace_engine(settings['engine'])
+        if 'replica' in settings:
+            trace_engine(settings['replica'].engine)
+
     if 'session' not in settings:
         settings['session'] = scoped_session(sessionmaker(
+            class_=RoutingSession,
             extension=ZopeTransactionExtension(keep_session=True),
             bind=settings['engine'],
+            replica=settings.get('replica'),
         ))
 
+    # process-wide cache for looking up companies by API key
+    if 'api_key_cache' not in settings:
+        settings['api_key_cache'] = TTLCache(
+            max_size=int(settings.get('billy.auth.cache_size', 1000)),
+            ttl=float(settings.get('billy.auth.cache_ttl', 60)),
+        )
+
     tables.set_now_func(datetime.datetime.utcnow)
     return settings
@@ -1,15 +1,76 @@
 from __future__ import unicode_literals
+import base64
 import logging
+import binascii
 from functools import wraps
 
+import iso8601
+from sqlalchemy import inspect
+from sqlalchemy import bindparam
+from sqlalchemy.orm import Query
+from sqlalchemy.orm import subqueryload
+from sqlalchemy.orm import contains_eager
+from sqlalchemy.orm import scoped_session
+from sqlalchemy.util import LRUCache
+from sqlalchemy.sql.expression import or_
+from sqlalchemy.sql.expression import and_
+
+from billy.errors import BillyError
+
+
+#: process-wide cache of compiled SQL of statements built by
+#  `BaseTableModel.cached_query`, keyed by the statement and the dialect
+COMPILED_CACHE = LRUCache(500)
+
+#: queries built by `BaseTableModel.cached_query`, keyed by table and shape
+_CACHED_QUERIES = {}
+
+
+class InvalidCursorError(BillyError):
+    """This error indicates the given pagination cursor is invalid
+
+    """
+
+
+def encode_cursor(record):
+    """Encode an opaque pagination cursor pointing to the given record
+
+    """
+    token = '{}|{}'.format(record.created_at.isoformat(), record.guid)
+    return base64.urlsafe_b64encode(token.encode('utf8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Decode a pagination cursor and return (created_at, guid) tuple
+
+    """
+    try:
+        token = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        created_at, guid = token.decode('utf8').split('|', 1)
+        created_at = iso8601.parse_date(created_at)
+    except (
+        ValueError,
+        TypeError,
+        binascii.Error,
+        UnicodeError,
+        iso8601.ParseError,
+    ):
+        raise InvalidCursorError('Invalid cursor {}'.format(cursor))
+    return created_at, guid
+
 
 def decorate_offset_limit(func):
-    """Make a querying function accept extra optional offset and limit
-    parameter and set to the querying result
+    """Make a querying function accept extra optional offset, limit and
+    cursor parameter and set to the querying result
+
+    When cursor is given (an empty string for the first page), records are
+    ordered by (created_at, guid) in descending order, and only the ones
+    after the record the cursor points to are returned, so that paging deep
+    won't cost O(offset)
 
     """
     @wraps(func)
-    def callee(*args, **kwargs):
+    def callee(self, *args, **kwargs):
         try:
             offset = kwargs.pop('offset')
         except KeyError:
@@ -18,7 +79,24 @@ def decorate_offset_limit(func):
             limit = kwargs.pop('limit')
         except KeyError:
             limit = None
-        query = func(*args, **kwargs)
+        try:
+            cursor = kwargs.pop('cursor')
+        except KeyError:
+            cursor = None
+        query = func(self, *args, **kwargs)
+        if cursor is not None:
+            table = self.TABLE
+            query = (
+                query
+                .order_by(None)
+                .order_by(table.created_at.desc(), table.guid.desc())
+            )
+            if cursor:
+                created_at, guid = decode_cursor(cursor)
+                query = query.filter(or_(
+                    table.created_at < created_at,
+                    and_(table.created_at == created_at, table.guid < guid),
+                ))
         if offset is not None:
             query = query.offset(offset)
         if limit is not None:
@@ -27,30 +105,146 @@ def decorate_offset_limit(func):
     return callee
 
 
+def load_relationships(query, paths):
+    """Load relationships of records in the query in a batch with
+    subqueryload, each path is a relationship name or a dotted path of
+    relationships like `transactions.failures`
+
+    """
+    for path in paths:
+        names = path.split('.')
+        option = subqueryload(names[0])
+        for name in names[1:]:
+            option = option.subqueryload(name)
+        query = query.options(option)
+    return query
+
+
 class BaseTableModel(object):
 
     #: the table for this model
     TABLE = None
 
+    #: relationships loaded in a batch by list_by_context by default
+    LIST_RELATIONSHIPS = ()
+
     def __init__(self, factory, logger=None):
         self.logger = logger or logging.getLogger(__name__)
         self.factory = factory
         self.session = factory.session
         assert self.TABLE is not None
 
+    def cached_query(self, shape, build, **params):
+        """Return a query of records of the table with a statement cached by
+        the shape, `build` is called with a query of the table to add
+        criterion and loading options only the first time a shape is asked
+        for, values of its bind parameters are given as keyword arguments
+
+        Notice: building a Query and compiling it into SQL costs much more
+        than running a lookup by primary key, so that the statement of a
+        shape is built only once and its compiled SQL is reused. Literal
+        values in the criterion are part of the shape, values that vary
+        between calls should be `bindparam`
+
+        """
+        key = (self.TABLE, shape)
+        query = _CACHED_QUERIES.get(key)
+        if query is None:
+            built = build(Query(self.TABLE)).with_labels()
+            query = (
+                built
+                .enable_assertions(False)
+                .from_statement(built.statement)
+                .execution_options(compiled_cache=COMPILED_CACHE)
+            )
+            _CACHED_QUERIES[key] = query
+        session = self.session
+        if isinstance(session, scoped_session):
+            session = session()
+        return query.with_session(session).params(**params)
+
     def get(self, guid, raise_error=False, with_lockmode=None):
         """Find a record by guid and return it
 
         :param guid: The guild of record to get
         :param raise_error: Raise KeyError when cannot find one
-        :param with_lockmode: The lock model to acquire on the row
+        :param with_lockmode: The lock model to acquire on the row, a record
+            already loaded in the session is refreshed with the locked row,
+            so that callers which lock it for reading latest state won't see
+            stale attributes
         """
-        query = self.session.query(self.TABLE)
-        if with_lockmode is not None:
-            query = query.with_lockmode(with_lockmode)
-        query = query.get(guid)
-        if raise_error and query is None:
+        record = None
+        # like Query.get, a loaded record is returned without a query unless
+        # a lock is asked for
+        if with_lockmode is None:
+            key = self.session.identity_key(self.TABLE, guid)
+            record = self.session.identity_map.get(key)
+            if record is not None and inspect(record).expired:
+                record = None
+        if record is None:
+            query = self.cached_query(
+                ('get', with_lockmode),
+                lambda query: (
+                    query
+                    .with_lockmode(with_lockmode)
+                    .filter(self.TABLE.guid == bindparam('guid'))
+                ),
+                guid=guid,
+            )
+            if with_lockmode is not None:
+                # Notice: a query populating existing records doesn't flush
+                # the session, flush it, otherwise changes made before the
+                # lock would be overwritten
+                self.session.flush()
+                query = query.populate_existing()
+            record = query.first()
+        if raise_error and record is None:
             raise KeyError('No such {} {}'.format(
                 self.TABLE.__name__.lower(), guid
             ))
-        return query
+        return record
+
+    def get_cached(self, guid):
+        """Find a record by guid through the record loader of the factory,
+        records looked up more than once are only queried once
+
+        """
+        return self.factory.loader.get(self.TABLE, guid, load=self.get)
+
+    def prefetch(self, guids):
+        """Load records with given guids into the record loader of the
+        factory in one query, so that following `get_cached` calls for them
+        cost nothing
+
+        """
+        self.factory.loader.prefetch(self.TABLE, guids)
+
+    def get_joined(self, guid, path=()):
+        """Find a record by guid with a path of many-to-one relationships,
+        like ('plan', ) for a subscription, joined and loaded in the same
+        query, return None if there is no such record
+
+        """
+        def build(query):
+            # load columns of subclasses too, like customer invoice ones
+            if inspect(self.TABLE).polymorphic_map:
+                query = query.with_polymorphic('*')
+            target = self.TABLE
+            option = None
+            for name in path:
+                attr = getattr(target, name)
+                target = attr.property.mapper.class_
+                query = query.join(attr)
+                if option is None:
+                    option = contains_eager(attr)
+                else:
+                    option = option.contains_eager(attr)
+            if option is not None:
+                query = query.options(option)
+            return query.filter(self.TABLE.guid == bindparam('guid'))
+
+        return self.cached_query(
+            ('joined', tuple(path)),
+            build,
+            guid=guid,
+        ).first()
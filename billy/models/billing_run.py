@@ -0,0 +1,129 @@
+from __future__ import unicode_literals
+import time
+import contextlib
+
+from billy.db import tables
+from billy.models.base import BaseTableModel
+from billy.utils.generic import make_guid
+
+
+class RunSummary(object):
+    """Summary of a billing run collected while it runs
+
+    """
+
+    #: phases of a run in order
+    PHASES = ('reconcile', 'callback', 'yield', 'process')
+
+    def __init__(self):
+        self.started_at = tables.now_func()
+        self.finished_at = None
+        self.phase_seconds = dict((phase, 0.0) for phase in self.PHASES)
+        self.invoices_yielded = 0
+        self.transactions_attempted = 0
+        self.transactions_succeeded = 0
+        self.transactions_retried = 0
+        self.transactions_failed = 0
+        self.processor_seconds = 0.0
+        self.db_statements = 0
+        self.db_seconds = 0.0
+        self.profile_path = None
+        self.error_message = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Add wall time of the block to the phase
+
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phase_seconds[name] += time.time() - start
+
+    def count_transactions(self, transactions):
+        """Count processed transactions by their submit status
+
+        """
+        statuses = tables.TransactionSubmitStatus
+        for transaction in transactions:
+            self.transactions_attempted += 1
+            if transaction.submit_status == statuses.DONE:
+                self.transactions_succeeded += 1
+            elif transaction.submit_status == statuses.RETRYING:
+                self.transactions_retried += 1
+            elif transaction.submit_status == statuses.FAILED:
+                self.transactions_failed += 1
+
+    def finish(self, error=None):
+        self.finished_at = tables.now_func()
+        if error is not None:
+            self.error_message = '{}: {}'.format(type(error).__name__, error)
+
+    def format(self):
+        """Format the summary for logging
+
+        """
+        lines = ['Billing run summary:']
+        for phase in self.PHASES:
+            lines.append('  {:<24} {:.3f} s'.format(
+                phase, self.phase_seconds[phase],
+            ))
+        lines.extend([
+            '  {:<24} {}'.format('invoices yielded', self.invoices_yielded),
+            '  {:<24} {} (succeeded={}, retried={}, failed={})'.format(
+                'transactions attempted',
+                self.transactions_attempted,
+                self.transactions_succeeded,
+                self.transactions_retried,
+                self.transactions_failed,
+            ),
+            '  {:<24} {:.3f} s'.format(
+                'processor time', self.processor_seconds,
+            ),
+            '  {:<24} {:.3f} s ({} statements)'.format(
+                'database time', self.db_seconds, self.db_statements,
+            ),
+        ])
+        return '\n'.join(lines)
+
+    def as_columns(self):
+        """Return values of the summary by columns of billing run table
+
+        """
+        columns = dict(
+            (phase + '_seconds', seconds)
+            for phase, seconds in self.phase_seconds.iteritems()
+        )
+        columns.update(
+            invoices_yielded=self.invoices_yielded,
+            transactions_attempted=self.transactions_attempted,
+            transactions_succeeded=self.transactions_succeeded,
+            transactions_retried=self.transactions_retried,
+            transactions_failed=self.transactions_failed,
+            processor_seconds=self.processor_seconds,
+            db_statements=self.db_statements,
+            db_seconds=self.db_seconds,
+            profile_path=self.profile_path,
+            error_message=self.error_message,
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+        )
+        return columns
+
+
+class BillingRunModel(BaseTableModel):
+
+    TABLE = tables.BillingRun
+
+    def create(self, summary):
+        """Save summary of a billing run and return the record
+
+        """
+        billing_run = tables.BillingRun(
+            guid='BR' + make_guid(),
+            **summary.as_columns()
+        )
+        self.session.add(billing_run)
+        self.session.flush()
+        return billing_run
@@ -0,0 +1,168 @@
+from __future__ import unicode_literals
+from __future__ import absolute_import
+import json
+import logging
+
+import transaction as db_transaction
+
+from billy.db import tables
+from billy.errors import BillyError
+from billy.models.model_factory import ModelFactory
+from billy.models.transaction import DuplicateEventError
+
+
+class CallbackEventConsumer(object):
+    """Callback event consumer verifies received callback events in the inbox
+    against the payment processor and applies them in batches
+
+    """
+
+    #: the default count of events to consume in a batch
+    DEFAULT_BATCH_SIZE = 100
+
+    #: errors mean the processor cannot be reached right now, events failed
+    #  with them are tried again later. Connection errors of requests and
+    #  HTTP errors of balanced are IOError too, the Balanced processor only
+    #  raises the latter for server errors, client errors are raised as
+    #  InvalidCallbackPayload which fails the event
+    UNAVAILABLE_ERRORS = (IOError, )
+
+    def __init__(
+        self,
+        session,
+        processor_factory,
+        settings=None,
+        batch_size=DEFAULT_BATCH_SIZE,
+        logger=None,
+    ):
+        self.logger = logger or logging.getLogger(__name__)
+        self.session = session
+        self.processor_factory = processor_factory
+        self.settings = settings or {}
+        self.batch_size = batch_size
+
+    def _make_factory(self):
+        return ModelFactory(
+            session=self.session,
+            processor_factory=self.processor_factory,
+            settings=self.settings,
+        )
+
+    def consume(self):
+        """Consume all received callback events, return count of consumed
+        events
+
+        """
+        total = 0
+        while True:
+            count, done = self.consume_batch()
+            total += count
+            if done:
+                return total
+
+    def consume_batch(self):
+        """Consume a batch of received callback events, return a tuple of
+        count of consumed events and whether there is no more event to consume
+        right now
+
+        """
+        factory = self._make_factory()
+        event_model = factory.create_callback_event_model()
+
+        # load the batch and commit right away, as we are going to verify
+        # these events with the processor out of DB transaction
+        with db_transaction.manager:
+            events = [
+                (
+                    event.guid,
+                    event.company_guid,
+                    event.company.processor_key,
+                    json.loads(event.payload),
+                )
+                for event in event_model.list_received(limit=self.batch_size)
+            ]
+        if not events:
+            return 0, True
+        self.logger.info('Verifying %s callback events ...', len(events))
+
+        count = 0
+        interrupted = False
+        for guid, company_guid, processor_key, payload in events:
+            processor = factory.create_processor()
+            processor.configure_api_key(processor_key)
+            # a transient copy for the processor, so that reading its
+            # attributes won't load anything from the database
+            company = tables.Company(
+                guid=company_guid,
+                processor_key=processor_key,
+            )
+            try:
+                update_db = processor.callback(company, payload)
+            except BillyError, e:
+                self._finish(event_model, guid, event_model.statuses.FAILED,
+                             e.msg)
+                count += 1
+                continue
+            except (SystemExit, KeyboardInterrupt):
+                raise
+            except self.UNAVAILABLE_ERRORS:
+                # Notice: the event is still in RECEIVED status, we will try
+                # it again next time, and stop this round as the processor
+                # is probably unavailable right now
+                self.logger.error('Failed to verify callback event %s', guid,
+                                  exc_info=True)
+                interrupted = True
+                break
+            except Exception, e:
+                # a malformed or unexpected payload will never succeed, fail
+                # it, otherwise it blocks all events after it
+                self.logger.error('Failed to verify callback event %s', guid,
+                                  exc_info=True)
+                self._finish(event_model, guid, event_model.statuses.FAILED,
+                             '{}: {}'.format(type(e).__name__, e))
+                count += 1
+                continue
+            self._apply(factory, event_model, guid, update_db)
+            count += 1
+        return count, interrupted or len(events) < self.batch_size
+
+    def _apply(self, factory, event_model, guid, update_db):
+        """Apply a verified callback event in its own DB transaction
+
+        """
+        statuses = event_model.statuses
+        try:
+            with db_transaction.manager:
+                event = event_model.get(guid, raise_error=True,
+                                        with_lockmode='update')
+                # another consumer got it first
+                if event.status != statuses.RECEIVED:
+                    return
+                if update_db is None:
+                    event_model.update_status(event, statuses.IGNORED)
+                    return
+                update_db(factory)
+                event_model.update_status(event, statuses.PROCESSED)
+        except DuplicateEventError, e:
+            self._finish(event_model, guid, statuses.IGNORED, e.msg)
+        except BillyError, e:
+            self._finish(event_model, guid, statuses.FAILED, e.msg)
+        except (SystemExit, KeyboardInterrupt):
+            raise
+        except Exception, e:
+            # the DB transaction was aborted, fail the event in a new one,
+            # so that it won't abort the whole consuming
+            self.logger.error('Failed to apply callback event %s', guid,
+                              exc_info=True)
+            self._finish(event_model, guid, statuses.FAILED,
+                         '{}: {}'.format(type(e).__name__, e))
+
+    def _finish(self, event_model, guid, status, error_message=None):
+        self.logger.info('Callback event %s is %s: %s',
+                         guid, status, error_message)
+        with db_transaction.manager:
+            event = event_model.get(guid, raise_error=True,
+                                    with_lockmode='update')
+            if event.status != event_model.statuses.RECEIVED:
+                return
+            event_model.update_status(event, status, error_message)
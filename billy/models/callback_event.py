@@ -0,0 +1,82 @@
+from __future__ import unicode_literals
+import json
+
+from sqlalchemy.orm import joinedload
+
+from billy.db import tables
+from billy.models.base import BaseTableModel
+from billy.errors import BillyError
+from billy.utils.generic import make_guid
+
+
+class DuplicateCallbackEventError(BillyError):
+    """This error indicates the given callback event was already received by
+    Billy system for the company
+
+    """
+
+
+class CallbackEventModel(BaseTableModel):
+
+    TABLE = tables.CallbackEvent
+
+    statuses = tables.CallbackEventStatus
+
+    def get_by_processor_id(self, company, processor_id):
+        """Get a callback event of company by its processor id
+
+        """
+        query = (
+            self.session.query(tables.CallbackEvent)
+            .filter_by(company_guid=company.guid)
+            .filter_by(processor_id=processor_id)
+        )
+        return query.first()
+
+    def create(self, company, processor_id, payload):
+        """Put a received callback payload into the inbox and return it
+
+        """
+        if self.get_by_processor_id(company, processor_id) is not None:
+            raise DuplicateCallbackEventError(
+                'Callback event {} already exists for {}'.format(
+                    processor_id, company.guid,
+                ),
+            )
+        now = tables.now_func()
+        event = tables.CallbackEvent(
+            guid='CE' + make_guid(),
+            company=company,
+            processor_id=processor_id,
+            payload=unicode(json.dumps(payload)),
+            status=self.statuses.RECEIVED,
+            created_at=now,
+            updated_at=now,
+        )
+        self.session.add(event)
+        self.session.flush()
+        return event
+
+    def list_received(self, limit=None):
+        """List callback events waiting to be applied, oldest first
+
+        """
+        CallbackEvent = tables.CallbackEvent
+        query = (
+            self.session.query(CallbackEvent)
+            .filter(CallbackEvent.status == self.statuses.RECEIVED)
+            .options(joinedload(CallbackEvent.company))
+            .order_by(CallbackEvent.created_at, CallbackEvent.guid)
+        )
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
+    def update_status(self, event, status, error_message=None):
+        """Update status of a callback event
+
+        """
+        event.status = status
+        event.error_message = error_message
+        event.updated_at = tables.now_func()
+        self.session.flush()
@@ -1,4 +1,10 @@
 from __future__ import unicode_literals
+from __future__ import absolute_import
+import datetime
+
+import transaction as db_transaction
+from sqlalchemy import bindparam
+from sqlalchemy.orm import Session
 
 from billy.db import tables
 from billy.models.base import BaseTableModel
@@ -14,16 +20,63 @@ class CompanyModel(BaseTableModel):
         """Get a company by its API key
 
         """
-        query = (
-            self.session.query(tables.Company)
-            .filter_by(api_key=api_key)
-            .filter_by(deleted=not ignore_deleted)
-            .first()
-        )
+        query = self.cached_query(
+            ('api_key', ignore_deleted),
+            lambda query: (
+                query
+                .filter_by(api_key=bindparam('api_key'))
+                .filter_by(deleted=not ignore_deleted)
+                .filter_by(pending=False)
+            ),
+            api_key=api_key,
+        ).first()
         if raise_error and query is None:
             raise KeyError('No such company with API key {}'.format(api_key))
         return query
 
+    def get_by_api_key_cached(self, api_key):
+        """Get a company by its API key like `get_by_api_key`, but look it up
+        in the process-wide API key cache first, so that recently used
+        companies don't cost any query
+
+        """
+        cache = self.factory.settings.get('api_key_cache')
+        if cache is None:
+            return self.get_by_api_key(api_key)
+        cached = cache.get(api_key)
+        if cached is not None:
+            return self.session.merge(cached, load=False)
+        company = self.get_by_api_key(api_key)
+        if company is None:
+            return None
+        # keep a detached copy in the cache, as the company instance belongs
+        # to current session
+        session = Session()
+        cached = session.merge(company, load=False)
+        session.expunge(cached)
+        cache.set(api_key, cached)
+        return company
+
+    def _invalidate_cache(self, company):
+        """Remove the company from the API key cache after current DB
+        transaction commits, evicting it before that would let a concurrent
+        request cache the row not committed yet again
+
+        Notice: the cache is per process, other processes keep serving the
+        company they cached until the TTL expires
+
+        """
+        cache = self.factory.settings.get('api_key_cache')
+        if cache is None:
+            return
+        # the key before updating, it's the one cached
+        api_key = company.api_key
+
+        def invalidate(success):
+            cache.invalidate(api_key)
+
+        db_transaction.get().addAfterCommitHook(invalidate)
+
     def get_by_callback_key(self, callback_key):
         query = (
             self.session.query(tables.Company)
@@ -31,9 +84,20 @@ class CompanyModel(BaseTableModel):
         )
         return query
 
-    def create(self, processor_key, name=None, make_callback_url=None):
+    def create(
+        self,
+        processor_key,
+        name=None,
+        make_callback_url=None,
+        pending=False,
+    ):
         """Create a company and return
 
+        When `pending` is True, the company will only be inserted in pending
+        state, the caller should commit it and call the function returned by
+        `prepare_provision` out of the database transaction, so that we won't
+        hold a database connection during the round trip to the processor
+
         """
         now = tables.now_func()
         company = tables.Company(
@@ -42,25 +106,95 @@ class CompanyModel(BaseTableModel):
             api_key=make_api_key(),
             callback_key=make_api_key(),
             name=name,
+            pending=True,
             created_at=now,
             updated_at=now,
         )
         self.session.add(company)
         self.session.flush()
+        if pending:
+            return company
+
+        provision = self.prepare_provision(company, make_callback_url)
+        update_db = provision()
+        return update_db(self.factory)
 
+    def prepare_provision(self, company, make_callback_url=None):
+        """Prepare provisioning a pending company in the processor, return a
+        function which talks to the processor without touching the database,
+        it returns an `update_db(model_factory)` function for finalizing the
+        company record afterward
+
+        """
+        guid = company.guid
+        processor_key = company.processor_key
+        url = None
         if make_callback_url is not None:
             url = make_callback_url(company)
-            processor = self.factory.create_processor()
-            processor.configure_api_key(company.processor_key)
-            processor.register_callback(company, url)
+        # a transient copy for the processor, so that reading its attributes
+        # won't load anything from the database
+        snapshot = tables.Company(
+            guid=guid,
+            processor_key=processor_key,
+            callback_key=company.callback_key,
+            name=company.name,
+        )
 
-        return company
+        def provision():
+            if url is not None:
+                processor = self.factory.create_processor()
+                processor.configure_api_key(processor_key)
+                processor.register_callback(snapshot, url)
+
+            def update_db(model_factory):
+                model = model_factory.create_company_model()
+                company = model.get(guid, raise_error=True,
+                                    with_lockmode='update')
+                company.pending = False
+                model.session.flush()
+                return company
+
+            return update_db
+
+        return provision
+
+    def discard_pending(self, guid):
+        """Remove a pending company which failed to be provisioned
+
+        """
+        (
+            self.session.query(tables.Company)
+            .filter_by(guid=guid, pending=True)
+            .delete()
+        )
+        self.session.flush()
+
+    def reconcile_pending(self, timeout, now=None):
+        """Mark companies stuck in pending state for more than `timeout`
+        seconds as deleted, return the count of them
+
+        """
+        if now is None:
+            now = tables.now_func()
+        Company = tables.Company
+        deadline = now - datetime.timedelta(seconds=timeout)
+        count = (
+            self.session.query(Company)
+            .filter(Company.pending)
+            .filter(~Company.deleted)
+            .filter(Company.created_at < deadline)
+            .update(dict(deleted=True, updated_at=now),
+                    synchronize_session=False)
+        )
+        self.session.flush()
+        return count
 
     def update(self, company, **kwargs):
         """Update a company
 
         """
         now = tables.now_func()
+        self._invalidate_cache(company)
         company.updated_at = now
         for key in ['name', 'processor_key', 'api_key']:
             if key not in kwargs:
@@ -75,5 +209,7 @@ class CompanyModel(BaseTableModel):
         """Delete a company
 
         """
+        self._invalidate_cache(company)
         company.deleted = True
+        company.updated_at = tables.now_func()
         self.session.flush()
@@ -1,4 +1,5 @@
 from __future__ import unicode_literals
+import datetime
 
 from billy.db import tables
 from billy.models.base import BaseTableModel
@@ -15,7 +16,8 @@ class CustomerModel(BaseTableModel):
 
     @decorate_offset_limit
     def list_by_context(self, context, processor_uri=NOT_SET):
-        """List customer by a given context
+        """List customer by a given context, customers still pending
+        provisioning are not listed
 
         """
         Company = tables.Company
@@ -23,7 +25,7 @@ class CustomerModel(BaseTableModel):
         Plan = tables.Plan
         Subscription = tables.Subscription
 
-        query = self.session.query(Customer)
+        query = self.session.query(Customer).filter(~Customer.pending)
         if isinstance(context, Plan):
             query = (
                 query
@@ -40,15 +42,24 @@ class CustomerModel(BaseTableModel):
 
         if processor_uri is not self.NOT_SET:
             query = query.filter(Customer.processor_uri == processor_uri)
-        query = query.order_by(Customer.created_at.desc())
+        query = query.order_by(
+            Customer.created_at.desc(),
+            Customer.guid.desc(),
+        )
         return query
 
     def create(
         self,
         company,
         processor_uri=None,
+        pending=False,
     ):
-        """Create a customer and return its id
+        """Create a customer and return it
+
+        When `pending` is True, the customer will only be inserted in pending
+        state, the caller should commit it and call the function returned by
+        `prepare_provision` out of the database transaction, so that we won't
+        hold a database connection during the round trip to the processor
 
         """
         now = tables.now_func()
@@ -56,23 +67,91 @@ class CustomerModel(BaseTableModel):
             guid='CU' + make_guid(),
             company=company,
             processor_uri=processor_uri,
+            pending=True,
             created_at=now,
             updated_at=now,
         )
         self.session.add(customer)
         self.session.flush()
+        if pending:
+            return customer
 
-        processor = self.factory.create_processor()
-        processor.configure_api_key(customer.company.processor_key)
-        # create customer
-        if customer.processor_uri is None:
-            customer.processor_uri = processor.create_customer(customer)
-        # validate the customer processor URI
-        else:
-            processor.validate_customer(customer.processor_uri)
+        provision = self.prepare_provision(customer)
+        update_db = provision()
+        return update_db(self.factory)
+
+    def prepare_provision(self, customer):
+        """Prepare provisioning a pending customer in the processor, return a
+        function which talks to the processor without touching the database,
+        it returns an `update_db(model_factory)` function for finalizing the
+        customer record afterward
+
+        """
+        guid = customer.guid
+        processor_uri = customer.processor_uri
+        processor_key = customer.company.processor_key
+        # a transient copy for the processor, so that reading its attributes
+        # won't load anything from the database
+        snapshot = tables.Customer(
+            guid=guid,
+            company_guid=customer.company_guid,
+            processor_uri=processor_uri,
+        )
+
+        def provision():
+            processor = self.factory.create_processor()
+            processor.configure_api_key(processor_key)
+            # create customer
+            if processor_uri is None:
+                new_processor_uri = processor.create_customer(snapshot)
+            # validate the customer processor URI
+            else:
+                processor.validate_customer(processor_uri)
+                new_processor_uri = processor_uri
+
+            def update_db(model_factory):
+                model = model_factory.create_customer_model()
+                customer = model.get(guid, raise_error=True,
+                                     with_lockmode='update')
+                customer.processor_uri = new_processor_uri
+                customer.pending = False
+                model.session.flush()
+                return customer
+
+            return update_db
+
+        return provision
+
+    def discard_pending(self, guid):
+        """Remove a pending customer which failed to be provisioned
 
+        """
+        (
+            self.session.query(tables.Customer)
+            .filter_by(guid=guid, pending=True)
+            .delete()
+        )
+        self.session.flush()
+
+    def reconcile_pending(self, timeout, now=None):
+        """Mark customers stuck in pending state for more than `timeout`
+        seconds as deleted, return the count of them
+
+        """
+        if now is None:
+            now = tables.now_func()
+        Customer = tables.Customer
+        deadline = now - datetime.timedelta(seconds=timeout)
+        count = (
+            self.session.query(Customer)
+            .filter(Customer.pending)
+            .filter(~Customer.deleted)
+            .filter(Customer.created_at < deadline)
+            .update(dict(deleted=True, updated_at=now),
+                    synchronize_session=False)
+        )
         self.session.flush()
-        return customer
+        return count
 
     def update(self, customer, **kwargs):
         """Update a customer
@@ -94,4 +173,5 @@ class CustomerModel(BaseTableModel):
 
         """
         customer.deleted = True
+        customer.updated_at = tables.now_func()
         self.session.flush()
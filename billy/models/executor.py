@@ -0,0 +1,122 @@
+from __future__ import unicode_literals
+from __future__ import absolute_import
+import Queue
+import logging
+import threading
+
+import transaction as db_transaction
+
+from billy.models.model_factory import ModelFactory
+from billy.utils.tracing import Tracer
+
+
+class TransactionExecutor(object):
+    """Transaction executor submits staged transactions to the payment
+    processor in background threads, so that API requests don't have to wait
+    for the round trip to the processor
+
+    """
+
+    def __init__(
+        self,
+        session,
+        processor_factory,
+        settings=None,
+        workers=1,
+        logger=None,
+    ):
+        self.logger = logger or logging.getLogger(__name__)
+        self.session = session
+        self.processor_factory = processor_factory
+        self.settings = settings or {}
+        self.tracer = self.settings.get('tracer') or Tracer()
+        self.workers = workers
+        self.queue = Queue.Queue()
+        self.threads = []
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        """Start worker threads if they are not running yet
+
+        """
+        with self._lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    name='billy-tx-executor-{}'.format(i),
+                )
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            guids = None
+            try:
+                # None is the signal for stopping
+                if item is None:
+                    return
+                guids, trace_context = item
+                self.process(guids, trace_context=trace_context)
+            except (SystemExit, KeyboardInterrupt):
+                raise
+            except Exception:
+                # Notice: the transactions are still in STAGED or RETRYING
+                # status, the process_billy_tx will pick them up later
+                self.logger.error('Failed to process transactions %s',
+                                  guids, exc_info=True)
+            finally:
+                self.queue.task_done()
+
+    def submit(self, guids):
+        """Submit transactions with given GUIDs for processing in background
+
+        :param guids: GUID list of transactions to be processed
+        """
+        guids = list(guids)
+        if not guids:
+            return
+        self._ensure_started()
+        self.logger.debug('Submitted transactions %s', guids)
+        # continue the trace of the submitter in the worker thread
+        self.queue.put((guids, self.tracer.current_context()))
+
+    def process(self, guids, trace_context=None):
+        """Process transactions with given GUIDs in a new database transaction
+
+        :param guids: GUID list of transactions to be processed
+        :param trace_context: context of the span submitted the transactions
+        """
+        factory = ModelFactory(
+            session=self.session,
+            processor_factory=self.processor_factory,
+            settings=self.settings,
+        )
+        tx_model = factory.create_transaction_model()
+        try:
+            with self.tracer.span(
+                'TransactionExecutor.process',
+                parent=trace_context,
+                transactions=len(guids),
+            ):
+                with db_transaction.manager:
+                    tx_model.process_transactions(guids=guids)
+        finally:
+            self.session.remove()
+
+    def shutdown(self, wait=True):
+        """Stop all worker threads
+
+        :param wait: wait until all submitted transactions are processed
+        """
+        with self._lock:
+            threads = self.threads
+            self.threads = []
+        for _ in threads:
+            self.queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
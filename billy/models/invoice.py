@@ -1,16 +1,24 @@
 from __future__ import unicode_literals
 
 from sqlalchemy.sql.expression import func
+from sqlalchemy.sql.expression import select
 
 from billy.db import tables
 from billy.models.base import BaseTableModel
 from billy.models.base import decorate_offset_limit
+from billy.models.base import load_relationships
 from billy.models.plan import PlanModel
 from billy.models.transaction import TransactionModel
 from billy.errors import BillyError
 from billy.utils.generic import make_guid
 
 
+def _int_or_none(value):
+    if value is None:
+        return None
+    return int(value)
+
+
 class InvalidOperationError(BillyError):
     """This error indicates an invalid operation to invoice model, such as
     updating an invoice's funding_instrument_uri in wrong status
@@ -42,9 +50,13 @@ class InvoiceModel(BaseTableModel):
     # statuses of invoice
     statuses = tables.InvoiceStatus
 
+    LIST_RELATIONSHIPS = ('items', 'adjustments')
+
     @decorate_offset_limit
-    def list_by_context(self, context, external_id=NOT_SET):
-        """Get invoices of a given context
+    def list_by_context(self, context, external_id=NOT_SET,
+                        relationships=None):
+        """Get invoices of a given context, relationships to load in a batch
+        can be given, items and adjustments are loaded by default
 
         """
         Company = tables.Company
@@ -59,14 +71,6 @@ class InvoiceModel(BaseTableModel):
         subscription_invoice_query = self.session.query(SubscriptionInvoice)
         # joined customer invoice query
         customer_invoice_query = self.session.query(CustomerInvoice)
-        # joined customer query
-        customer_query = (
-            customer_invoice_query
-            .join(
-                Customer,
-                Customer.guid == CustomerInvoice.customer_guid,
-            )
-        )
         # joined subscription query
         subscription_query = (
             subscription_invoice_query
@@ -75,14 +79,6 @@ class InvoiceModel(BaseTableModel):
                 Subscription.guid == SubscriptionInvoice.subscription_guid,
             )
         )
-        # joined plan query
-        plan_query = (
-            subscription_query
-            .join(
-                Plan,
-                Plan.guid == Subscription.plan_guid,
-            )
-        )
 
         if isinstance(context, Customer):
             query = (
@@ -102,20 +98,11 @@ class InvoiceModel(BaseTableModel):
                 .order_by(SubscriptionInvoice.scheduled_at.desc())
             )
         elif isinstance(context, Company):
-            q1 = (
-                plan_query
-                .filter(Plan.company == context)
-                .from_self(Invoice.guid)
-            )
-            q2 = (
-                customer_query
-                .filter(Customer.company == context)
-                .from_self(Invoice.guid)
-            )
-            guid_query = q1.union(q2)
             query = (
                 self.session.query(Invoice)
-                .filter(Invoice.guid.in_(guid_query))
+                # load columns of subscription and customer invoices too
+                .with_polymorphic('*')
+                .filter(Invoice.company_guid == context.guid)
             )
         else:
             raise ValueError('Unsupported context {}'.format(context))
@@ -130,9 +117,79 @@ class InvoiceModel(BaseTableModel):
                 .filter(CustomerInvoice.external_id == external_id)
             )
 
-        query = query.order_by(Invoice.created_at.desc())
+        if relationships is None:
+            relationships = self.LIST_RELATIONSHIPS
+        query = load_relationships(query, relationships)
+        query = query.order_by(
+            Invoice.created_at.desc(),
+            Invoice.guid.desc(),
+        )
+        return query
+
+    def export_query(self, company_guid, since=None, until=None):
+        """Build a select of plain invoice rows of a company created in
+        [since, until) for exporting, without ORM hydration
+
+        """
+        Invoice = tables.Invoice
+        invoice = Invoice.__table__
+        customer_invoice = tables.CustomerInvoice.__table__
+        subscription_invoice = tables.SubscriptionInvoice.__table__
+        query = (
+            select(
+                [
+                    Invoice.guid,
+                    Invoice.invoice_type,
+                    Invoice.transaction_type,
+                    Invoice.status,
+                    Invoice.amount,
+                    Invoice.effective_amount,
+                    Invoice.total_adjustment_amount,
+                    Invoice.title,
+                    Invoice.funding_instrument_uri,
+                    Invoice.appears_on_statement_as,
+                    customer_invoice.c.customer_guid,
+                    customer_invoice.c.external_id,
+                    subscription_invoice.c.subscription_guid,
+                    subscription_invoice.c.scheduled_at,
+                    Invoice.created_at,
+                    Invoice.updated_at,
+                ],
+                from_obj=[
+                    invoice
+                    .outerjoin(customer_invoice)
+                    .outerjoin(subscription_invoice)
+                ],
+            )
+            .where(Invoice.company_guid == company_guid)
+            .order_by(Invoice.created_at, Invoice.guid)
+        )
+        if since is not None:
+            query = query.where(Invoice.created_at >= since)
+        if until is not None:
+            query = query.where(Invoice.created_at < until)
         return query
 
+    def list_existing_external_ids(self, customer_guids, external_ids):
+        """Find invoices of given customers with any of given external IDs,
+        return a set of (customer_guid, external_id) pairs of them
+
+        """
+        CustomerInvoice = tables.CustomerInvoice
+        customer_guids = list(set(customer_guids))
+        external_ids = list(set(external_ids))
+        if not customer_guids or not external_ids:
+            return set()
+        query = (
+            self.session.query(
+                CustomerInvoice.customer_guid,
+                CustomerInvoice.external_id,
+            )
+            .filter(CustomerInvoice.customer_guid.in_(customer_guids))
+            .filter(CustomerInvoice.external_id.in_(external_ids))
+        )
+        return set(query)
+
     def _create_transaction(self, invoice):
         """Create a charge/payout transaction from the given invoice and return
 
@@ -173,6 +230,7 @@ class InvoiceModel(BaseTableModel):
             invoice_cls = tables.CustomerInvoice
             # we only support charge type for customer invoice now
             transaction_type = self.transaction_types.DEBIT
+            company_guid = customer.company_guid
             extra_kwargs = dict(
                 customer=customer,
                 external_id=external_id,
@@ -189,6 +247,7 @@ class InvoiceModel(BaseTableModel):
                 transaction_type = self.transaction_types.CREDIT
             else:
                 raise ValueError('Invalid plan_type {}'.format(plan_type))
+            company_guid = subscription.plan.company_guid
             extra_kwargs = dict(
                 subscription=subscription,
                 scheduled_at=scheduled_at,
@@ -202,10 +261,13 @@ class InvoiceModel(BaseTableModel):
         now = tables.now_func()
         invoice = invoice_cls(
             guid='IV' + make_guid(),
+            company_guid=company_guid,
             invoice_type=invoice_type,
             transaction_type=transaction_type,
             status=self.statuses.STAGED,
             amount=amount,
+            total_adjustment_amount=0,
+            effective_amount=amount,
             funding_instrument_uri=funding_instrument_uri,
             title=title,
             created_at=now,
@@ -226,32 +288,43 @@ class InvoiceModel(BaseTableModel):
                 .format(customer.guid, external_id)
             )
 
+        # Notice: items and adjustments are inserted with one executemany
+        # each instead of adding them through the ORM one by one, so that
+        # invoices with thousands of items can be created quickly
         if items:
-            for item in items:
-                record = tables.Item(
-                    invoice=invoice,
+            self.session.execute(tables.Item.__table__.insert(), [
+                dict(
+                    invoice_guid=invoice.guid,
                     name=item['name'],
-                    amount=item['amount'],
+                    amount=int(item['amount']),
                     type=item.get('type'),
-                    quantity=item.get('quantity'),
+                    quantity=_int_or_none(item.get('quantity')),
                     unit=item.get('unit'),
-                    volume=item.get('volume'),
+                    volume=_int_or_none(item.get('volume')),
                 )
-                self.session.add(record)
-            self.session.flush()
+                for item in items
+            ])
 
         # TODO: what about an invalid adjust? say, it makes the total of invoice
         # a negative value? I think we should not allow user to create such
         # invalid invoice
         if adjustments:
-            for adjustment in adjustments:
-                record = tables.Adjustment(
-                    invoice=invoice,
-                    amount=adjustment['amount'],
+            rows = [
+                dict(
+                    invoice_guid=invoice.guid,
+                    amount=int(adjustment['amount']),
                     reason=adjustment.get('reason'),
                 )
-                self.session.add(record)
-            self.session.flush()
+                for adjustment in adjustments
+            ]
+            self.session.execute(tables.Adjustment.__table__.insert(), rows)
+            invoice.total_adjustment_amount = sum(row['amount'] for row in rows)
+            invoice.effective_amount = (
+                invoice.amount + invoice.total_adjustment_amount
+            )
+        if items or adjustments:
+            # they are loaded from database when they are accessed
+            self.session.expire(invoice, ['items', 'adjustments'])
 
         # as if we set the funding_instrument_uri at very first, we want to charge it
         # immediately, so we create a transaction right away, also set the
@@ -267,6 +340,24 @@ class InvoiceModel(BaseTableModel):
         self.session.flush()
         return invoice
 
+    def add_adjustment(self, invoice, amount, reason=None):
+        """Add an adjustment to the invoice and return it, stored adjustment
+        amounts of the invoice are updated accordingly
+
+        """
+        amount = int(amount)
+        adjustment = tables.Adjustment(
+            invoice=invoice,
+            amount=amount,
+            reason=reason,
+        )
+        self.session.add(adjustment)
+        invoice.total_adjustment_amount += amount
+        invoice.effective_amount = (
+            invoice.amount + invoice.total_adjustment_amount
+        )
+        return adjustment
+
     def update_funding_instrument_uri(self, invoice, funding_instrument_uri):
         """Update the funding_instrument_uri of an invoice, as it may yield
         transactions, we don't want to put this in `update` method
@@ -369,6 +460,7 @@ class InvoiceModel(BaseTableModel):
             )
         self.get(invoice.guid, with_lockmode='update')
         invoice.status = self.statuses.CANCELED
+        invoice.updated_at = now
 
         # those transactions which are still running
         running_transactions = (
@@ -0,0 +1,65 @@
+from __future__ import unicode_literals
+
+
+class RecordLoader(object):
+    """Request scoped cache of records keyed by (table, guid), so that form
+    validators and views share the records they look up instead of querying
+    them again
+
+    Notice: the identity map of SQLAlchemy session only holds weak
+    references, a record loaded by a validator and thrown away is gone
+    before the view asks for it again, this loader keeps strong references
+    to them
+
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.records = {}
+
+    def _cached(self, table, guid):
+        record = self.records.get((table, guid))
+        # the session could be cleared or removed since then
+        if record is not None and record not in self.session:
+            del self.records[(table, guid)]
+            return None
+        return record
+
+    def get(self, table, guid, load=None):
+        """Get a record of the table by guid, return None if there is no
+        such record, `load` is called with the guid to load the record if it
+        is not loaded yet
+
+        """
+        record = self._cached(table, guid)
+        if record is None:
+            if load is None:
+                load = self.session.query(table).get
+            record = load(guid)
+            if record is not None:
+                self.records[(table, guid)] = record
+        return record
+
+    def prefetch(self, table, guids):
+        """Load records of the table with given guids which are not loaded
+        yet in one query
+
+        """
+        missing = set(
+            guid for guid in guids
+            if guid is not None and self._cached(table, guid) is None
+        )
+        if not missing:
+            return
+        query = (
+            self.session.query(table)
+            .filter(table.guid.in_(sorted(missing)))
+        )
+        for record in query:
+            self.records[(table, record.guid)] = record
+
+    def clear(self):
+        """Forget all loaded records
+
+        """
+        self.records.clear()
@@ -1,5 +1,8 @@
 from __future__ import unicode_literals
 
+from billy.models.loader import RecordLoader
+from billy.models.billing_run import BillingRunModel
+from billy.models.callback_event import CallbackEventModel
 from billy.models.company import CompanyModel
 from billy.models.customer import CustomerModel
 from billy.models.plan import PlanModel
@@ -7,6 +10,8 @@ from billy.models.invoice import InvoiceModel
 from billy.models.subscription import SubscriptionModel
 from billy.models.transaction import TransactionModel
 from billy.models.transaction_failure import TransactionFailureModel
+from billy.models.processors.instrumented import InstrumentedProcessor
+from billy.models.tracing import TracedModel
 
 
 class ModelFactory(object):
@@ -15,51 +20,74 @@ class ModelFactory(object):
         self.session = session
         self.settings = settings or {}
         self.processor_factory = processor_factory
+        #: cache of records shared by models created by this factory
+        self.loader = RecordLoader(session)
+        #: tracer of model methods and processor calls, if tracing is enabled
+        self.tracer = self.settings.get('tracer')
+        if self.tracer is not None and not self.tracer.enabled:
+            self.tracer = None
+
+    def _traced(self, model):
+        if self.tracer is None:
+            return model
+        return TracedModel(model, self.tracer)
 
     def create_processor(self):
-        """Create a processor
+        """Create a processor, calls to it are observed by metrics and traced
 
         """
-        return self.processor_factory()
+        return InstrumentedProcessor(self.processor_factory(), self.tracer)
 
     def create_company_model(self):
         """Create a company model
 
         """
-        return CompanyModel(self)
+        return self._traced(CompanyModel(self))
 
     def create_customer_model(self):
         """Create a customer model
 
         """
-        return CustomerModel(self)
+        return self._traced(CustomerModel(self))
 
     def create_plan_model(self):
         """Create a plan model
 
         """
-        return PlanModel(self)
+        return self._traced(PlanModel(self))
 
     def create_invoice_model(self):
         """Create an invoice model
 
         """
-        return InvoiceModel(self)
+        return self._traced(InvoiceModel(self))
 
     def create_subscription_model(self):
         """Create a subscription model
 
         """
-        return SubscriptionModel(self)
+        return self._traced(SubscriptionModel(self))
 
     def create_transaction_model(self):
         """Create a transaction model
 
         """
-        return TransactionModel(self)
+        return self._traced(TransactionModel(self))
 
     def create_transaction_failure_model(self):
         """Create a transaction failure model
 
         """
-        return TransactionFailureModel(self)
+        return self._traced(TransactionFailureModel(self))
+
+    def create_callback_event_model(self):
+        """Create a callback event model
+
+        """
+        return self._traced(CallbackEventModel(self))
+
+    def create_billing_run_model(self):
+        """Create a billing run model
+
+        """
+        return self._traced(BillingRunModel(self))
@@ -28,7 +28,10 @@ class PlanModel(BaseTableModel):
         else:
             raise ValueError('Unsupported context {}'.format(context))
 
-        query = query.order_by(Plan.created_at.desc())
+        query = query.order_by(
+            Plan.created_at.desc(),
+            Plan.guid.desc(),
+        )
         return query
 
     def create(
@@ -85,4 +88,5 @@ class PlanModel(BaseTableModel):
 
         """
         plan.deleted = True
+        plan.updated_at = tables.now_func()
         self.session.flush()
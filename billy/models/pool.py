@@ -0,0 +1,194 @@
+from __future__ import unicode_literals
+import time
+import logging
+import threading
+
+from sqlalchemy import event
+from sqlalchemy import engine_from_config
+from sqlalchemy.exc import DisconnectionError
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from pyramid.settings import asbool
+
+
+class PoolStats(object):
+    """Thread-safe statistics of a connection pool, they are recorded by
+    event listeners of the pool
+
+    """
+
+    def __init__(self, name, logger=None):
+        self.name = name
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        #: count of connections checked out
+        self.checkouts = 0
+        #: total and the longest seconds waited for checking out connections
+        self.checkout_seconds = 0.0
+        self.max_checkout_seconds = 0.0
+        #: count of connections checked out and not returned yet, and the
+        #  highest count ever
+        self.in_use = 0
+        self.max_in_use = 0
+        #: count of database connections opened
+        self.connects = 0
+        #: count of connections opened beyond the pool size
+        self.overflows = 0
+        #: count of checkouts gave up waiting for a connection
+        self.timeouts = 0
+        #: count of dead connections found by pre-ping
+        self.disconnects = 0
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.checkout_seconds += seconds
+            self.max_checkout_seconds = max(self.max_checkout_seconds, seconds)
+
+    def record_checkout(self):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+
+    def record_checkin(self):
+        with self._lock:
+            self.in_use = max(self.in_use - 1, 0)
+
+    def record_connect(self, overflow):
+        with self._lock:
+            self.connects += 1
+            if overflow > 0:
+                self.overflows += 1
+        if overflow > 0:
+            self.logger.warning(
+                'Connection pool %s overflows, %s connections beyond pool '
+                'size are open', self.name, overflow,
+            )
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+        self.logger.error(
+            'Connection pool %s timed out waiting for a connection',
+            self.name,
+        )
+
+    def record_disconnect(self):
+        with self._lock:
+            self.disconnects += 1
+
+    def snapshot(self):
+        """Return a dict of current statistics
+
+        """
+        with self._lock:
+            return dict(
+                checkouts=self.checkouts,
+                checkout_seconds=self.checkout_seconds,
+                max_checkout_seconds=self.max_checkout_seconds,
+                in_use=self.in_use,
+                max_in_use=self.max_in_use,
+                connects=self.connects,
+                overflows=self.overflows,
+                timeouts=self.timeouts,
+                disconnects=self.disconnects,
+            )
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool which records time waited for checking out connections,
+    subclasses made by `instrumented_pool_class` provide the stats
+
+    """
+
+    #: the `PoolStats` to record in
+    stats = None
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            return super(InstrumentedQueuePool, self)._do_get()
+        except TimeoutError:
+            self.stats.record_timeout()
+            raise
+        finally:
+            self.stats.record_wait(time.time() - start)
+
+
+def instrumented_pool_class(stats):
+    """Make a QueuePool class records in given stats, the class is kept
+    when the pool is recreated by disposing the engine
+
+    """
+    return type(
+        str('InstrumentedQueuePool'),
+        (InstrumentedQueuePool, ),
+        dict(stats=stats),
+    )
+
+
+def ping_connection(stats):
+    """Make a checkout listener which tests the connection with a trivial
+    query, dead connections are replaced by the pool with new ones, so that
+    we won't fail a request with a connection closed by the database
+    server in the meantime
+
+    """
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        try:
+            cursor = dbapi_connection.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            finally:
+                cursor.close()
+        except Exception:
+            stats.record_disconnect()
+            # the pool will try again with a new connection
+            raise DisconnectionError()
+    return checkout
+
+
+def engine_from_settings(settings, prefix, name):
+    """Create an engine from settings with given prefix like
+    `engine_from_config` does, with the instrumented connection pool, and
+    return (engine, stats)
+
+    Besides the pool arguments of `create_engine`, such as `pool_size`,
+    `max_overflow`, `pool_timeout` and `pool_recycle`, `pool_pre_ping` can
+    be set to test connections when they are checked out
+
+    """
+    options = dict(
+        (key, value) for key, value in settings.iteritems()
+        if key.startswith(prefix)
+    )
+    pre_ping = asbool(options.pop(prefix + 'pool_pre_ping', False))
+    stats = PoolStats(name)
+    url = make_url(options[prefix + 'url'])
+    poolclass = options.get(prefix + 'poolclass')
+    if poolclass is None:
+        poolclass = url.get_dialect().get_pool_class(url)
+    # only QueuePool waits for connections, others open them on demand
+    if poolclass is QueuePool:
+        options[prefix + 'poolclass'] = instrumented_pool_class(stats)
+    engine = engine_from_config(options, prefix)
+
+    def connect(dbapi_connection, connection_record):
+        overflow = 0
+        if isinstance(engine.pool, QueuePool):
+            overflow = engine.pool.overflow()
+        stats.record_connect(overflow)
+
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        stats.record_checkout()
+
+    def checkin(dbapi_connection, connection_record):
+        stats.record_checkin()
+
+    if pre_ping:
+        event.listen(engine, 'checkout', ping_connection(stats))
+    event.listen(engine, 'connect', connect)
+    event.listen(engine, 'checkout', checkout)
+    event.listen(engine, 'checkin', checkin)
+    return engine, stats
@@ -93,6 +93,14 @@ class BalancedProcessor(PaymentProcessor):
         balanced.configure(api_key)
         self._configured_api_key = True
 
+    def get_callback_event_id(self, payload):
+        try:
+            return payload['id']
+        except (KeyError, TypeError):
+            raise InvalidCallbackPayload(
+                'Invalid callback payload without event id'
+            )
+
     @ensure_api_key_configured
     def callback(self, company, payload):
         self.logger.info(
@@ -108,6 +116,11 @@ class BalancedProcessor(PaymentProcessor):
             uri = '/v1/events/{}'.format(payload['id'])
             event = self.event_cls.fetch(uri)
         except balanced.exc.BalancedError, e:
+            # Notice: a server error of Balanced says nothing about the
+            # event, raise it as it is (an IOError), so that the event is
+            # verified again later instead of being failed
+            if getattr(e, 'status_code', 0) >= 500:
+                raise
             raise InvalidCallbackPayload(
                 'Invalid callback payload '
                 'BalancedError: {}'.format(e)
@@ -145,7 +158,9 @@ class BalancedProcessor(PaymentProcessor):
             transaction = transaction_model.get(guid)
             if transaction is None:
                 raise InvalidCallbackPayload('Transaction {} does not exist'.format(guid))
-            if transaction.company != company:
+            # Notice: compare by guid, as the given company could be a
+            # transient copy of the record
+            if transaction.company_guid != company.guid:
                 raise InvalidCallbackPayload('No access to other company')
             transaction_model.add_event(
                 transaction=transaction,
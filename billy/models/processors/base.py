@@ -21,6 +21,15 @@ class PaymentProcessor(object):
         """
         raise NotImplementedError
 
+    def get_callback_event_id(self, payload):
+        """Get the id of event in payment processor from callback payload, it
+        is used for deduplicating callbacks before they are verified
+
+        :param payload: the callback payload
+        :return: the id of event in payment processor
+        """
+        raise NotImplementedError
+
     def register_callback(self, company, url):
         """Register callback in the payment processor
 
@@ -0,0 +1,49 @@
+from __future__ import unicode_literals
+
+from billy.metrics import PROCESSOR_CALL_DURATION
+from billy.metrics import PROCESSOR_ERRORS
+
+
+class InstrumentedProcessor(object):
+    """A proxy of payment processor which observes latency and counts errors
+    of processor calls by operation, and runs public methods of the
+    processor in spans if a tracer is given, other attributes are passed to
+    the processor as they are
+
+    """
+
+    #: names of processor methods to instrument
+    OPERATIONS = frozenset([
+        'debit',
+        'credit',
+        'refund',
+        'prepare_customer',
+        'callback',
+    ])
+
+    def __init__(self, processor, tracer=None):
+        self.processor = processor
+        self.tracer = tracer
+
+    def _instrument(self, operation, method):
+        def call(*args, **kwargs):
+            with PROCESSOR_CALL_DURATION.time(operation=operation):
+                try:
+                    return method(*args, **kwargs)
+                except Exception:
+                    PROCESSOR_ERRORS.inc(operation=operation)
+                    raise
+        return call
+
+    def __getattr__(self, name):
+        value = getattr(self.processor, name)
+        if name in self.OPERATIONS:
+            value = self._instrument(name, value)
+        if (
+            self.tracer is not None and
+            not name.startswith('_') and
+            callable(value)
+        ):
+            span_name = '{}.{}'.format(type(self.processor).__name__, name)
+            value = self.tracer.wrap(span_name, value)
+        return value
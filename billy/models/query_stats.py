@@ -0,0 +1,138 @@
+from __future__ import unicode_literals
+import time
+import threading
+import contextlib
+
+from sqlalchemy import event
+
+_local = threading.local()
+
+
+class QueryStats(object):
+    """Count and total seconds of SQL statements executed in a scope, with
+    the statements themselves (at most `max_statements` of them)
+
+    """
+
+    def __init__(self, max_statements=100):
+        self.max_statements = max_statements
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = []
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        if len(self.statements) < self.max_statements:
+            self.statements.append((statement, seconds))
+
+    def exceeds(self, max_count=None, max_seconds=None):
+        """Return whether the count or the time exceeds given thresholds
+
+        """
+        return (
+            (max_count is not None and self.count > max_count) or
+            (max_seconds is not None and self.seconds > max_seconds)
+        )
+
+    def format_statements(self):
+        """Format recorded statements for logging
+
+        """
+        return '\n'.join(
+            '[{:.1f} ms] {}'.format(seconds * 1000, statement)
+            for statement, seconds in self.statements
+        )
+
+
+def _active_stats():
+    return getattr(_local, 'stack', None)
+
+
+@contextlib.contextmanager
+def record_queries(max_statements=100):
+    """Record SQL statements executed by current thread in the block into a
+    `QueryStats`, scopes can be nested, a statement is recorded in all
+    enclosing scopes
+
+    """
+    stats = QueryStats(max_statements=max_statements)
+    stack = _active_stats()
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(stats)
+    try:
+        yield stats
+    finally:
+        stack.remove(stats)
+
+
+def _before_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+):
+    if _active_stats():
+        conn.info['query_start_time'] = time.time()
+
+
+def _after_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+):
+    stack = _active_stats()
+    start_time = conn.info.pop('query_start_time', None)
+    if not stack or start_time is None:
+        return
+    seconds = time.time() - start_time
+    for stats in stack:
+        stats.record(statement, seconds)
+
+
+def instrument_engine(engine):
+    """Listen to SQL execution of the engine, so that its statements are
+    recorded by `record_queries`
+
+    """
+    if event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        return
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def query_thresholds(settings, prefix):
+    """Get (max_count, max_seconds) thresholds of SQL statements from
+    `max_count` and `max_db_time` (in milliseconds) settings with given
+    prefix, either of them is None if it is not set
+
+    """
+    max_count = settings.get(prefix + 'max_count')
+    if max_count:
+        max_count = int(max_count)
+    else:
+        max_count = None
+    max_time = settings.get(prefix + 'max_db_time')
+    if max_time:
+        max_seconds = float(max_time) / 1000
+    else:
+        max_seconds = None
+    return max_count, max_seconds
+
+
+def log_query_stats(logger, name, stats, max_count=None, max_seconds=None):
+    """Log count and time of statements recorded for the named operation,
+    with the statements if they exceed given thresholds
+
+    """
+    if stats.exceeds(max_count, max_seconds):
+        logger.warning(
+            '%s executed %s SQL statements in %.1f ms:\n%s',
+            name,
+            stats.count,
+            stats.seconds * 1000,
+            stats.format_statements(),
+        )
+    else:
+        logger.info(
+            '%s executed %s SQL statements in %.1f ms',
+            name,
+            stats.count,
+            stats.seconds * 1000,
+        )
@@ -0,0 +1,121 @@
+from __future__ import unicode_literals
+import time
+import logging
+import threading
+
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import SelectBase
+
+#: queries of replication lag in seconds of a replica for dialects which
+#  can tell, replicas of other dialects are considered to be up to date
+LAG_QUERIES = dict(
+    postgresql=(
+        'SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())'
+    ),
+)
+
+
+class Replica(object):
+    """A read-only replica of the database, it is only used when its
+    replication lag is no more than `max_lag` seconds, the lag is checked at
+    most once every `check_interval` seconds
+
+    """
+
+    def __init__(
+        self,
+        engine,
+        max_lag=5,
+        check_interval=1,
+        timer=time.time,
+        logger=None,
+    ):
+        self.engine = engine
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.timer = timer
+        self.logger = logger or logging.getLogger(__name__)
+        self._usable = True
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def lag(self):
+        """Query replication lag of the replica in seconds
+
+        """
+        query = LAG_QUERIES.get(self.engine.dialect.name)
+        if query is None:
+            return 0
+        lag = self.engine.scalar(query)
+        # not replaying anything, it is not a replica actually
+        if lag is None:
+            return 0
+        return float(lag)
+
+    def usable(self):
+        """Return whether the replica is up to date enough to read from, if
+        it lags behind too far or it is not available, reads should fall
+        back to the primary
+
+        """
+        now = self.timer()
+        with self._lock:
+            if (
+                self._checked_at is not None and
+                now - self._checked_at < self.check_interval
+            ):
+                return self._usable
+            self._checked_at = now
+        try:
+            lag = self.lag()
+        except DBAPIError, e:
+            self.logger.warning('Failed to check replica lag, %s', e)
+            usable = False
+        else:
+            usable = lag <= self.max_lag
+            if not usable:
+                self.logger.warning(
+                    'Replica lags %s seconds behind, read from primary', lag,
+                )
+        self._usable = usable
+        return usable
+
+
+def is_read(clause):
+    """Return whether the clause only reads without locking rows
+
+    """
+    return (
+        isinstance(clause, SelectBase) and
+        getattr(clause, '_for_update_arg', None) is None
+    )
+
+
+class RoutingSession(Session):
+    """Session which sends SELECT statements to the replica when reading
+    from replica is enabled with `use_replica`, until anything else is
+    executed, the statements after that stay on the primary, so that they
+    can see what was written
+
+    """
+
+    def __init__(self, replica=None, **kwargs):
+        super(RoutingSession, self).__init__(**kwargs)
+        self.replica = replica
+
+    def use_replica(self, enabled=True):
+        """Enable or disable reading from the replica, and forget whether
+        anything is written
+
+        """
+        self.info['use_replica'] = enabled
+        self.info['written'] = False
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.replica is not None and self.info.get('use_replica'):
+            if not is_read(clause):
+                self.info['written'] = True
+            elif not self.info.get('written') and self.replica.usable():
+                return self.replica.engine
+        return super(RoutingSession, self).get_bind(mapper, clause)
@@ -1,11 +1,15 @@
 from __future__ import unicode_literals
 
+from sqlalchemy.orm import undefer
+from sqlalchemy.orm import joinedload
 from sqlalchemy.sql.expression import not_
 
 from billy.db import tables
 from billy.models.base import BaseTableModel
 from billy.models.base import decorate_offset_limit
+from billy.models.base import load_relationships
 from billy.models.schedule import next_transaction_datetime
+from billy.metrics import INVOICES_YIELDED
 from billy.errors import BillyError
 from billy.utils.generic import make_guid
 
@@ -22,8 +26,9 @@ class SubscriptionModel(BaseTableModel):
     TABLE = tables.Subscription
 
     @decorate_offset_limit
-    def list_by_context(self, context):
-        """List subscriptions by a given context
+    def list_by_context(self, context, relationships=None):
+        """List subscriptions by a given context, relationships to load in a
+        batch can be given
 
         """
         Company = tables.Company
@@ -31,7 +36,11 @@ class SubscriptionModel(BaseTableModel):
         Plan = tables.Plan
         Subscription = tables.Subscription
 
-        query = self.session.query(Subscription)
+        query = (
+            self.session.query(Subscription)
+            .options(undefer('invoice_count'))
+            .options(joinedload('plan'))
+        )
         if isinstance(context, Plan):
             query = query.filter(Subscription.plan == context)
         elif isinstance(context, Customer):
@@ -48,7 +57,13 @@ class SubscriptionModel(BaseTableModel):
         else:
             raise ValueError('Unsupported context {}'.format(context))
 
-        query = query.order_by(Subscription.created_at.desc())
+        if relationships is None:
+            relationships = self.LIST_RELATIONSHIPS
+        query = load_relationships(query, relationships)
+        query = query.order_by(
+            Subscription.created_at.desc(),
+            Subscription.guid.desc(),
+        )
         return query
 
     def create(
@@ -117,6 +132,7 @@ class SubscriptionModel(BaseTableModel):
         now = tables.now_func()
         subscription.canceled = True
         subscription.canceled_at = now
+        subscription.updated_at = now
         # TODO: what about refund?
 
     def yield_invoices(self, subscriptions=None, now=None):
@@ -171,6 +187,9 @@ class SubscriptionModel(BaseTableModel):
                     scheduled_at=subscription.next_invoice_at,
                     appears_on_statement_as=subscription.appears_on_statement_as,
                 )
+                INVOICES_YIELDED.inc()
+                # invoice_count is a column property, reload it
+                self.session.expire(subscription, ['invoice_count'])
                 self.logger.info(
                     'Created subscription invoice for %s, guid=%s, '
                     'plan_type=%s, funding_instrument_uri=%s, '
@@ -190,6 +209,7 @@ class SubscriptionModel(BaseTableModel):
                     period=subscription.invoice_count,
                     interval=subscription.plan.interval,
                 )
+                subscription.updated_at = tables.now_func()
                 self.logger.info(
                     'Schedule next invoice of %s at %s (period=%s)',
                     subscription.guid,
@@ -0,0 +1,96 @@
+from __future__ import unicode_literals
+import inspect
+
+from sqlalchemy import event
+from pyramid.path import DottedNameResolver
+
+from billy.utils.tracing import Tracer
+from billy.utils.tracing import JSONLinesExporter
+from billy.utils.tracing import current_span
+
+
+def jsonlines_exporter(settings):
+    """Make an exporter appends spans to the `billy.tracing.file`
+
+    """
+    return JSONLinesExporter(settings['billy.tracing.file'])
+
+
+def tracer_from_settings(settings):
+    """Create a tracer from settings, spans are passed to the exporter made
+    by the `billy.tracing.exporter` factory (called with settings), or
+    written to the `billy.tracing.file` if only it is set. Tracing is
+    disabled if neither of them is set
+
+    """
+    exporter_factory = settings.get('billy.tracing.exporter')
+    if exporter_factory is None and settings.get('billy.tracing.file'):
+        exporter_factory = jsonlines_exporter
+    exporter = None
+    if exporter_factory is not None:
+        resolver = DottedNameResolver()
+        exporter = resolver.maybe_resolve(exporter_factory)(settings)
+    return Tracer(
+        exporter=exporter,
+        sample_rate=float(settings.get('billy.tracing.sample_rate', 1.0)),
+    )
+
+
+class TracedModel(object):
+    """A proxy of model which runs public methods of the model in spans
+
+    """
+
+    def __init__(self, model, tracer):
+        self.__dict__['_model'] = model
+        self.__dict__['_tracer'] = tracer
+
+    def __getattr__(self, name):
+        value = getattr(self._model, name)
+        if name.startswith('_') or not inspect.ismethod(value):
+            return value
+        span_name = '{}.{}'.format(type(self._model).__name__, name)
+        return self._tracer.wrap(span_name, value)
+
+    def __setattr__(self, name, value):
+        setattr(self._model, name, value)
+
+
+def _before_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+):
+    parent = current_span()
+    if parent is None or not parent.sampled:
+        return
+    conn.info['tracing_span'] = parent.tracer.start_span(
+        'SQL',
+        parent=parent,
+        statement=statement,
+        executemany=executemany,
+    )
+
+
+def _after_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+):
+    span = conn.info.pop('tracing_span', None)
+    if span is not None:
+        span.finish()
+
+
+def _dbapi_error(conn, cursor, statement, parameters, context, exception):
+    span = conn.info.pop('tracing_span', None)
+    if span is not None:
+        span.finish(exception)
+
+
+def trace_engine(engine):
+    """Listen to SQL execution of the engine, so that statements executed
+    in spans are traced as their children
+
+    """
+    if event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        return
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'dbapi_error', _dbapi_error)
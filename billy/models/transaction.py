@@ -1,11 +1,16 @@
 from __future__ import unicode_literals
 
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.expression import select
+from sqlalchemy.sql.expression import exists
+from sqlalchemy.sql.expression import literal
+from sqlalchemy.sql.functions import count
 
 from billy.db import tables
 from billy.models.base import BaseTableModel
 from billy.models.base import decorate_offset_limit
+from billy.models.base import load_relationships
 from billy.errors import BillyError
+from billy.metrics import TRANSACTIONS_PROCESSED
 from billy.utils.generic import make_guid
 
 
@@ -29,6 +34,8 @@ class TransactionModel(BaseTableModel):
 
     statuses = tables.TransactionStatus
 
+    LIST_RELATIONSHIPS = ('failures', )
+
     @property
     def maximum_retry(self):
         maximum_retry = int(self.factory.settings.get(
@@ -37,6 +44,35 @@ class TransactionModel(BaseTableModel):
         ))
         return maximum_retry
 
+    def export_query(self, company_guid, since=None, until=None):
+        """Build a select of plain transaction rows of a company created in
+        [since, until) for exporting, without ORM hydration
+
+        """
+        Transaction = tables.Transaction
+        query = (
+            select([
+                Transaction.guid,
+                Transaction.invoice_guid,
+                Transaction.transaction_type,
+                Transaction.submit_status,
+                Transaction.status,
+                Transaction.amount,
+                Transaction.funding_instrument_uri,
+                Transaction.processor_uri,
+                Transaction.appears_on_statement_as,
+                Transaction.created_at,
+                Transaction.updated_at,
+            ])
+            .where(Transaction.company_guid == company_guid)
+            .order_by(Transaction.created_at, Transaction.guid)
+        )
+        if since is not None:
+            query = query.where(Transaction.created_at >= since)
+        if until is not None:
+            query = query.where(Transaction.created_at < until)
+        return query
+
     def get_last_transaction(self):
         """Get last transaction
 
@@ -48,9 +84,26 @@ class TransactionModel(BaseTableModel):
         )
         return query.first()
 
+    def count_by_submit_status(self, submit_statuses):
+        """Count transactions in given submit statuses, return a dict maps
+        the statuses to counts
+
+        """
+        Transaction = tables.Transaction
+        query = (
+            self.session
+            .query(Transaction.submit_status, count(Transaction.guid))
+            .filter(Transaction.submit_status.in_(submit_statuses))
+            .group_by(Transaction.submit_status)
+        )
+        counts = dict((status, 0) for status in submit_statuses)
+        counts.update(query)
+        return counts
+
     @decorate_offset_limit
-    def list_by_context(self, context):
-        """List transactions by a given context
+    def list_by_context(self, context, relationships=None):
+        """List transactions by a given context, relationships to load in a
+        batch can be given, failures are loaded by default
 
         """
         Company = tables.Company
@@ -88,22 +141,6 @@ class TransactionModel(BaseTableModel):
                 Subscription.guid == SubscriptionInvoice.subscription_guid,
             )
         )
-        # joined customer query
-        customer_query = (
-            customer_invoice_query
-            .join(
-                Customer,
-                Customer.guid == CustomerInvoice.customer_guid,
-            )
-        )
-        # joined plan query
-        plan_query = (
-            subscription_query
-            .join(
-                Plan,
-                Plan.guid == Subscription.plan_guid,
-            )
-        )
 
         if isinstance(context, Invoice):
             query = (
@@ -126,19 +163,20 @@ class TransactionModel(BaseTableModel):
                 .filter(Subscription.plan == context)
             )
         elif isinstance(context, Company):
-            q1 = (
-                plan_query
-                .filter(Plan.company == context)
-            )
-            q2 = (
-                customer_query
-                .filter(Customer.company == context)
+            query = (
+                basic_query
+                .filter(Transaction.company_guid == context.guid)
             )
-            query = q1.union(q2)
         else:
             raise ValueError('Unsupported context {}'.format(context))
 
-        query = query.order_by(Transaction.created_at.desc())
+        if relationships is None:
+            relationships = self.LIST_RELATIONSHIPS
+        query = load_relationships(query, relationships)
+        query = query.order_by(
+            Transaction.created_at.desc(),
+            Transaction.guid.desc(),
+        )
         return query
 
     def create(
@@ -176,6 +214,7 @@ class TransactionModel(BaseTableModel):
         now = tables.now_func()
         transaction = tables.Transaction(
             guid='TX' + make_guid(),
+            company_guid=invoice.company_guid,
             transaction_type=transaction_type,
             amount=amount,
             funding_instrument_uri=funding_instrument_uri,
@@ -204,25 +243,41 @@ class TransactionModel(BaseTableModel):
         """Add a status updating event of transaction from callback
 
         """
+        TransactionEvent = tables.TransactionEvent
+        columns = TransactionEvent.__table__.c
         now = tables.now_func()
-        # the latest event of this transaction
-        last_event = transaction.events.first()
+        # lock the transaction, so that events of the same transaction are
+        # added one by one, then the existence check below won't race
+        self.get(transaction.guid, with_lockmode='update')
 
-        event = tables.TransactionEvent(
-            guid='TE' + make_guid(),
-            transaction=transaction,
-            processor_id=processor_id,
-            occurred_at=occurred_at,
-            status=status,
-            created_at=now,
+        # Notice: insert the event only when it doesn't exist, so that a
+        # duplicate event won't raise IntegrityError and roll back the whole
+        # unit of work
+        values = [
+            ('guid', 'TE' + make_guid()),
+            ('transaction_guid', transaction.guid),
+            ('processor_id', processor_id),
+            ('occurred_at', occurred_at),
+            ('status', status),
+            ('created_at', now),
+        ]
+        exists_query = (
+            select([columns.guid])
+            .where(columns.transaction_guid == transaction.guid)
+            .where(columns.processor_id == processor_id)
         )
-        self.session.add(event)
-        
-        # ensure won't duplicate
-        try:
-            self.session.flush()
-        except IntegrityError:
-            self.session.rollback()
+        stmt = (
+            TransactionEvent.__table__.insert()
+            .from_select(
+                [name for name, _ in values],
+                select([
+                    literal(value, type_=columns[name].type)
+                    for name, value in values
+                ]).where(~exists(exists_query)),
+            )
+        )
+        result = self.session.execute(stmt)
+        if not result.rowcount:
             raise DuplicateEventError(
                 'Event {} already exists for {}'.format(
                     processor_id, transaction.guid,
@@ -248,12 +303,14 @@ class TransactionModel(BaseTableModel):
         # attackers can send us an old `succeeded` event to make the invoice
         # settled.  This is why we need to ensure only the latest event can
         # affect status of invoice.
-        if last_event is not None and occurred_at <= last_event.occurred_at:
+        last_occurred_at = transaction.last_event_occurred_at
+        if last_occurred_at is not None and occurred_at <= last_occurred_at:
             return
 
         old_status = transaction.status
         transaction.updated_at = now
         transaction.status = status
+        transaction.last_event_occurred_at = occurred_at
         # update invoice status
         invoice_model = self.factory.create_invoice_model()
         invoice_model.transaction_status_update(
@@ -334,6 +391,7 @@ class TransactionModel(BaseTableModel):
                                   'transaction %s failed', self.maximum_retry,
                                   transaction.guid)
                 transaction.submit_status = self.submit_statuses.FAILED
+                TRANSACTIONS_PROCESSED.inc(result='failed')
 
                 # the transaction is failed, update invoice status
                 if transaction.transaction_type in [
@@ -341,6 +399,9 @@ class TransactionModel(BaseTableModel):
                     self.types.CREDIT,
                 ]:
                     transaction.invoice.status = invoice_model.statuses.FAILED
+                    transaction.invoice.updated_at = now
+            else:
+                TRANSACTIONS_PROCESSED.inc(result='retried')
             transaction.updated_at = now
             self.session.flush()
             return
@@ -350,6 +411,7 @@ class TransactionModel(BaseTableModel):
         transaction.status = result['status']
         transaction.submit_status = self.submit_statuses.DONE
         transaction.updated_at = tables.now_func()
+        TRANSACTIONS_PROCESSED.inc(result='succeeded')
         invoice_model.transaction_status_update(
             invoice=transaction.invoice,
             transaction=transaction,
@@ -362,9 +424,13 @@ class TransactionModel(BaseTableModel):
                          transaction.guid, transaction.submit_status,
                          result)
 
-    def process_transactions(self, transactions=None):
+    def process_transactions(self, transactions=None, guids=None):
         """Process all transactions
 
+        :param transactions: transactions to process, all STAGED and RETRYING
+            transactions will be processed by default
+        :param guids: only process STAGED and RETRYING transactions with
+            these GUIDs
         """
         Transaction = tables.Transaction
         query = (
@@ -374,6 +440,8 @@ class TransactionModel(BaseTableModel):
                 self.submit_statuses.RETRYING]
             ))
         )
+        if guids is not None:
+            query = query.filter(Transaction.guid.in_(guids))
         if transactions is not None:
             query = transactions
 
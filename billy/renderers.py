@@ -5,6 +5,157 @@ from pyramid.settings import asbool
 
 from billy.db import tables
 from billy.models.invoice import InvoiceModel
+from billy.api.utils import RecordStream
+from billy.api.fields import get_response_shape
+from billy.api.fields import wants_field
+from billy.api.fields import expansions_of
+
+
+class StreamingJSON(JSON):
+    """JSON renderer which writes items of list responses incrementally
+    through the response app_iter when they are given as a `RecordStream`
+
+    """
+
+    #: placeholder for the items in the serialized list response
+    ITEMS_PLACEHOLDER = '__billy_items__'
+
+    def __call__(self, info):
+        render = super(StreamingJSON, self).__call__(info)
+
+        def _render(value, system):
+            request = system.get('request')
+            if (
+                request is None or
+                not isinstance(value, dict) or
+                not isinstance(value.get('items'), RecordStream)
+            ):
+                return render(value, system)
+            response = request.response
+            if response.content_type == response.default_content_type:
+                response.content_type = 'application/json'
+            response.app_iter = self._iter_list(value, request)
+            return None
+
+        return _render
+
+    def _iter_list(self, value, request):
+        """Serialize the first chunk of records right away, and return an
+        iterator yields the whole list response piece by piece
+
+        """
+        default = self._make_default(request)
+        indent = self.kw.get('indent')
+        separators = self.kw.get('separators') or (', ', ': ')
+        if indent:
+            item_indent = '\n' + ' ' * (indent * 2)
+            closing = '\n' + ' ' * indent + ']'
+        else:
+            item_indent = ''
+            closing = ']'
+        item_separator = separators[0].rstrip() + item_indent
+        stream = value['items']
+
+        def dump_envelope():
+            envelope = dict(value, items=self.ITEMS_PLACEHOLDER)
+            envelope['next_cursor'] = stream.next_cursor
+            return self.serializer(envelope, default=default, **self.kw)
+
+        def dump_records(records, first):
+            parts = []
+            for record in records:
+                item = self.serializer(record, default=default, **self.kw)
+                if indent:
+                    item = item.replace('\n', item_indent)
+                if not first:
+                    parts.append(item_separator)
+                else:
+                    parts.append('[' + item_indent)
+                first = False
+                parts.append(item)
+            return ''.join(parts).encode('utf8')
+
+        prefix, _ = dump_envelope().split(
+            '"{}"'.format(self.ITEMS_PLACEHOLDER)
+        )
+        chunks = stream.iter_chunks()
+        # Notice: the first chunk was fetched in the request transaction, we
+        # need to serialize it before the transaction is over
+        head = list(next(chunks))
+        empty = not head
+        head = prefix.encode('utf8') + dump_records(head, first=True)
+
+        def iter_body(empty):
+            yield head
+            for records in chunks:
+                yield dump_records(records, first=empty)
+                empty = empty and not records
+            _, suffix = dump_envelope().split(
+                '"{}"'.format(self.ITEMS_PLACEHOLDER)
+            )
+            if empty:
+                yield ('[]' + suffix).encode('utf8')
+            else:
+                yield (closing + suffix).encode('utf8')
+
+        return iter_body(empty)
+
+
+def find_adapter(record, adapters):
+    """Find the adapter of a record from a dict maps table classes to
+    adapters
+
+    """
+    for cls in type(record).__mro__:
+        if cls in adapters:
+            return adapters[cls]
+    raise TypeError('No adapter for {!r}'.format(record))
+
+
+def render_related(related, request, adapters):
+    """Render records of an expanded relationship with all their fields
+
+    """
+    if related is None:
+        return None
+    shape = get_response_shape(request)
+    # Notice: fields parameter only applies to records at the top level
+    request._response_shape = (None, frozenset())
+    try:
+        if isinstance(related, list):
+            return [
+                find_adapter(record, adapters)(record, request)
+                for record in related
+            ]
+        return find_adapter(related, adapters)(related, request)
+    finally:
+        request._response_shape = shape
+
+
+def shaped_adapter(adapter, adapters):
+    """Wrap an adapter to apply `fields` and `expand` parameters of the
+    request to records in the response
+
+    """
+    def _adapter(record, request):
+        fields, expand = get_response_shape(request)
+        value = adapter(record, request)
+        expansions = expansions_of(record)
+        for name in expand:
+            if name not in expansions:
+                continue
+            value[name] = render_related(
+                getattr(record, name),
+                request,
+                adapters,
+            )
+        if fields is not None:
+            value = dict(
+                (key, item) for key, item in value.iteritems()
+                if key == 'guid' or key in fields or key in expand
+            )
+        return value
+    return _adapter
 
 
 def company_adapter(company, request):
@@ -38,22 +189,25 @@ def customer_adapter(customer, request):
 
 
 def invoice_adapter(invoice, request):
+    # Notice: items and adjustments are not loaded unless they are asked for
     items = []
-    for item in invoice.items:
-        items.append(dict(
-            name=item.name,
-            amount=item.amount,
-            type=item.type,
-            quantity=item.quantity,
-            volume=item.volume,
-            unit=item.unit,
-        ))
+    if wants_field(request, 'items'):
+        for item in invoice.items:
+            items.append(dict(
+                name=item.name,
+                amount=item.amount,
+                type=item.type,
+                quantity=item.quantity,
+                volume=item.volume,
+                unit=item.unit,
+            ))
     adjustments = []
-    for adjustment in invoice.adjustments:
-        adjustments.append(dict(
-            amount=adjustment.amount,
-            reason=adjustment.reason,
-        ))
+    if wants_field(request, 'adjustments'):
+        for adjustment in invoice.adjustments:
+            adjustments.append(dict(
+                amount=adjustment.amount,
+                reason=adjustment.reason,
+            ))
 
     if invoice.invoice_type == InvoiceModel.types.SUBSCRIPTION:
         extra_args = dict(
@@ -122,10 +276,16 @@ def subscription_adapter(subscription, request):
 
 
 def transaction_adapter(transaction, request):
-    serialized_failures = [
-        transaction_failure_adapter(f, request)
-        for f in transaction.failures
-    ]
+    # Notice: failures are not loaded unless they are asked for
+    serialized_failures = []
+    failure_count = 0
+    if wants_field(request, 'failures'):
+        serialized_failures = [
+            transaction_failure_adapter(f, request)
+            for f in transaction.failures
+        ]
+    if wants_field(request, 'failure_count'):
+        failure_count = transaction.failure_count
     return dict(
         guid=transaction.guid,
         invoice_guid=transaction.invoice_guid,
@@ -136,7 +296,7 @@ def transaction_adapter(transaction, request):
         funding_instrument_uri=transaction.funding_instrument_uri,
         processor_uri=transaction.processor_uri,
         appears_on_statement_as=transaction.appears_on_statement_as,
-        failure_count=transaction.failure_count,
+        failure_count=failure_count,
         failures=serialized_failures,
         created_at=transaction.created_at.isoformat(),
         updated_at=transaction.updated_at.isoformat(),
@@ -161,19 +321,23 @@ def enum_symbol(enum_value):
 
 def includeme(config):
     settings = config.registry.settings
-    kwargs = {}
     cfg_key = 'api.json.pretty_print'
-    pretty_print = settings.get(cfg_key, True)
+    pretty_print = asbool(settings.get(cfg_key, True))
     if pretty_print:
         kwargs = dict(sort_keys=True, indent=4, separators=(',', ': '))
+    else:
+        kwargs = dict(sort_keys=True, separators=(',', ':'))
 
-    json_renderer = JSON(**kwargs)
-    json_renderer.add_adapter(tables.Company, company_adapter)
-    json_renderer.add_adapter(tables.Customer, customer_adapter)
-    json_renderer.add_adapter(tables.Invoice, invoice_adapter)
-    json_renderer.add_adapter(tables.Plan, plan_adapter)
-    json_renderer.add_adapter(tables.Subscription, subscription_adapter)
-    json_renderer.add_adapter(tables.Transaction, transaction_adapter)
-    json_renderer.add_adapter(tables.TransactionFailure,
-                              transaction_failure_adapter)
+    json_renderer = StreamingJSON(**kwargs)
+    adapters = {
+        tables.Company: company_adapter,
+        tables.Customer: customer_adapter,
+        tables.Invoice: invoice_adapter,
+        tables.Plan: plan_adapter,
+        tables.Subscription: subscription_adapter,
+        tables.Transaction: transaction_adapter,
+        tables.TransactionFailure: transaction_failure_adapter,
+    }
+    for table, adapter in adapters.iteritems():
+        json_renderer.add_adapter(table, shaped_adapter(adapter, adapters))
     config.add_renderer('json', json_renderer)
@@ -6,6 +6,7 @@ from pyramid.decorator import reify
 from pyramid.events import NewResponse
 from pyramid.events import NewRequest
 from pyramid.events import subscriber
+from sqlalchemy.orm import scoped_session
 
 from billy.models.model_factory import ModelFactory
 from billy.api.utils import get_processor_factory
@@ -61,3 +62,28 @@ def clean_db_session(event):
     db_session_cleanup = asbool(settings.get('db_session_cleanup', True))
     if db_session_cleanup:
         event.request.add_finished_callback(clean_up)
+
+
+#: request methods which never write, their queries can be sent to the
+#  replica database
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+@subscriber(NewRequest)
+def route_db_session(event):
+    """Send queries of safe requests to the replica database if there is
+    one, until anything is written in the request
+
+    """
+    request = event.request
+    session = request.session
+    if isinstance(session, scoped_session):
+        session = session()
+    if getattr(session, 'replica', None) is None:
+        return
+    session.use_replica(request.method in SAFE_METHODS)
+
+    def clean_up(request):
+        session.use_replica(False)
+
+    request.add_finished_callback(clean_up)
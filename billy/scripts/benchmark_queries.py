@@ -0,0 +1,114 @@
+"""Micro-benchmark of hot model lookups, compares per-call time of building
+and compiling the queries every time with the cached statements used by the
+models
+
+    python -m billy.scripts.benchmark_queries [db_url] [number]
+
+"""
+from __future__ import unicode_literals
+from __future__ import print_function
+import sys
+import timeit
+
+import transaction as db_transaction
+from sqlalchemy.orm import contains_eager
+
+from billy.db import tables
+from billy.models import setup_database
+from billy.models.model_factory import ModelFactory
+
+
+def setup_records(db_url):
+    settings = setup_database({}, **{'sqlalchemy.url': db_url})
+    tables.DeclarativeBase.metadata.create_all(settings['engine'])
+    factory = ModelFactory(settings['session'], settings=settings)
+    company_model = factory.create_company_model()
+    customer_model = factory.create_customer_model()
+    plan_model = factory.create_plan_model()
+    subscription_model = factory.create_subscription_model()
+    with db_transaction.manager:
+        company = company_model.create(processor_key='BENCHMARK')
+        # pending customers are not provisioned with the processor
+        customer = customer_model.create(company=company, pending=True)
+        plan = plan_model.create(
+            company=company,
+            plan_type=plan_model.types.DEBIT,
+            amount=10,
+            frequency=plan_model.frequencies.MONTHLY,
+        )
+        subscription = subscription_model.create(
+            customer=customer,
+            plan=plan,
+        )
+    return factory, dict(
+        api_key=company.api_key,
+        customer_guid=customer.guid,
+        subscription_guid=subscription.guid,
+    )
+
+
+def main(argv=sys.argv):
+    db_url = argv[1] if len(argv) > 1 else 'sqlite:///'
+    number = int(argv[2]) if len(argv) > 2 else 2000
+    factory, values = setup_records(db_url)
+    session = factory.session
+    Company = tables.Company
+    Customer = tables.Customer
+    Subscription = tables.Subscription
+
+    def uncached_get():
+        return session.query(Customer).get(values['customer_guid'])
+
+    def uncached_get_joined():
+        return (
+            session.query(Subscription)
+            .join(Subscription.plan)
+            .options(contains_eager(Subscription.plan))
+            .filter(Subscription.guid == values['subscription_guid'])
+            .first()
+        )
+
+    def uncached_get_by_api_key():
+        return (
+            session.query(Company)
+            .filter_by(api_key=values['api_key'])
+            .filter_by(deleted=False)
+            .filter_by(pending=False)
+            .first()
+        )
+
+    def cached_get():
+        model = factory.create_customer_model()
+        return model.get(values['customer_guid'])
+
+    def cached_get_joined():
+        model = factory.create_subscription_model()
+        return model.get_joined(values['subscription_guid'], ('plan', ))
+
+    def cached_get_by_api_key():
+        model = factory.create_company_model()
+        return model.get_by_api_key(values['api_key'])
+
+    def measure(func):
+        def call():
+            # start from an empty identity map, so that every call queries
+            session.expunge_all()
+            func()
+        call()
+        return timeit.timeit(call, number=number) / number * 1000000
+
+    print('{:<16}{:>12}{:>12}'.format('lookup', 'before (us)', 'after (us)'))
+    for name, before, after in [
+        ('get', uncached_get, cached_get),
+        ('get_joined', uncached_get_joined, cached_get_joined),
+        ('get_by_api_key', uncached_get_by_api_key, cached_get_by_api_key),
+    ]:
+        print('{:<16}{:>12.1f}{:>12.1f}'.format(
+            name,
+            measure(before),
+            measure(after),
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,11 @@
 from __future__ import unicode_literals
 import os
 import sys
+import pstats
+import cProfile
 import logging
+import StringIO
+import contextlib
 
 import transaction as db_transaction
 from pyramid.paster import (
@@ -11,49 +15,227 @@ from pyramid.paster import (
 
 from billy.models import setup_database
 from billy.models.model_factory import ModelFactory
+from billy.models.billing_run import RunSummary
+from billy.models.callback_consumer import CallbackEventConsumer
+from billy.models.processors.instrumented import InstrumentedProcessor
+from billy.models.query_stats import QueryStats
+from billy.models.query_stats import record_queries
+from billy.models.query_stats import log_query_stats
+from billy.models.query_stats import query_thresholds
 from billy.api.utils import get_processor_factory
+from billy.metrics import REGISTRY
+from billy.metrics import PROCESSOR_CALL_DURATION
+from billy.metrics import collect_backlog
+from billy.metrics import collect_pool_stats
 
 
 def usage(argv):
     cmd = os.path.basename(argv[0])
-    print('usage: %s <config_uri>\n'
+    print('usage: %s [--profile=<pstats_file>] <config_uri>\n'
           '(example: "%s development.ini")' % (cmd, cmd))
     sys.exit(1)
 
 
+def parse_args(argv):
+    """Parse command line arguments and return (config_uri, profile_path)
+
+    """
+    profile_path = None
+    args = []
+    for arg in argv[1:]:
+        if arg.startswith('--profile='):
+            profile_path = arg[len('--profile='):]
+            if not profile_path:
+                usage(argv)
+        elif arg.startswith('--'):
+            usage(argv)
+        else:
+            args.append(arg)
+    if len(args) != 1:
+        usage(argv)
+    return args[0], profile_path
+
+
+def write_metrics(path):
+    """Write metrics into the file for the textfile collector of Prometheus
+    node exporter, the file is replaced atomically so that the collector
+    never reads a partial one
+
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as metrics_file:
+        metrics_file.write(REGISTRY.render().encode('utf8'))
+    os.rename(temp_path, path)
+
+
+def write_profile(profiler, path, logger):
+    """Write pstats output of the profiler to the file, and log functions
+    take most cumulative time
+
+    """
+    profiler.dump_stats(path)
+    output = StringIO.StringIO()
+    stats = pstats.Stats(path, stream=output)
+    stats.sort_stats('cumulative').print_stats(20)
+    logger.info('Wrote profile to %s, top functions by cumulative time:\n%s',
+                path, output.getvalue())
+
+
+def processor_seconds():
+    """Total seconds this process spent in calling the payment processor
+
+    """
+    return sum(
+        PROCESSOR_CALL_DURATION.get(operation=operation)[1]
+        for operation in InstrumentedProcessor.OPERATIONS
+    )
+
+
+def run(factory, consumer, summary, track_queries, logger):
+    """Run all phases of billing and collect the summary
+
+    """
+    company_model = factory.create_company_model()
+    customer_model = factory.create_customer_model()
+    subscription_model = factory.create_subscription_model()
+    tx_model = factory.create_transaction_model()
+
+    # records stay in pending state only if the process crashed during
+    # provisioning them, give up the ones which are stuck for too long
+    pending_timeout = int(factory.settings.get(
+        'billy.provision.pending_timeout', 3600
+    ))
+    with summary.phase('reconcile'):
+        with db_transaction.manager:
+            logger.info('Reconciling pending records ...')
+            with track_queries('CompanyModel.reconcile_pending'):
+                count = company_model.reconcile_pending(pending_timeout)
+            with track_queries('CustomerModel.reconcile_pending'):
+                count += customer_model.reconcile_pending(pending_timeout)
+            logger.info('Marked %s stale pending records as deleted', count)
+
+    # apply callback events buffered in the inbox first, so that we have
+    # latest transaction statuses
+    with summary.phase('callback'):
+        logger.info('Consuming callback events ...')
+        with track_queries('CallbackEventConsumer.consume'):
+            count = consumer.consume()
+        logger.info('Consumed %s callback events', count)
+
+    # yield all transactions and commit before we process them, so that
+    # we won't double process them.
+    # Notice: statements are tracked with the commit, so that the ones
+    # flushed by it are counted too
+    with summary.phase('yield'):
+        logger.info('Yielding transaction ...')
+        with track_queries('SubscriptionModel.yield_invoices'):
+            with db_transaction.manager:
+                invoices = subscription_model.yield_invoices()
+                summary.invoices_yielded = len(invoices)
+
+    with summary.phase('process'):
+        logger.info('Processing transaction ...')
+        with track_queries('TransactionModel.process_transactions'):
+            with db_transaction.manager:
+                transactions = tx_model.process_transactions()
+                summary.count_transactions(transactions)
+
+
 def main(argv=sys.argv, processor=None):
     logger = logging.getLogger(__name__)
 
-    if len(argv) != 2:
-        usage(argv)
-    config_uri = argv[1]
+    config_uri, profile_path = parse_args(argv)
     setup_logging(config_uri)
     settings = get_appsettings(config_uri)
     settings = setup_database({}, **settings)
 
     session = settings['session']
-    try:
-        if processor is None:
-            processor_factory = get_processor_factory(settings)
-        else:
-            processor_factory = lambda: processor
-        factory = ModelFactory(
-            session=session,
-            processor_factory=processor_factory,
-            settings=settings,
-        )
-        subscription_model = factory.create_subscription_model()
-        tx_model = factory.create_transaction_model()
+    max_count, max_seconds = query_thresholds(
+        settings,
+        'billy.query_stats.batch_',
+    )
 
-        # yield all transactions and commit before we process them, so that
-        # we won't double process them.
-        with db_transaction.manager:
-            logger.info('Yielding transaction ...')
-            subscription_model.yield_invoices()
+    @contextlib.contextmanager
+    def track_queries(name):
+        """Log SQL statements executed by the named model method
 
-        with db_transaction.manager:
-            logger.info('Processing transaction ...')
-            tx_model.process_transactions()
+        """
+        with record_queries() as stats:
+            yield
+        log_query_stats(logger, name, stats, max_count, max_seconds)
+
+    if processor is None:
+        processor_factory = get_processor_factory(settings)
+    else:
+        processor_factory = lambda: processor
+    factory = ModelFactory(
+        session=session,
+        processor_factory=processor_factory,
+        settings=settings,
+    )
+    consumer = CallbackEventConsumer(
+        session=session,
+        processor_factory=processor_factory,
+        settings=settings,
+        batch_size=int(settings.get(
+            'billy.callback.batch_size',
+            CallbackEventConsumer.DEFAULT_BATCH_SIZE,
+        )),
+    )
+
+    summary = RunSummary()
+    # processor calls are timed by metrics of the process, the run takes
+    # the difference
+    start_processor_seconds = processor_seconds()
+    profiler = None
+    if profile_path:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    error = None
+    # replaced by the recording one once the run starts, so that the summary
+    # can still be saved when we fail before that
+    run_stats = QueryStats()
+    try:
+        with record_queries() as run_stats:
+            # the whole run is traced as one trace
+            with settings['tracer'].span('process_billy_tx'):
+                run(factory, consumer, summary, track_queries, logger)
+
+        metrics_path = settings.get('billy.metrics.textfile')
+        if metrics_path:
+            with db_transaction.manager:
+                collect_backlog(factory.create_transaction_model())
+            collect_pool_stats(settings['pool_stats'])
+            write_metrics(metrics_path)
+            logger.info('Wrote metrics to %s', metrics_path)
         logger.info('Done')
+    except BaseException, e:
+        error = e
+        raise
     finally:
+        if profiler is not None:
+            profiler.disable()
+            write_profile(profiler, profile_path, logger)
+            summary.profile_path = profile_path
+        summary.processor_seconds = (
+            processor_seconds() - start_processor_seconds
+        )
+        summary.db_statements = run_stats.count
+        summary.db_seconds = run_stats.seconds
+        summary.finish(error)
+        logger.info(summary.format())
+        # keep the summary, so that we can track how long runs take over
+        # time, but never fail the run because of it.
+        # Notice: aborting the transaction doesn't roll back the session kept
+        # by the zope transaction extension, roll it back for the run failed
+        # with a database error, otherwise the session is unusable
+        try:
+            session.rollback()
+            with db_transaction.manager:
+                factory.create_billing_run_model().create(summary)
+        except Exception:
+            logger.error('Failed to save the billing run summary',
+                         exc_info=True)
         session.close()
+        for name, stats in sorted(settings['pool_stats'].iteritems()):
+            logger.info('Connection pool %s: %s', name, stats.snapshot())
@@ -22,6 +22,9 @@ class DummyProcessor(object):
 
         return update_db
 
+    def get_callback_event_id(self, payload):
+        return payload['id']
+
     def register_callback(self, company, url):
         pass
 
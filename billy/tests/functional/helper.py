@@ -2,6 +2,7 @@ from __future__ import unicode_literals
 import os
 import unittest
 
+from sqlalchemy import event
 from webtest import TestApp
 from pyramid.testing import DummyRequest
 
@@ -57,9 +58,36 @@ class ViewTestCase(unittest.TestCase):
         self.invoice_model = self.model_factory.create_invoice_model()
         self.transaction_model = self.model_factory.create_transaction_model()
         self.transaction_failure_model = self.model_factory.create_transaction_failure_model()
+        self.callback_event_model = self.model_factory.create_callback_event_model()
 
     def tearDown(self):
         self.testapp.session.close()
         self.testapp.session.remove()
         DeclarativeBase.metadata.drop_all()
         self.testapp.session.bind.dispose()
+
+    def capture_queries(self, func, *args, **kwargs):
+        """Call the given function and return SQL statements it executed
+
+        """
+        engine = self.settings['engine']
+        statements = []
+
+        def before_cursor_execute(
+            conn, cursor, statement, parameters, context, executemany
+        ):
+            statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            func(*args, **kwargs)
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        return statements
+
+    def count_queries(self, func, *args, **kwargs):
+        """Call the given function and return count of SQL statements it
+        executed
+
+        """
+        return len(self.capture_queries(func, *args, **kwargs))
@@ -1,6 +1,8 @@
 from __future__ import unicode_literals
 import base64
 
+import transaction as db_transaction
+
 from webtest.app import TestRequest
 
 from billy.api.auth import get_remote_user
@@ -73,3 +75,80 @@ class TestAuth(ViewTestCase):
 
         self.assertEqual(response, 'RESPONSE')
         self.assertEqual(called, [True])
+
+    def test_company_lookup_is_cached(self):
+        with db_transaction.manager:
+            company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+        api_key = str(company.api_key)
+        url = '/v1/companies/{}'.format(company.guid)
+
+        def get():
+            self.testapp.session.expunge_all()
+            self.testapp.get(
+                url,
+                extra_environ=dict(REMOTE_USER=api_key),
+                status=200,
+            )
+
+        # the first request looks the company up only once
+        self.assertEqual(self.count_queries(get), 2)
+        # then it is served from the cache
+        self.assertEqual(self.count_queries(get), 1)
+
+    def test_company_cache_invalidated_after_commit(self):
+        with db_transaction.manager:
+            company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+            guid = company.guid
+        api_key = str(company.api_key)
+        cache = self.settings['api_key_cache']
+        self.company_model.get_by_api_key_cached(api_key)
+        self.assertNotEqual(cache.get(api_key), None)
+
+        with db_transaction.manager:
+            company = self.company_model.get(guid)
+            self.company_model.update(company, api_key='NEW_API_KEY')
+            # a concurrent request may still cache the committed row until
+            # this transaction commits
+            self.assertNotEqual(cache.get(api_key), None)
+        self.assertEqual(cache.get(api_key), None)
+
+    def test_company_cache_invalidation(self):
+        with db_transaction.manager:
+            company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+            guid = company.guid
+        old_api_key = str(company.api_key)
+        url = '/v1/companies/{}'.format(guid)
+        self.testapp.get(
+            url,
+            extra_environ=dict(REMOTE_USER=old_api_key),
+            status=200,
+        )
+
+        with db_transaction.manager:
+            company = self.company_model.get(guid)
+            self.company_model.update(company, api_key='NEW_API_KEY')
+        self.testapp.get(
+            url,
+            extra_environ=dict(REMOTE_USER=old_api_key),
+            status=403,
+        )
+        self.testapp.get(
+            url,
+            extra_environ=dict(REMOTE_USER=b'NEW_API_KEY'),
+            status=200,
+        )
+
+        with db_transaction.manager:
+            company = self.company_model.get(guid)
+            self.company_model.delete(company)
+        self.testapp.get(
+            url,
+            extra_environ=dict(REMOTE_USER=b'NEW_API_KEY'),
+            status=403,
+        )
@@ -0,0 +1,381 @@
+from __future__ import unicode_literals
+import json
+
+import mock
+import transaction as db_transaction
+from freezegun import freeze_time
+
+from billy.models.customer import CustomerModel
+from billy.models.invoice import InvoiceModel
+from billy.models.subscription import SubscriptionModel
+from billy.models.transaction import TransactionModel
+from billy.tests.functional.helper import ViewTestCase
+
+
+@freeze_time('2013-08-16')
+class TestBulk(ViewTestCase):
+
+    def setUp(self):
+        super(TestBulk, self).setUp()
+        with db_transaction.manager:
+            self.company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+            self.customer = self.customer_model.create(
+                company=self.company,
+            )
+            self.plan = self.plan_model.create(
+                company=self.company,
+                plan_type=self.plan_model.types.DEBIT,
+                amount=1000,
+                frequency=self.plan_model.frequencies.MONTHLY,
+            )
+            other_company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+            self.other_customer = self.customer_model.create(
+                company=other_company,
+            )
+        self.api_key = str(self.company.api_key)
+
+    def post(self, url, body, status=200):
+        if not isinstance(body, basestring):
+            body = json.dumps(body)
+        return self.testapp.post(
+            url,
+            body,
+            content_type=b'application/json',
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=status,
+        )
+
+    def test_bulk_customers(self):
+        self.testapp.app.registry.settings['billy.bulk.chunk_size'] = 2
+        res = self.post('/v1/customers/bulk', [
+            dict(),
+            dict(processor_uri='MOCK_URI'),
+            dict(),
+        ])
+        results = res.json['items']
+        self.assertEqual([result['index'] for result in results], [0, 1, 2])
+        for result in results:
+            customer = self.customer_model.get(result['guid'])
+            self.assertEqual(customer.company_guid, self.company.guid)
+            self.assertFalse(customer.pending)
+        customer = self.customer_model.get(results[1]['guid'])
+        self.assertEqual(customer.processor_uri, 'MOCK_URI')
+
+    def test_bulk_customers_jsonl(self):
+        body = '\n'.join([json.dumps(dict()), '', json.dumps(dict())])
+        res = self.post('/v1/customers/bulk', body)
+        self.assertEqual(len(res.json['items']), 2)
+        for result in res.json['items']:
+            self.assertNotEqual(self.customer_model.get(result['guid']), None)
+
+    @mock.patch('billy.tests.fixtures.processor.DummyProcessor.validate_customer')
+    def test_bulk_customers_with_provision_failure(self, validate_method):
+        def validate_customer(processor_uri):
+            if processor_uri == 'BAD_URI':
+                raise RuntimeError('Bad customer')
+            return True
+
+        validate_method.side_effect = validate_customer
+        res = self.post('/v1/customers/bulk', [
+            dict(processor_uri='GOOD_URI'),
+            dict(processor_uri='BAD_URI'),
+        ])
+        results = res.json['items']
+        self.assertNotEqual(self.customer_model.get(results[0]['guid']), None)
+        self.assertEqual(results[1], dict(
+            index=1,
+            error_class='RuntimeError',
+            error_message='Bad customer',
+        ))
+        # the pending customer is discarded
+        Customer = self.customer_model.TABLE
+        query = (
+            self.testapp.session.query(Customer)
+            .filter_by(processor_uri='BAD_URI')
+        )
+        self.assertEqual(query.count(), 0)
+
+    def test_bulk_customers_with_failed_chunk(self):
+        self.testapp.app.registry.settings['billy.bulk.chunk_size'] = 2
+        prepare_provision = CustomerModel.prepare_provision
+
+        def prepare(model, customer):
+            if customer.processor_uri == 'BAD_URI':
+                raise KeyError('Boom!')
+            return prepare_provision(model, customer)
+
+        with mock.patch.object(
+            CustomerModel,
+            'prepare_provision',
+            autospec=True,
+            side_effect=prepare,
+        ):
+            res = self.post('/v1/customers/bulk', [
+                dict(processor_uri='GOOD_URI'),
+                dict(processor_uri='BAD_URI'),
+                dict(),
+            ])
+        results = res.json['items']
+        # the whole chunk failed, but not the others
+        self.assertEqual(results[0]['error_class'], 'KeyError')
+        self.assertEqual(results[1]['error_class'], 'KeyError')
+        customer = self.customer_model.get(results[2]['guid'])
+        self.assertFalse(customer.pending)
+
+    def test_bulk_bad_body(self):
+        for body in [
+            'not json',
+            '"foo"',
+            '[]',
+            '[1, 2]',
+        ]:
+            self.post('/v1/customers/bulk', body, status=400)
+
+    def test_bulk_too_many_items(self):
+        self.testapp.app.registry.settings['billy.bulk.max_items'] = 2
+        self.post('/v1/customers/bulk', [dict(), dict(), dict()], status=400)
+
+    def test_bulk_invoices(self):
+        self.testapp.app.registry.settings['billy.bulk.chunk_size'] = 2
+        with db_transaction.manager:
+            self.invoice_model.create(
+                customer=self.customer,
+                amount=100,
+                external_id='EXISTING',
+            )
+        res = self.post('/v1/invoices/bulk', [
+            dict(
+                customer_guid=self.customer.guid,
+                amount=1000,
+                title='foo',
+                external_id='NEW',
+                items=[dict(name='item', amount=1000, unit='hours')],
+                adjustments=[dict(amount=-100, reason='discount')],
+            ),
+            dict(customer_guid=self.customer.guid, amount=-1),
+            dict(customer_guid=self.other_customer.guid, amount=1000),
+            dict(customer_guid=self.customer.guid, amount=1000,
+                 external_id='EXISTING'),
+            dict(customer_guid=self.customer.guid, amount=1000,
+                 external_id='NEW'),
+            dict(customer_guid=self.customer.guid, amount=1000,
+                 items=[dict(name='no amount')]),
+            dict(customer_guid=self.customer.guid, amount=2000,
+                 funding_instrument_uri='/v1/cards/tester'),
+        ])
+        results = res.json['items']
+        self.assertEqual([result['index'] for result in results],
+                         range(7))
+
+        invoice = self.invoice_model.get(results[0]['guid'])
+        self.assertEqual(invoice.title, 'foo')
+        self.assertEqual(invoice.external_id, 'NEW')
+        self.assertEqual(invoice.effective_amount, 900)
+        self.assertEqual(len(invoice.items), 1)
+        self.assertEqual(invoice.items[0].unit, 'hours')
+        self.assertEqual(invoice.adjustments[0].reason, 'discount')
+
+        self.assertEqual(results[1]['error_class'], 'ValidationError')
+        self.assertIn('amount', results[1]['error_message'])
+        self.assertEqual(results[2]['error_class'], 'HTTPForbidden')
+        self.assertEqual(results[3]['error_class'],
+                         'DuplicateExternalIDError')
+        self.assertEqual(results[4]['error_class'],
+                         'DuplicateExternalIDError')
+        self.assertEqual(results[5]['error_class'], 'ValidationError')
+
+        invoice = self.invoice_model.get(results[6]['guid'])
+        # the transaction is processed right away
+        self.assertEqual(invoice.status, self.invoice_model.statuses.SETTLED)
+
+    def test_bulk_invoices_with_failed_chunk(self):
+        self.testapp.app.registry.settings['billy.bulk.chunk_size'] = 2
+        create = InvoiceModel.create
+
+        def create_invoice(model, **kwargs):
+            if kwargs['amount'] == 3000:
+                raise KeyError('Boom!')
+            return create(model, **kwargs)
+
+        with mock.patch.object(
+            InvoiceModel,
+            'create',
+            autospec=True,
+            side_effect=create_invoice,
+        ):
+            res = self.post('/v1/invoices/bulk', [
+                dict(customer_guid=self.customer.guid, amount=1000),
+                dict(customer_guid=self.customer.guid, amount=3000),
+                dict(customer_guid=self.customer.guid, amount=2000),
+            ])
+        results = res.json['items']
+        # the first invoice is rolled back with the chunk
+        self.assertEqual(results[0]['error_class'], 'KeyError')
+        self.assertEqual(results[1]['error_class'], 'KeyError')
+        invoice = self.invoice_model.get(results[2]['guid'])
+        self.assertEqual(invoice.amount, 2000)
+        self.assertEqual(len(self.customer.invoices), 1)
+
+    def test_bulk_invoices_with_malformed_entries(self):
+        self.testapp.app.registry.settings['billy.bulk.chunk_size'] = 3
+        res = self.post('/v1/invoices/bulk', [
+            dict(customer_guid=self.customer.guid, amount=1000,
+                 items=[dict(name='foo', amount=100)]),
+            dict(customer_guid=self.customer.guid, amount=1000,
+                 items=[dict(name='foo', amount='abc')]),
+            dict(customer_guid=self.customer.guid, amount=1000,
+                 adjustments=[dict(amount={})]),
+            dict(customer_guid=self.customer.guid, amount=1000,
+                 adjustments=[dict(amount='-100')]),
+        ])
+        results = res.json['items']
+        # only the malformed items fail, not the chunk they are in
+        self.assertEqual(results[1]['error_class'], 'ValidationError')
+        self.assertIn('amount', results[1]['error_message'])
+        self.assertEqual(results[2]['error_class'], 'ValidationError')
+        invoice = self.invoice_model.get(results[0]['guid'])
+        self.assertEqual(invoice.items[0].amount, 100)
+        invoice = self.invoice_model.get(results[3]['guid'])
+        self.assertEqual(invoice.effective_amount, 900)
+
+    def test_bulk_with_pending_customer(self):
+        with db_transaction.manager:
+            customer = self.customer_model.create(
+                company=self.company,
+                pending=True,
+            )
+        res = self.post('/v1/invoices/bulk', [
+            dict(customer_guid=customer.guid, amount=1000),
+            dict(customer_guid=self.customer.guid, amount=1000),
+        ])
+        results = res.json['items']
+        self.assertEqual(results[0]['error_class'], 'HTTPBadRequest')
+        self.assertNotEqual(self.invoice_model.get(results[1]['guid']), None)
+
+        res = self.post('/v1/subscriptions/bulk', [
+            dict(customer_guid=customer.guid, plan_guid=self.plan.guid),
+            dict(customer_guid=self.customer.guid, plan_guid=self.plan.guid),
+        ])
+        results = res.json['items']
+        self.assertEqual(results[0]['error_class'], 'HTTPBadRequest')
+        self.assertNotEqual(
+            self.subscription_model.get(results[1]['guid']),
+            None,
+        )
+
+    def test_bulk_invoices_processed_in_chunks(self):
+        settings = self.testapp.app.registry.settings
+        settings['billy.bulk.chunk_size'] = 2
+        settings['billy.transaction.processing_mode'] = 'inline'
+        with mock.patch.object(
+            TransactionModel,
+            'process_transactions',
+            autospec=True,
+        ) as process_method:
+            res = self.post('/v1/invoices/bulk', [
+                dict(customer_guid=self.customer.guid, amount=1000,
+                     funding_instrument_uri='/v1/cards/tester')
+                for _ in range(3)
+            ])
+        self.assertEqual(len(res.json['items']), 3)
+        # each chunk of transactions is processed in its own DB transaction
+        self.assertEqual(
+            [len(call[0][1]) for call in process_method.call_args_list],
+            [2, 1],
+        )
+
+    @mock.patch('billy.tests.fixtures.processor.DummyProcessor'
+                '.validate_funding_instrument')
+    def test_bulk_invoices_with_bad_funding_instrument(self, validate_method):
+        def validate_funding_instrument(funding_instrument_uri):
+            if funding_instrument_uri == '/v1/cards/bad':
+                raise RuntimeError('Bad card')
+            return True
+
+        validate_method.side_effect = validate_funding_instrument
+        res = self.post('/v1/invoices/bulk', [
+            dict(customer_guid=self.customer.guid, amount=1000,
+                 funding_instrument_uri='/v1/cards/bad'),
+            dict(customer_guid=self.customer.guid, amount=1000,
+                 funding_instrument_uri='/v1/cards/good'),
+            dict(customer_guid=self.customer.guid, amount=1000,
+                 funding_instrument_uri='/v1/cards/bad'),
+        ])
+        results = res.json['items']
+        self.assertEqual(results[0]['error_class'], 'RuntimeError')
+        self.assertEqual(results[2]['error_class'], 'RuntimeError')
+        self.assertNotEqual(self.invoice_model.get(results[1]['guid']), None)
+        # each funding instrument is only validated once
+        self.assertEqual(validate_method.call_count, 2)
+
+    def test_bulk_subscriptions(self):
+        with db_transaction.manager:
+            deleted_plan = self.plan_model.create(
+                company=self.company,
+                plan_type=self.plan_model.types.DEBIT,
+                amount=1000,
+                frequency=self.plan_model.frequencies.MONTHLY,
+            )
+            self.plan_model.delete(deleted_plan)
+        res = self.post('/v1/subscriptions/bulk', [
+            dict(
+                customer_guid=self.customer.guid,
+                plan_guid=self.plan.guid,
+                funding_instrument_uri='/v1/cards/tester',
+            ),
+            dict(
+                customer_guid=self.customer.guid,
+                plan_guid=self.plan.guid,
+                started_at='2013-08-17T00:00:00Z',
+            ),
+            dict(
+                customer_guid=self.customer.guid,
+                plan_guid=deleted_plan.guid,
+            ),
+            dict(customer_guid=self.customer.guid),
+        ])
+        results = res.json['items']
+
+        subscription = self.subscription_model.get(results[0]['guid'])
+        self.assertEqual(subscription.invoice_count, 1)
+        self.assertEqual(subscription.invoices[0].status,
+                         self.invoice_model.statuses.SETTLED)
+        subscription = self.subscription_model.get(results[1]['guid'])
+        self.assertEqual(subscription.invoice_count, 0)
+        self.assertEqual(results[2]['error_class'], 'HTTPBadRequest')
+        self.assertEqual(results[3]['error_class'], 'ValidationError')
+
+    def test_bulk_subscriptions_with_failed_chunk(self):
+        self.testapp.app.registry.settings['billy.bulk.chunk_size'] = 2
+        create = SubscriptionModel.create
+
+        def create_subscription(model, **kwargs):
+            if kwargs['amount'] == 3000:
+                raise KeyError('Boom!')
+            return create(model, **kwargs)
+
+        with mock.patch.object(
+            SubscriptionModel,
+            'create',
+            autospec=True,
+            side_effect=create_subscription,
+        ):
+            res = self.post('/v1/subscriptions/bulk', [
+                dict(customer_guid=self.customer.guid,
+                     plan_guid=self.plan.guid, amount=1000),
+                dict(customer_guid=self.customer.guid,
+                     plan_guid=self.plan.guid, amount=3000),
+                dict(customer_guid=self.customer.guid,
+                     plan_guid=self.plan.guid, amount=2000),
+            ])
+        results = res.json['items']
+        # the first subscription is rolled back with the chunk
+        self.assertEqual(results[0]['error_class'], 'KeyError')
+        self.assertEqual(results[1]['error_class'], 'KeyError')
+        subscription = self.subscription_model.get(results[2]['guid'])
+        self.assertEqual(subscription.amount, 2000)
+        self.assertEqual(len(self.customer.subscriptions), 1)
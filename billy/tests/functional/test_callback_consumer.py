@@ -0,0 +1,153 @@
+from __future__ import unicode_literals
+
+import mock
+import balanced
+import transaction as db_transaction
+from freezegun import freeze_time
+
+from billy.errors import BillyError
+from billy.models.callback_consumer import CallbackEventConsumer
+from billy.models.processors.balanced_payments import BalancedProcessor
+from billy.models.transaction import DuplicateEventError
+from billy.tests.functional.helper import ViewTestCase
+
+
+@freeze_time('2013-08-16')
+class TestCallbackEventConsumer(ViewTestCase):
+
+    def setUp(self):
+        super(TestCallbackEventConsumer, self).setUp()
+        with db_transaction.manager:
+            self.company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+            self.event_guids = []
+            for i in range(5):
+                event = self.callback_event_model.create(
+                    company=self.company,
+                    processor_id='EV_ID_{}'.format(i),
+                    payload=dict(
+                        id='EV_ID_{}'.format(i),
+                        type='debit.updated',
+                    ),
+                )
+                self.event_guids.append(event.guid)
+        self.consumer = CallbackEventConsumer(
+            session=self.testapp.session,
+            processor_factory=lambda: self.dummy_processor,
+            settings=self.settings,
+            batch_size=2,
+        )
+
+    def assert_statuses(self, expected):
+        statuses = [
+            self.callback_event_model.get(guid).status
+            for guid in self.event_guids
+        ]
+        self.assertEqual(statuses, expected)
+
+    @mock.patch('billy.tests.fixtures.processor.DummyProcessor.callback')
+    def test_consume(self, callback_method):
+        update_db = mock.Mock()
+        callback_method.return_value = update_db
+
+        count = self.consumer.consume()
+        self.assertEqual(count, 5)
+        self.assertEqual(callback_method.call_count, 5)
+        self.assertEqual(update_db.call_count, 5)
+        called_company, payload = callback_method.call_args_list[0][0]
+        self.assertEqual(called_company.guid, self.company.guid)
+        self.assertEqual(payload, dict(id='EV_ID_0', type='debit.updated'))
+        statuses = self.callback_event_model.statuses
+        self.assert_statuses([statuses.PROCESSED] * 5)
+
+        # consuming again should be a no-op
+        self.assertEqual(self.consumer.consume(), 0)
+
+    @mock.patch('billy.tests.fixtures.processor.DummyProcessor.callback')
+    def test_consume_with_errors(self, callback_method):
+        update_db = mock.Mock()
+
+        def callback(company, payload):
+            if payload['id'] == 'EV_ID_0':
+                raise BillyError('Boom!')
+            if payload['id'] == 'EV_ID_1':
+                return None
+            if payload['id'] == 'EV_ID_2':
+                return mock.Mock(side_effect=DuplicateEventError('Dup!'))
+            return update_db
+
+        callback_method.side_effect = callback
+        self.consumer.consume()
+
+        statuses = self.callback_event_model.statuses
+        self.assert_statuses([
+            statuses.FAILED,
+            statuses.IGNORED,
+            statuses.IGNORED,
+            statuses.PROCESSED,
+            statuses.PROCESSED,
+        ])
+        event = self.callback_event_model.get(self.event_guids[0])
+        self.assertEqual(event.error_message, 'Boom!')
+
+    @mock.patch('billy.tests.fixtures.processor.DummyProcessor.callback')
+    def test_consume_with_processor_unavailable(self, callback_method):
+        callback_method.side_effect = IOError('Connection refused')
+
+        count = self.consumer.consume()
+        self.assertEqual(count, 0)
+        self.assertEqual(callback_method.call_count, 1)
+        # events should be left for next time
+        statuses = self.callback_event_model.statuses
+        self.assert_statuses([statuses.RECEIVED] * 5)
+
+    def test_consume_with_balanced_server_error(self):
+        response = mock.Mock(status_code=503, data={})
+        Event = mock.Mock()
+        Event.fetch.side_effect = balanced.exc.HTTPError(
+            mock.Mock(response=response),
+        )
+        consumer = CallbackEventConsumer(
+            session=self.testapp.session,
+            processor_factory=lambda: BalancedProcessor(event_cls=Event),
+            settings=self.settings,
+            batch_size=2,
+        )
+
+        count = consumer.consume()
+        self.assertEqual(count, 0)
+        self.assertEqual(Event.fetch.call_count, 1)
+        # events should be left for next time
+        statuses = self.callback_event_model.statuses
+        self.assert_statuses([statuses.RECEIVED] * 5)
+
+    @mock.patch('billy.tests.fixtures.processor.DummyProcessor.callback')
+    def test_consume_with_malformed_payload(self, callback_method):
+        update_db = mock.Mock()
+
+        def callback(company, payload):
+            if payload['id'] == 'EV_ID_0':
+                entity = {}
+                return entity['meta']
+            if payload['id'] == 'EV_ID_1':
+                return mock.Mock(side_effect=ValueError('Bad event'))
+            return update_db
+
+        callback_method.side_effect = callback
+        count = self.consumer.consume()
+        self.assertEqual(count, 5)
+
+        # events behind the poison ones should still be applied
+        statuses = self.callback_event_model.statuses
+        self.assert_statuses([
+            statuses.FAILED,
+            statuses.FAILED,
+            statuses.PROCESSED,
+            statuses.PROCESSED,
+            statuses.PROCESSED,
+        ])
+        event = self.callback_event_model.get(self.event_guids[0])
+        self.assertEqual(event.error_message, "KeyError: u'meta'")
+        event = self.callback_event_model.get(self.event_guids[1])
+        self.assertEqual(event.error_message, 'ValueError: Bad event')
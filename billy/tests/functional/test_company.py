@@ -2,8 +2,10 @@ from __future__ import unicode_literals
 import json
 
 import mock
+import transaction as db_transaction
 from freezegun import freeze_time
 
+from billy.errors import BillyError
 from billy.utils.generic import utc_now
 from billy.tests.functional.helper import ViewTestCase
 
@@ -32,7 +34,59 @@ class TestCompanyViews(ViewTestCase):
         expected_url = 'http://localhost/v1/companies/{}/callbacks/{}/'.format(
             company.guid, company.callback_key,
         )
-        register_callback_method.assert_called_once_with(company, expected_url)
+        self.assertEqual(register_callback_method.call_count, 1)
+        # the processor gets a transient copy of the company, as it is called
+        # out of the database transaction
+        called_company, called_url = register_callback_method.call_args[0]
+        self.assertEqual(called_company.guid, company.guid)
+        self.assertEqual(called_url, expected_url)
+        self.assertFalse(company.pending)
+
+    @mock.patch('billy.tests.fixtures.processor.DummyProcessor.register_callback')
+    def test_create_company_with_failed_callback_registration(
+        self,
+        register_callback_method,
+    ):
+        register_callback_method.side_effect = BillyError('Boom!')
+        res = self.testapp.post(
+            '/v1/companies',
+            dict(processor_key='MOCK_PROCESSOR_KEY'),
+            status=400,
+        )
+        self.assertEqual(res.json['error_class'], 'BillyError')
+        # the pending company should be discarded
+        called_company = register_callback_method.call_args[0][0]
+        self.assertEqual(self.company_model.get(called_company.guid), None)
+
+    def test_pending_company_cannot_access_api(self):
+        with db_transaction.manager:
+            company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+                pending=True,
+            )
+            api_key = str(company.api_key)
+        self.testapp.get(
+            '/v1/customers',
+            extra_environ=dict(REMOTE_USER=api_key),
+            status=403,
+        )
+
+    def test_reconcile_pending(self):
+        with db_transaction.manager:
+            company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+                pending=True,
+            )
+            guid = company.guid
+            self.company_model.create(processor_key='MOCK_PROCESSOR_KEY')
+
+        with freeze_time('2013-08-16 01:00:01'):
+            with db_transaction.manager:
+                count = self.company_model.reconcile_pending(3600)
+                self.assertEqual(count, 1)
+
+        company = self.company_model.get(guid)
+        self.assertTrue(company.deleted)
 
     def test_create_company_with_random_callback_keys(self):
         times = 100
@@ -72,6 +126,42 @@ class TestCompanyViews(ViewTestCase):
     def test_callback_with_slash_ending(self, callback_method):
         self.test_callback(slash=True)
 
+    @mock.patch('billy.tests.fixtures.processor.DummyProcessor.callback')
+    def test_deferred_callback(self, callback_method):
+        settings = self.testapp.app.registry.settings
+        settings['billy.callback.deferred'] = 'true'
+        res = self.testapp.post(
+            '/v1/companies',
+            dict(processor_key='MOCK_PROCESSOR_KEY'),
+        )
+        company = self.company_model.get(res.json['guid'])
+        url = '/v1/companies/{}/callbacks/{}/'.format(
+            company.guid, company.callback_key,
+        )
+        payload = dict(id='EV_ID_1', foo='bar')
+
+        def post_callback():
+            return self.testapp.post(
+                url,
+                json.dumps(payload),
+                headers=[(b'content-type', b'application/json')],
+            )
+
+        res = post_callback()
+        self.assertEqual(res.json['code'], 'queued')
+        # the event should not be verified within the request
+        self.assertFalse(callback_method.called)
+
+        event = self.callback_event_model.get_by_processor_id(
+            company, 'EV_ID_1',
+        )
+        self.assertEqual(event.status, self.callback_event_model.statuses.RECEIVED)
+        self.assertEqual(json.loads(event.payload), payload)
+
+        res = post_callback()
+        self.assertEqual(res.json['code'], 'duplicate')
+        self.assertEqual(self.callback_event_model.list_received().count(), 1)
+
     def test_create_company_with_bad_parameters(self):
         self.testapp.post(
             '/v1/companies',
@@ -0,0 +1,149 @@
+from __future__ import unicode_literals
+import zlib
+
+import transaction as db_transaction
+from freezegun import freeze_time
+from webob import Request
+
+from billy.api.compression import choose_encoding
+from billy.tests.functional.helper import ViewTestCase
+
+
+@freeze_time('2013-08-16')
+class TestCompression(ViewTestCase):
+
+    def setUp(self):
+        super(TestCompression, self).setUp()
+        with db_transaction.manager:
+            self.company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+            self.customer = self.customer_model.create(
+                company=self.company,
+            )
+            for i in range(10):
+                self.invoice_model.create(
+                    customer=self.customer,
+                    amount=100 + i,
+                    funding_instrument_uri='/v1/cards/tester',
+                )
+        self.api_key = str(self.company.api_key)
+
+    def get(self, url, accept_encoding=None, status=200, headers=None,
+            **settings):
+        # Notice: webtest decodes response bodies, so we call the WSGI app
+        # directly to see what is on the wire
+        self.testapp.app.registry.settings.update(settings)
+        headers = dict(headers or {})
+        if accept_encoding is not None:
+            headers[b'Accept-Encoding'] = str(accept_encoding)
+        request = Request.blank(
+            str(url),
+            headers=headers,
+            environ=dict(REMOTE_USER=self.api_key),
+        )
+        res = request.get_response(self.testapp.app)
+        self.assertEqual(res.status_int, status)
+        return res
+
+    def test_gzip(self):
+        expected = self.get('/v1/transactions')
+        self.assertEqual(expected.content_encoding, None)
+        self.assertIn('Accept-Encoding', expected.headers['Vary'])
+
+        res = self.get('/v1/transactions', accept_encoding='gzip, deflate')
+        self.assertEqual(res.content_encoding, 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        body = zlib.decompress(res.body, 16 + zlib.MAX_WBITS)
+        self.assertEqual(body, expected.body)
+        self.assertTrue(len(res.body) * 5 < len(expected.body))
+
+    def test_deflate(self):
+        expected = self.get('/v1/transactions')
+        res = self.get('/v1/transactions', accept_encoding='deflate')
+        self.assertEqual(res.content_encoding, 'deflate')
+        self.assertEqual(zlib.decompress(res.body), expected.body)
+
+    def test_streaming(self):
+        url = '/v1/transactions?limit=10'
+        expected = self.get(url, **{'api.json.stream_chunk_size': 0})
+        res = self.get(
+            url,
+            accept_encoding='gzip',
+            **{'api.json.stream_chunk_size': 3}
+        )
+        self.assertEqual(res.content_encoding, 'gzip')
+        body = zlib.decompress(res.body, 16 + zlib.MAX_WBITS)
+        self.assertEqual(body, expected.body)
+
+    def test_export(self):
+        url = '/v1/transactions/export?format=jsonl'
+        expected = self.get(url)
+        res = self.get(url, accept_encoding='gzip')
+        self.assertEqual(res.content_encoding, 'gzip')
+        body = zlib.decompress(res.body, 16 + zlib.MAX_WBITS)
+        self.assertEqual(body, expected.body)
+
+    def test_min_size(self):
+        url = '/v1/transactions?limit=1'
+        res = self.get(
+            url,
+            accept_encoding='gzip',
+            **{'api.compression.min_size': 100}
+        )
+        self.assertEqual(res.content_encoding, 'gzip')
+        res = self.get(
+            url,
+            accept_encoding='gzip',
+            **{'api.compression.min_size': 100000}
+        )
+        self.assertEqual(res.content_encoding, None)
+        self.assertEqual(res.json_body['limit'], 1)
+
+    def test_level(self):
+        url = '/v1/transactions'
+        fast = self.get(
+            url,
+            accept_encoding='gzip',
+            **{'api.compression.level': 1}
+        )
+        best = self.get(
+            url,
+            accept_encoding='gzip',
+            **{'api.compression.level': 9}
+        )
+        self.assertEqual(
+            zlib.decompress(fast.body, 16 + zlib.MAX_WBITS),
+            zlib.decompress(best.body, 16 + zlib.MAX_WBITS),
+        )
+        self.assertTrue(len(best.body) <= len(fast.body))
+
+    def test_disabled(self):
+        res = self.get(
+            '/v1/transactions',
+            accept_encoding='gzip',
+            **{'api.compression.enabled': 'false'}
+        )
+        self.assertEqual(res.content_encoding, None)
+        self.assertEqual(len(res.json_body['items']), 10)
+
+    def test_not_modified(self):
+        url = '/v1/transactions'
+        etag = self.get(url, accept_encoding='gzip').headers['ETag']
+        res = self.get(
+            url,
+            accept_encoding='gzip',
+            headers={b'If-None-Match': str(etag)},
+            status=304,
+        )
+        self.assertEqual(res.content_encoding, None)
+
+    def test_choose_encoding(self):
+        self.assertEqual(choose_encoding(None), None)
+        self.assertEqual(choose_encoding('identity'), None)
+        self.assertEqual(choose_encoding('gzip;q=0'), None)
+        self.assertEqual(choose_encoding('gzip')[0], 'gzip')
+        self.assertEqual(choose_encoding('*')[0], 'gzip')
+        self.assertEqual(choose_encoding('gzip;q=0.5, deflate')[0], 'deflate')
+        self.assertEqual(choose_encoding('deflate, gzip')[0], 'gzip')
+        self.assertEqual(choose_encoding('*, gzip;q=0')[0], 'deflate')
@@ -71,7 +71,12 @@ class TestCustomerViews(ViewTestCase):
         customer = self.customer_model.get(res.json['guid'])
         self.assertEqual(res.json['processor_uri'], 'MOCK_CUSTOMER_URI')
         self.assertFalse(validate_customer_method.called)
-        create_customer_method.assert_called_once_with(customer)
+        self.assertEqual(create_customer_method.call_count, 1)
+        # the processor gets a transient copy of the customer, as it is called
+        # out of the database transaction
+        called_customer = create_customer_method.call_args[0][0]
+        self.assertEqual(called_customer.guid, customer.guid)
+        self.assertFalse(customer.pending)
 
     @mock.patch('billy.tests.fixtures.processor.DummyProcessor.validate_customer')
     def test_create_customer_with_bad_processor_uri(
@@ -87,6 +92,31 @@ class TestCustomerViews(ViewTestCase):
         )
         self.assertEqual(res.json['error_class'], 'BillyError')
         self.assertEqual(res.json['error_message'], 'Boom!')
+        # the pending customer should be discarded
+        self.assertEqual(
+            self.customer_model.list_by_context(self.company).count(), 0)
+
+    def test_reconcile_pending(self):
+        with db_transaction.manager:
+            customer = self.customer_model.create(
+                company=self.company,
+                pending=True,
+            )
+            guid = customer.guid
+
+        with db_transaction.manager:
+            # not timed out yet
+            count = self.customer_model.reconcile_pending(60)
+            self.assertEqual(count, 0)
+
+        with freeze_time('2013-08-16 00:01:01'):
+            with db_transaction.manager:
+                count = self.customer_model.reconcile_pending(60)
+                self.assertEqual(count, 1)
+
+        customer = self.customer_model.get(guid)
+        self.assertTrue(customer.pending)
+        self.assertTrue(customer.deleted)
 
     def test_create_customer_with_bad_api_key(self):
         self.testapp.post(
@@ -115,6 +145,29 @@ class TestCustomerViews(ViewTestCase):
         )
         self.assertEqual(res.json, created_customer)
 
+    def test_pending_customer_is_not_visible(self):
+        with db_transaction.manager:
+            customer = self.customer_model.create(
+                company=self.company,
+                pending=True,
+            )
+            pending_guid = customer.guid
+            visible_guid = self.customer_model.create(
+                company=self.company,
+            ).guid
+        self.testapp.get(
+            '/v1/customers/{}'.format(pending_guid),
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=404,
+        )
+        res = self.testapp.get(
+            '/v1/customers',
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+        guids = [item['guid'] for item in res.json['items']]
+        self.assertEqual(guids, [visible_guid])
+
     def test_get_customer_with_bad_api_key(self):
         res = self.testapp.post(
             '/v1/customers',
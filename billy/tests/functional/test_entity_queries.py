@@ -0,0 +1,269 @@
+from __future__ import unicode_literals
+
+import transaction as db_transaction
+from freezegun import freeze_time
+
+from billy.models.base import COMPILED_CACHE
+from billy.tests.functional.helper import ViewTestCase
+
+
+@freeze_time('2013-08-16')
+class TestEntityQueries(ViewTestCase):
+    """Make sure loading an entity and its owner company for the ACL takes
+    only one query, and records looked up by validators are not queried
+    again by views
+
+    """
+
+    def setUp(self):
+        super(TestEntityQueries, self).setUp()
+        with db_transaction.manager:
+            self.company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+            self.customer = self.customer_model.create(
+                company=self.company,
+            )
+            self.plan = self.plan_model.create(
+                company=self.company,
+                plan_type=self.plan_model.types.DEBIT,
+                amount=10,
+                frequency=self.plan_model.frequencies.MONTHLY,
+            )
+            self.subscription = self.subscription_model.create(
+                customer=self.customer,
+                plan=self.plan,
+                funding_instrument_uri='/v1/cards/tester',
+            )
+            self.subscription_invoice = self.subscription.invoices[0]
+            self.customer_invoice = self.invoice_model.create(
+                customer=self.customer,
+                amount=100,
+                funding_instrument_uri='/v1/cards/tester',
+            )
+            self.transaction = self.customer_invoice.transactions[0]
+        self.api_key = str(self.company.api_key)
+
+    def get_statements(self, url):
+        def get():
+            self.testapp.session.expunge_all()
+            self.testapp.get(
+                url,
+                extra_environ=dict(REMOTE_USER=self.api_key),
+                status=200,
+            )
+
+        # warm up the API key cache, so that authentication costs no query
+        get()
+        return self.capture_queries(get)
+
+    def assert_loaded_once(self, url, table_name, other_table_names):
+        statements = self.get_statements(url)
+        # the entity comes first, with the records on the path to company
+        self.assertIn('\nFROM {}'.format(table_name), statements[0])
+        for statement in statements:
+            for other_table_name in other_table_names:
+                self.assertNotIn(
+                    '\nFROM {} '.format(other_table_name),
+                    statement,
+                )
+
+    def test_customer(self):
+        self.assert_loaded_once(
+            '/v1/customers/{}'.format(self.customer.guid),
+            'customer',
+            ['company'],
+        )
+
+    def test_plan(self):
+        self.assert_loaded_once(
+            '/v1/plans/{}'.format(self.plan.guid),
+            '"plan"',
+            ['company'],
+        )
+
+    def test_subscription(self):
+        self.assert_loaded_once(
+            '/v1/subscriptions/{}'.format(self.subscription.guid),
+            'subscription JOIN "plan"',
+            ['company', '"plan"', 'customer'],
+        )
+
+    def test_invoice(self):
+        for guid in [
+            self.customer_invoice.guid,
+            self.subscription_invoice.guid,
+        ]:
+            self.assert_loaded_once(
+                '/v1/invoices/{}'.format(guid),
+                'invoice',
+                [
+                    'company',
+                    'customer',
+                    'customer_invoice',
+                    'subscription_invoice',
+                    'subscription',
+                ],
+            )
+
+    def test_transaction(self):
+        self.assert_loaded_once(
+            '/v1/transactions/{}'.format(self.transaction.guid),
+            '"transaction"',
+            ['company', 'invoice', 'customer'],
+        )
+
+    def selects_before_insert(self, statements, table_name):
+        count = 0
+        for statement in statements:
+            if statement.startswith('INSERT'):
+                break
+            if '\nFROM {} '.format(table_name) in statement:
+                count += 1
+        return count
+
+    def post_statements(self, url, params, json_body=False):
+        customer_guid = self.customer.guid
+
+        def post():
+            self.testapp.session.expunge_all()
+            if json_body:
+                self.testapp.post_json(
+                    url,
+                    params,
+                    extra_environ=dict(REMOTE_USER=self.api_key),
+                    status=200,
+                )
+            else:
+                self.testapp.post(
+                    url,
+                    params,
+                    extra_environ=dict(REMOTE_USER=self.api_key),
+                    status=200,
+                )
+
+        statements = self.capture_queries(post)
+        self.assertEqual(self.customer_model.get(customer_guid).guid,
+                         customer_guid)
+        return statements
+
+    def test_validators_share_records_with_views(self):
+        # Notice: one lookup shared by the validator and the view, and one
+        # more as beginning the write transaction expires loaded records
+        statements = self.post_statements('/v1/subscriptions', dict(
+            customer_guid=self.customer.guid,
+            plan_guid=self.plan.guid,
+        ))
+        self.assertEqual(self.selects_before_insert(statements, 'customer'),
+                         2)
+        self.assertEqual(self.selects_before_insert(statements, '"plan"'), 2)
+
+        statements = self.post_statements('/v1/invoices', dict(
+            customer_guid=self.customer.guid,
+            amount=100,
+        ))
+        self.assertEqual(self.selects_before_insert(statements, 'customer'),
+                         2)
+
+    def test_bulk_prefetch(self):
+        with db_transaction.manager:
+            other_customer = self.customer_model.create(
+                company=self.company,
+            )
+        plan_guid = self.plan.guid
+        guids = [self.customer.guid, other_customer.guid] * 3
+        statements = self.post_statements(
+            '/v1/invoices/bulk',
+            [dict(customer_guid=guid, amount=100) for guid in guids],
+            json_body=True,
+        )
+        self.assertEqual(self.selects_before_insert(statements, 'customer'),
+                         2)
+
+        statements = self.post_statements(
+            '/v1/subscriptions/bulk',
+            [dict(customer_guid=guid, plan_guid=plan_guid) for guid in guids],
+            json_body=True,
+        )
+        self.assertEqual(self.selects_before_insert(statements, 'customer'),
+                         2)
+        self.assertEqual(self.selects_before_insert(statements, '"plan"'), 2)
+
+    def test_record_loader(self):
+        customer_guid = self.customer.guid
+        loader = self.model_factory.loader
+        loader.clear()
+        self.testapp.session.expunge_all()
+        statements = self.capture_queries(
+            loader.prefetch,
+            self.customer_model.TABLE,
+            [customer_guid, 'NOT_EXIST', None],
+        )
+        self.assertEqual(len(statements), 1)
+        statements = self.capture_queries(
+            loader.get,
+            self.customer_model.TABLE,
+            customer_guid,
+        )
+        self.assertEqual(statements, [])
+        # records expunged from the session are loaded again
+        self.testapp.session.expunge_all()
+        customer = loader.get(self.customer_model.TABLE, customer_guid)
+        self.assertIn(customer, self.testapp.session)
+        self.assertEqual(
+            loader.get(self.customer_model.TABLE, 'NOT_EXIST'),
+            None,
+        )
+
+    def test_cached_statements(self):
+        session = self.testapp.session
+        subscription_guid = self.subscription.guid
+        invoice_guid = self.customer_invoice.guid
+        customer_guid = self.customer.guid
+        company_guid = self.company.guid
+
+        def lookup():
+            session.expunge_all()
+            subscription = self.subscription_model.get_joined(
+                subscription_guid,
+                ('plan', ),
+            )
+            self.assertEqual(subscription.guid, subscription_guid)
+            self.assertEqual(subscription.plan.amount, 10)
+            invoice = self.invoice_model.get(invoice_guid)
+            self.assertEqual(invoice.customer_guid, customer_guid)
+            company = self.company_model.get_by_api_key(self.api_key)
+            self.assertEqual(company.guid, company_guid)
+            self.assertEqual(self.company_model.get_by_api_key('BAD'), None)
+            self.assertEqual(self.customer_model.get('NOT_EXIST'), None)
+
+        lookup()
+        compiled_count = len(COMPILED_CACHE)
+        lookup()
+        # statements of the same shapes are compiled only once
+        self.assertEqual(len(COMPILED_CACHE), compiled_count)
+
+    def test_get_from_identity_map(self):
+        session = self.testapp.session
+        customer_guid = self.customer.guid
+        session.expunge_all()
+        customer = self.customer_model.get(customer_guid)
+        statements = self.capture_queries(
+            self.customer_model.get,
+            customer_guid,
+        )
+        self.assertEqual(statements, [])
+        # expired records are refreshed, locking always queries
+        session.expire(customer)
+        statements = self.capture_queries(
+            self.customer_model.get,
+            customer_guid,
+        )
+        self.assertEqual(len(statements), 1)
+        statements = self.capture_queries(
+            self.customer_model.get,
+            customer_guid,
+            with_lockmode='update',
+        )
+        self.assertEqual(len(statements), 1)
+        self.assertIs(self.customer_model.get(customer_guid), customer)
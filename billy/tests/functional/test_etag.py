@@ -0,0 +1,218 @@
+from __future__ import unicode_literals
+
+import transaction as db_transaction
+from freezegun import freeze_time
+
+from billy.tests.functional.helper import ViewTestCase
+
+
+class TestETag(ViewTestCase):
+
+    def setUp(self):
+        super(TestETag, self).setUp()
+        with freeze_time('2013-08-16'):
+            with db_transaction.manager:
+                self.company = self.company_model.create(
+                    processor_key='MOCK_PROCESSOR_KEY',
+                )
+                self.customer = self.customer_model.create(
+                    company=self.company,
+                )
+                self.invoice = self.invoice_model.create(
+                    customer=self.customer,
+                    amount=1000,
+                    items=[dict(name='foo', amount=1000)],
+                )
+        self.api_key = str(self.company.api_key)
+
+    def get(self, url, etag=None, status=200):
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = str(etag)
+        return self.testapp.get(
+            url,
+            headers=headers,
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=status,
+        )
+
+    def test_entity(self):
+        url = '/v1/invoices/{}'.format(self.invoice.guid)
+        res = self.get(url)
+        etag = res.headers['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+
+        res = self.get(url, etag=etag, status=304)
+        self.assertEqual(res.headers['ETag'], etag)
+        self.assertEqual(res.body, b'')
+        self.get(url, etag='W/"other"', status=200)
+        # other representations get other ETags
+        res = self.get(url + '?foo=bar')
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+        with freeze_time('2013-08-17'):
+            with db_transaction.manager:
+                invoice = self.invoice_model.get(self.invoice.guid)
+                self.invoice_model.update_funding_instrument_uri(
+                    invoice=invoice,
+                    funding_instrument_uri='/v1/cards/tester',
+                )
+        res = self.get(url, etag=etag, status=200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_not_modified_skips_rendering(self):
+        url = '/v1/invoices/{}'.format(self.invoice.guid)
+        etag = self.get(url).headers['ETag']
+
+        def get(etag=None, status=200):
+            self.testapp.session.expunge_all()
+            self.get(url, etag=etag, status=status)
+
+        full_count = self.count_queries(get)
+        not_modified_count = self.count_queries(get, etag=etag, status=304)
+        self.assertTrue(not_modified_count < full_count)
+
+    def test_list(self):
+        url = '/v1/invoices'
+        res = self.get(url)
+        etag = res.headers['ETag']
+        self.get(url, etag=etag, status=304)
+        # different page
+        res = self.get(url + '?offset=1', etag=etag)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+        with freeze_time('2013-08-17'):
+            with db_transaction.manager:
+                customer = self.customer_model.get(self.customer.guid)
+                self.invoice_model.create(
+                    customer=customer,
+                    amount=2000,
+                )
+        res = self.get(url, etag=etag, status=200)
+        self.assertEqual(len(res.json['items']), 2)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_list_without_if_none_match(self):
+        url = '/v1/invoices'
+
+        def get(etag=None):
+            self.testapp.session.expunge_all()
+            return self.get(url, etag=etag)
+
+        def count_page_queries(etag=None):
+            statements = self.capture_queries(get, etag=etag)
+            return len([
+                statement for statement in statements
+                if statement.startswith('SELECT invoice.guid')
+            ])
+
+        # the page is only queried once without If-None-Match, the ETag is
+        # made of the loaded records
+        self.assertEqual(count_page_queries(), 1)
+        self.assertEqual(count_page_queries(etag='W/"other"'), 2)
+        etag = get().headers['ETag']
+        self.get(url, etag=etag, status=304)
+
+    def test_streamed_list(self):
+        settings = self.testapp.app.registry.settings
+        settings['api.json.stream_chunk_size'] = 2
+        with db_transaction.manager:
+            customer = self.customer_model.get(self.customer.guid)
+            for _ in range(3):
+                self.invoice_model.create(customer=customer, amount=2000)
+        url = '/v1/invoices?limit=10'
+        res = self.get(url)
+        self.assertEqual(len(res.json['items']), 4)
+        etag = res.headers['ETag']
+        self.get(url, etag=etag, status=304)
+
+    def assert_changed_by(self, url, change):
+        """Make sure the ETag of the entity changes after the change, which
+        is made a day later
+
+        """
+        etag = self.get(url).headers['ETag']
+        with freeze_time('2013-08-17'):
+            change()
+        res = self.get(url, etag=etag, status=200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_cancel_invoice(self):
+        def cancel():
+            self.testapp.post(
+                '/v1/invoices/{}/cancel'.format(self.invoice.guid),
+                extra_environ=dict(REMOTE_USER=self.api_key),
+                status=200,
+            )
+
+        url = '/v1/invoices/{}'.format(self.invoice.guid)
+        self.assert_changed_by(url, cancel)
+
+    def test_failed_invoice(self):
+        with freeze_time('2013-08-16'):
+            with db_transaction.manager:
+                invoice = self.invoice_model.get(self.invoice.guid)
+                self.invoice_model.update_funding_instrument_uri(
+                    invoice=invoice,
+                    funding_instrument_uri='/v1/cards/tester',
+                )
+        self.model_factory.settings['billy.transaction.maximum_retry'] = 0
+
+        def debit(transaction):
+            raise RuntimeError('Boom!')
+
+        def fail():
+            self.dummy_processor.debit = debit
+            with db_transaction.manager:
+                invoice = self.invoice_model.get(self.invoice.guid)
+                self.transaction_model.process_one(invoice.transactions[0])
+                self.assertEqual(invoice.status,
+                                 self.invoice_model.statuses.FAILED)
+
+        url = '/v1/invoices/{}'.format(self.invoice.guid)
+        self.assert_changed_by(url, fail)
+
+    def test_delete_customer(self):
+        def delete():
+            self.testapp.delete(
+                '/v1/customers/{}'.format(self.customer.guid),
+                extra_environ=dict(REMOTE_USER=self.api_key),
+                status=200,
+            )
+
+        url = '/v1/customers/{}'.format(self.customer.guid)
+        self.assert_changed_by(url, delete)
+
+    def test_cancel_subscription_and_delete_plan(self):
+        with freeze_time('2013-08-16'):
+            with db_transaction.manager:
+                plan = self.plan_model.create(
+                    company=self.company,
+                    plan_type=self.plan_model.types.DEBIT,
+                    amount=10,
+                    frequency=self.plan_model.frequencies.MONTHLY,
+                )
+                subscription = self.subscription_model.create(
+                    customer=self.customer,
+                    plan=plan,
+                )
+
+        def cancel():
+            self.testapp.post(
+                '/v1/subscriptions/{}/cancel'.format(subscription.guid),
+                extra_environ=dict(REMOTE_USER=self.api_key),
+                status=200,
+            )
+
+        def delete():
+            self.testapp.delete(
+                '/v1/plans/{}'.format(plan.guid),
+                extra_environ=dict(REMOTE_USER=self.api_key),
+                status=200,
+            )
+
+        self.assert_changed_by(
+            '/v1/subscriptions/{}'.format(subscription.guid),
+            cancel,
+        )
+        self.assert_changed_by('/v1/plans/{}'.format(plan.guid), delete)
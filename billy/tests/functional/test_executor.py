@@ -0,0 +1,49 @@
+from __future__ import unicode_literals
+
+import transaction as db_transaction
+from freezegun import freeze_time
+
+from billy.models.executor import TransactionExecutor
+from billy.tests.functional.helper import ViewTestCase
+
+
+@freeze_time('2013-08-16')
+class TestTransactionExecutor(ViewTestCase):
+
+    def setUp(self):
+        super(TestTransactionExecutor, self).setUp()
+        with db_transaction.manager:
+            self.company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+            self.customer = self.customer_model.create(
+                company=self.company
+            )
+            invoice = self.invoice_model.create(
+                customer=self.customer,
+                amount=100,
+                funding_instrument_uri='/v1/cards/tester',
+            )
+            self.transaction_guid = invoice.transactions[0].guid
+        self.executor = TransactionExecutor(
+            session=self.testapp.session,
+            processor_factory=lambda: self.dummy_processor,
+            settings=self.settings,
+        )
+
+    def test_process(self):
+        self.executor.process([self.transaction_guid])
+        transaction = self.transaction_model.get(self.transaction_guid)
+        self.assertEqual(transaction.submit_status,
+                         self.transaction_model.submit_statuses.DONE)
+        self.assertEqual(transaction.processor_uri, 'MOCK_DEBIT_TX_URI')
+        self.assertEqual(transaction.invoice.status,
+                         self.invoice_model.statuses.SETTLED)
+
+    def test_process_finished_transaction(self):
+        self.executor.process([self.transaction_guid])
+        # processing a finished transaction again should be a no-op
+        self.executor.process([self.transaction_guid])
+        transaction = self.transaction_model.get(self.transaction_guid)
+        self.assertEqual(transaction.submit_status,
+                         self.transaction_model.submit_statuses.DONE)
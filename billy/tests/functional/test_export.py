@@ -0,0 +1,118 @@
+from __future__ import unicode_literals
+import io
+import csv
+import json
+import datetime
+
+import pytz
+import transaction as db_transaction
+
+from billy.tests.functional.helper import ViewTestCase
+
+
+class TestExport(ViewTestCase):
+
+    def setUp(self):
+        super(TestExport, self).setUp()
+        with db_transaction.manager:
+            self.company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+            self.customer = self.customer_model.create(
+                company=self.company,
+            )
+            other_company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+            other_customer = self.customer_model.create(
+                company=other_company,
+            )
+            self.invoice_model.create(
+                customer=other_customer,
+                amount=999,
+                funding_instrument_uri='/v1/cards/tester',
+            )
+        self.invoice_guids = []
+        self.transaction_guids = []
+        with db_transaction.manager:
+            for day in range(3):
+                invoice = self.invoice_model.create(
+                    customer=self.customer,
+                    amount=100 + day,
+                    title='invoice, "{}"'.format(day),
+                    external_id='EX{}'.format(day),
+                    funding_instrument_uri='/v1/cards/tester',
+                )
+                # one invoice and transaction a day
+                created_at = datetime.datetime(2013, 8, 16 + day,
+                                               tzinfo=pytz.utc)
+                invoice.created_at = created_at
+                invoice.transactions[0].created_at = created_at
+                self.invoice_guids.append(invoice.guid)
+                self.transaction_guids.append(invoice.transactions[0].guid)
+        self.api_key = str(self.company.api_key)
+
+    def export(self, url, status=200):
+        return self.testapp.get(
+            url,
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=status,
+        )
+
+    def test_export_transactions_csv(self):
+        res = self.export('/v1/transactions/export')
+        self.assertEqual(res.content_type, 'text/csv')
+        self.assertIn('transactions.csv', res.headers['Content-Disposition'])
+        rows = list(csv.DictReader(io.BytesIO(res.body)))
+        self.assertEqual([row['guid'] for row in rows], self.transaction_guids)
+        self.assertEqual(rows[0]['amount'], '100')
+        self.assertEqual(rows[0]['transaction_type'], 'debit')
+        self.assertEqual(rows[0]['processor_uri'], '')
+        self.assertEqual(rows[0]['created_at'], '2013-08-16T00:00:00+00:00')
+
+    def test_export_invoices_jsonl(self):
+        res = self.export('/v1/invoices/export?format=jsonl')
+        self.assertEqual(res.content_type, 'application/x-ndjson')
+        rows = [json.loads(line) for line in res.body.splitlines()]
+        self.assertEqual([row['guid'] for row in rows], self.invoice_guids)
+        self.assertEqual(rows[1]['title'], 'invoice, "1"')
+        self.assertEqual(rows[1]['external_id'], 'EX1')
+        self.assertEqual(rows[1]['customer_guid'], self.customer.guid)
+        self.assertEqual(rows[1]['subscription_guid'], None)
+        self.assertEqual(rows[1]['status'], 'processing')
+
+    def test_export_invoices_csv_with_quotes(self):
+        res = self.export('/v1/invoices/export')
+        rows = list(csv.DictReader(io.BytesIO(res.body)))
+        self.assertEqual(rows[2]['title'], 'invoice, "2"')
+
+    def test_export_range(self):
+        res = self.export(
+            '/v1/transactions/export?format=jsonl'
+            '&since=2013-08-17T00:00:00Z&until=2013-08-18T00:00:00Z'
+        )
+        rows = [json.loads(line) for line in res.body.splitlines()]
+        self.assertEqual([row['guid'] for row in rows],
+                         self.transaction_guids[1:2])
+
+    def test_export_in_chunks(self):
+        self.testapp.app.registry.settings['billy.export.chunk_size'] = 2
+        res = self.export('/v1/invoices/export?format=jsonl')
+        rows = [json.loads(line) for line in res.body.splitlines()]
+        self.assertEqual([row['guid'] for row in rows], self.invoice_guids)
+
+    def test_export_with_one_query(self):
+        statements = self.capture_queries(
+            self.export,
+            '/v1/transactions/export',
+        )
+        export_statements = [
+            statement for statement in statements
+            if 'FROM "transaction"' in statement
+        ]
+        self.assertEqual(len(export_statements), 1)
+
+    def test_export_bad_params(self):
+        self.export('/v1/transactions/export?format=xml', status=400)
+        self.export('/v1/invoices/export?since=yesterday', status=400)
+        self.testapp.get('/v1/invoices/export', status=403)
@@ -0,0 +1,161 @@
+from __future__ import unicode_literals
+
+import transaction as db_transaction
+from freezegun import freeze_time
+
+from billy.tests.functional.helper import ViewTestCase
+
+
+@freeze_time('2013-08-16')
+class TestFields(ViewTestCase):
+
+    def setUp(self):
+        super(TestFields, self).setUp()
+        with db_transaction.manager:
+            self.company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+            self.customer = self.customer_model.create(
+                company=self.company,
+            )
+        self.api_key = str(self.company.api_key)
+        self.company_guid = self.company.guid
+        self.customer_guid = self.customer.guid
+        self.invoice_guids = self.add_invoices(2)
+
+    def add_invoices(self, count):
+        guids = []
+        with db_transaction.manager:
+            customer = self.customer_model.get(self.customer_guid)
+            for _ in range(count):
+                invoice = self.invoice_model.create(
+                    customer=customer,
+                    amount=100,
+                    items=[dict(name='foo', amount=100)],
+                    adjustments=[dict(amount=-10, reason='coupon')],
+                )
+                transaction = self.transaction_model.create(
+                    invoice=invoice,
+                    amount=90,
+                )
+                self.transaction_failure_model.create(
+                    transaction=transaction,
+                    error_message='Boom!',
+                )
+                guids.append(invoice.guid)
+        return guids
+
+    def get(self, url, params=None, status=200):
+        # Notice: start from a clean session and API key cache, so that
+        # nothing is served from the identity map or the cache
+        self.testapp.session.expunge_all()
+        self.settings['api_key_cache'].clear()
+        return self.testapp.get(
+            url,
+            params or {},
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=status,
+        )
+
+    def test_fields(self):
+        res = self.get('/v1/invoices', dict(fields='status,amount'))
+        for item in res.json['items']:
+            self.assertEqual(set(item), set(['guid', 'status', 'amount']))
+
+        res = self.get(
+            '/v1/invoices/{}'.format(self.invoice_guids[0]),
+            dict(fields='items'),
+        )
+        self.assertEqual(set(res.json), set(['guid', 'items']))
+        self.assertEqual(res.json['items'][0]['name'], 'foo')
+
+        res = self.get('/v1/transactions', dict(fields='failure_count'))
+        for item in res.json['items']:
+            self.assertEqual(set(item), set(['guid', 'failure_count']))
+            self.assertEqual(item['failure_count'], 1)
+
+    def test_fields_skip_relationships(self):
+        full_count = self.count_queries(self.get, '/v1/invoices')
+        sparse_count = self.count_queries(
+            self.get,
+            '/v1/invoices',
+            dict(fields='guid,status'),
+        )
+        # items and adjustments are not loaded
+        self.assertEqual(sparse_count, full_count - 2)
+
+    def test_expand(self):
+        res = self.get('/v1/invoices', dict(expand='transactions'))
+        for item in res.json['items']:
+            self.assertEqual(len(item['transactions']), 1)
+            transaction = item['transactions'][0]
+            self.assertEqual(transaction['invoice_guid'], item['guid'])
+            self.assertEqual(transaction['failure_count'], 1)
+
+        res = self.get(
+            '/v1/invoices/{}'.format(self.invoice_guids[0]),
+            dict(expand='transactions', fields='status'),
+        )
+        self.assertEqual(set(res.json), set(['guid', 'status',
+                                             'transactions']))
+        # fields do not apply to expanded records
+        transaction = res.json['transactions'][0]
+        self.assertEqual(transaction['failures'][0]['error_message'],
+                         'Boom!')
+
+        with db_transaction.manager:
+            subscription = self.subscription_model.create(
+                customer=self.customer_model.get(self.customer_guid),
+                plan=self.plan_model.create(
+                    company=self.company_model.get(self.company_guid),
+                    plan_type=self.plan_model.types.DEBIT,
+                    amount=10,
+                    frequency=self.plan_model.frequencies.MONTHLY,
+                ),
+            )
+        res = self.get(
+            '/v1/subscriptions/{}'.format(subscription.guid),
+            dict(expand='customer,plan'),
+        )
+        self.assertEqual(res.json['customer']['guid'], self.customer_guid)
+        self.assertEqual(res.json['plan']['amount'], 10)
+
+    def test_expand_with_fixed_query_count(self):
+        def count():
+            return self.count_queries(
+                self.get,
+                '/v1/invoices',
+                dict(expand='transactions', limit=100),
+            )
+
+        small_count = count()
+        self.add_invoices(5)
+        self.assertEqual(count(), small_count)
+
+    def test_expand_etag(self):
+        url = '/v1/invoices/{}'.format(self.invoice_guids[0])
+        params = dict(expand='transactions')
+        etag = self.get(url, params).headers['ETag']
+        # only the transaction is updated, not the invoice
+        with db_transaction.manager:
+            invoice = self.invoice_model.get(self.invoice_guids[0])
+            transaction = invoice.transactions[0]
+            transaction.status = self.transaction_model.statuses.FAILED
+            transaction.updated_at = invoice.updated_at.replace(day=17)
+        res = self.testapp.get(
+            url,
+            params,
+            headers={'If-None-Match': str(etag)},
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_bad_expand(self):
+        self.get('/v1/invoices', dict(expand='foo'), status=400)
+        self.get('/v1/customers', dict(expand='transactions'), status=400)
+        self.get(
+            '/v1/invoices/{}'.format(self.invoice_guids[0]),
+            dict(expand='items'),
+            status=400,
+        )
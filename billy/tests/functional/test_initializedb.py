@@ -92,6 +92,8 @@ class TestInitializedb(unittest.TestCase):
             'invoice',
             'item',
             'adjustment',
+            'callback_event',
+            'billing_run',
             'alembic_version',
         ]))
 
@@ -1,4 +1,5 @@
 from __future__ import unicode_literals
+import json
 
 import mock
 import transaction as db_transaction
@@ -89,6 +90,7 @@ class TestInvoiceViews(ViewTestCase):
 
         invoice = self.invoice_model.get(res.json['guid'])
         self.assertEqual(len(invoice.transactions), 0)
+        self.assertEqual(invoice.company_guid, self.company.guid)
 
     @mock.patch('billy.tests.fixtures.processor.DummyProcessor.validate_funding_instrument')
     def test_create_invoice_with_invalid_funding_instrument(
@@ -209,6 +211,137 @@ class TestInvoiceViews(ViewTestCase):
                     del adjustment[key]
         self.assertEqual(adjustment_result, adjustments)
 
+        # the amounts are stored, so that they can be used in queries
+        Invoice = self.invoice_model.TABLE
+        query = (
+            self.testapp.session.query(Invoice)
+            .filter(Invoice.effective_amount == 200 - 100 + 20 + 3)
+        )
+        self.assertEqual(query.one().guid, res.json['guid'])
+
+    def test_create_invoice_with_json_body(self):
+        items = [
+            dict(name='foo', amount=1234),
+            dict(name='bar', amount=5678, unit='hours', quantity=10),
+        ]
+        adjustments = [
+            dict(amount=-100, reason='coupon'),
+            dict(amount=20),
+        ]
+        res = self.testapp.post_json(
+            '/v1/invoices',
+            dict(
+                customer_guid=self.customer.guid,
+                amount=200,
+                title='usage',
+                items=items,
+                adjustments=adjustments,
+            ),
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+        self.assertEqual(res.json['title'], 'usage')
+        self.assertEqual(res.json['total_adjustment_amount'], -80)
+        self.assertEqual(res.json['effective_amount'], 120)
+        item_result = res.json['items']
+        adjustment_result = res.json['adjustments']
+        for entry in item_result + adjustment_result:
+            for key, value in list(entry.iteritems()):
+                if value is None:
+                    del entry[key]
+        self.assertEqual(item_result, items)
+        self.assertEqual(adjustment_result, adjustments)
+
+    def test_create_invoice_with_many_items(self):
+        items = [
+            dict(name='usage {}'.format(i), amount=i, volume=i)
+            for i in range(2000)
+        ]
+        statements = self.capture_queries(
+            self.testapp.post_json,
+            '/v1/invoices',
+            dict(
+                customer_guid=self.customer.guid,
+                amount=200,
+                items=items,
+            ),
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+        item_inserts = [
+            statement for statement in statements
+            if statement.startswith('INSERT INTO item ')
+        ]
+        self.assertEqual(len(item_inserts), 1)
+
+        invoice = self.testapp.session.query(self.invoice_model.TABLE).one()
+        self.assertEqual(len(invoice.items), 2000)
+        self.assertEqual(invoice.items[1999].name, 'usage 1999')
+
+    def test_create_invoice_with_bad_json_body(self):
+        def assert_bad_request(body):
+            self.testapp.post(
+                '/v1/invoices',
+                body,
+                headers={b'Content-Type': b'application/json'},
+                extra_environ=dict(REMOTE_USER=self.api_key),
+                status=400,
+            )
+
+        assert_bad_request(b'{"customer_guid":')
+        assert_bad_request(b'[]')
+        assert_bad_request(json.dumps(dict(
+            customer_guid=self.customer.guid,
+        )))
+        assert_bad_request(json.dumps(dict(
+            customer_guid=self.customer.guid,
+            amount=100,
+            items=[dict(name='foo')],
+        )))
+        assert_bad_request(json.dumps(dict(
+            customer_guid=self.customer.guid,
+            amount=100,
+            adjustments=dict(amount=10),
+        )))
+        for item in [
+            dict(name='foo', amount='abc'),
+            dict(name='foo', amount={}),
+            dict(name='foo', amount=True),
+            dict(name='foo', amount=10, quantity='many'),
+            dict(name='foo', amount=10, volume=[1]),
+        ]:
+            assert_bad_request(json.dumps(dict(
+                customer_guid=self.customer.guid,
+                amount=100,
+                items=[item],
+            )))
+        assert_bad_request(json.dumps(dict(
+            customer_guid=self.customer.guid,
+            amount=100,
+            adjustments=[dict(amount='abc')],
+        )))
+
+    def test_create_invoice_with_bad_form_entries(self):
+        def assert_bad_request(**kwargs):
+            self.testapp.post(
+                '/v1/invoices',
+                dict(customer_guid=self.customer.guid, amount=100, **kwargs),
+                extra_environ=dict(REMOTE_USER=self.api_key),
+                status=400,
+            )
+
+        assert_bad_request(item_name1='foo', item_amount1='abc')
+        assert_bad_request(item_name1='foo', item_amount1='10',
+                           item_quantity1='many')
+        assert_bad_request(item_name1='foo', item_amount1='10',
+                           item_volume1='1.5')
+        assert_bad_request(item_name1='foo')
+        assert_bad_request(adjustment_amount1='abc')
+        self.assertEqual(
+            self.testapp.session.query(self.invoice_model.TABLE).count(),
+            0,
+        )
+
     @mock.patch('billy.tests.fixtures.processor.DummyProcessor.debit')
     def test_create_invoice_with_funding_instrument_uri(self, debit_method):
         amount = 5566
@@ -258,6 +391,52 @@ class TestInvoiceViews(ViewTestCase):
                          self.transaction_model.statuses.SUCCEEDED)
         debit_method.assert_called_once_with(transaction)
 
+    @mock.patch('billy.tests.fixtures.processor.DummyProcessor.debit')
+    def test_create_invoice_with_deferred_processing(self, debit_method):
+        settings = self.testapp.app.registry.settings
+        settings['billy.transaction.processing_mode'] = 'deferred'
+        res = self.testapp.post(
+            '/v1/invoices',
+            dict(
+                customer_guid=self.customer.guid,
+                amount=5566,
+                funding_instrument_uri='MOCK_CARD_URI',
+            ),
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+        self.assertEqual(res.json['status'], 'processing')
+        invoice = self.invoice_model.get(res.json['guid'])
+        self.assertEqual(len(invoice.transactions), 1)
+        transaction = invoice.transactions[0]
+        self.assertEqual(transaction.submit_status,
+                         self.transaction_model.submit_statuses.STAGED)
+        self.assertFalse(debit_method.called)
+
+    def test_create_invoice_with_background_processing(self):
+        settings = self.testapp.app.registry.settings
+        settings['billy.transaction.processing_mode'] = 'background'
+        settings['transaction_executor'] = mock.Mock()
+        res = self.testapp.post(
+            '/v1/invoices',
+            dict(
+                customer_guid=self.customer.guid,
+                amount=5566,
+                funding_instrument_uri='MOCK_CARD_URI',
+            ),
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+        self.assertEqual(res.json['status'], 'processing')
+        invoice = self.invoice_model.get(res.json['guid'])
+        transaction = invoice.transactions[0]
+        self.assertEqual(transaction.submit_status,
+                         self.transaction_model.submit_statuses.STAGED)
+        submit_method = settings['transaction_executor'].submit
+        self.assertEqual(submit_method.call_count, 1)
+        self.assertEqual(list(submit_method.call_args[0][0]),
+                         [transaction.guid])
+
     @mock.patch('billy.tests.fixtures.processor.DummyProcessor.debit')
     def test_create_invoice_with_funding_instrument_uri_with_zero_amount(self, debit_method):
         amount = 0
@@ -359,6 +538,23 @@ class TestInvoiceViews(ViewTestCase):
             status=400,
         )
 
+    def test_create_invoice_to_a_pending_customer(self):
+        with db_transaction.manager:
+            customer = self.customer_model.create(
+                company=self.company,
+                pending=True,
+            )
+
+        self.testapp.post(
+            '/v1/invoices',
+            dict(
+                customer_guid=customer.guid,
+                amount=123,
+            ),
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=400,
+        )
+
     def test_get_invoice(self):
         res = self.testapp.post(
             '/v1/invoices',
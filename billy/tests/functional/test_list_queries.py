@@ -0,0 +1,108 @@
+from __future__ import unicode_literals
+
+import transaction as db_transaction
+from freezegun import freeze_time
+
+from billy.tests.functional.helper import ViewTestCase
+
+
+@freeze_time('2013-08-16')
+class TestListQueries(ViewTestCase):
+    """Make sure list endpoints issue a fixed number of queries no matter how
+    many records are on the page
+
+    """
+
+    def setUp(self):
+        super(TestListQueries, self).setUp()
+        with db_transaction.manager:
+            self.company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+            self.customer = self.customer_model.create(
+                company=self.company,
+            )
+        self.api_key = str(self.company.api_key)
+        self.company_guid = self.company.guid
+        self.customer_guid = self.customer.guid
+
+    def add_records(self, count):
+        with db_transaction.manager:
+            company = self.company_model.get(self.company_guid)
+            invoice_customer = self.customer_model.get(self.customer_guid)
+            for _ in range(count):
+                customer = self.customer_model.create(
+                    company=company,
+                )
+                plan = self.plan_model.create(
+                    company=company,
+                    plan_type=self.plan_model.types.DEBIT,
+                    amount=10,
+                    frequency=self.plan_model.frequencies.MONTHLY,
+                )
+                # a subscription yields a subscription invoice and
+                # transaction right away
+                self.subscription_model.create(
+                    customer=customer,
+                    plan=plan,
+                    funding_instrument_uri='/v1/cards/tester',
+                )
+                invoice = self.invoice_model.create(
+                    customer=invoice_customer,
+                    amount=100,
+                    items=[
+                        dict(name='foo', amount=60),
+                        dict(name='bar', amount=40),
+                    ],
+                    adjustments=[
+                        dict(amount=-10, reason='coupon'),
+                    ],
+                )
+                transaction = self.transaction_model.create(
+                    invoice=invoice,
+                    amount=90,
+                )
+                self.transaction_failure_model.create(
+                    transaction=transaction,
+                    error_message='Boom!',
+                )
+
+    def assert_fixed_query_count(self, url):
+        def get():
+            # Notice: start from a clean session and API key cache, so that
+            # nothing is served from the identity map or the cache
+            self.testapp.session.expunge_all()
+            self.settings['api_key_cache'].clear()
+            res = self.testapp.get(
+                url,
+                dict(limit=100),
+                extra_environ=dict(REMOTE_USER=self.api_key),
+                status=200,
+            )
+            return res
+
+        self.add_records(2)
+        small_count = self.count_queries(get)
+        self.add_records(8)
+        large_count = self.count_queries(get)
+        self.assertEqual(small_count, large_count)
+
+    def test_invoice_list(self):
+        self.assert_fixed_query_count('/v1/invoices')
+
+    def test_customer_invoice_list(self):
+        self.assert_fixed_query_count(
+            '/v1/customers/{}/invoices'.format(self.customer_guid),
+        )
+
+    def test_transaction_list(self):
+        self.assert_fixed_query_count('/v1/transactions')
+
+    def test_subscription_list(self):
+        self.assert_fixed_query_count('/v1/subscriptions')
+
+    def test_customer_list(self):
+        self.assert_fixed_query_count('/v1/customers')
+
+    def test_plan_list(self):
+        self.assert_fixed_query_count('/v1/plans')
@@ -0,0 +1,166 @@
+from __future__ import unicode_literals
+
+import transaction as db_transaction
+from freezegun import freeze_time
+
+from billy.metrics import REQUEST_DURATION
+from billy.metrics import PROCESSOR_CALL_DURATION
+from billy.metrics import PROCESSOR_ERRORS
+from billy.metrics import TRANSACTIONS_PROCESSED
+from billy.metrics import INVOICES_YIELDED
+from billy.tests.functional.helper import ViewTestCase
+
+
+@freeze_time('2013-08-16')
+class TestMetrics(ViewTestCase):
+
+    def setUp(self):
+        def model_factory_func():
+            return self.model_factory
+
+        self.settings = {
+            'billy.processor_factory': lambda: self.dummy_processor,
+            'model_factory_func': model_factory_func,
+            'db_session_cleanup': False,
+            'billy.metrics.enabled': 'true',
+        }
+        super(TestMetrics, self).setUp()
+        with db_transaction.manager:
+            self.company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+            self.customer = self.customer_model.create(
+                company=self.company
+            )
+            self.plan = self.plan_model.create(
+                company=self.company,
+                frequency=self.plan_model.frequencies.WEEKLY,
+                plan_type=self.plan_model.types.DEBIT,
+                amount=10,
+            )
+
+    def create_transaction(self):
+        with db_transaction.manager:
+            subscription = self.subscription_model.create(
+                customer=self.customer,
+                plan=self.plan,
+            )
+            transaction = self.transaction_model.create(
+                invoice=subscription.invoices[0],
+                transaction_type=self.transaction_model.types.DEBIT,
+                amount=10,
+                funding_instrument_uri='/v1/cards/tester',
+            )
+        return transaction
+
+    def test_metrics(self):
+        self.create_transaction()
+        res = self.testapp.get('/metrics', status=200)
+        self.assertEqual(res.content_type, 'text/plain')
+        self.assertIn('version=0.0.4', res.headers['Content-Type'])
+        self.assertIn(
+            '# TYPE billy_request_duration_seconds histogram',
+            res.text,
+        )
+        self.assertIn('billy_transaction_backlog{submit_status="staged"} 1',
+                      res.text)
+        self.assertIn(
+            'billy_transaction_backlog{submit_status="retrying"} 0',
+            res.text,
+        )
+        self.assertIn('billy_db_pool_checkouts{pool="primary"}', res.text)
+
+    def test_metrics_disabled(self):
+        self.testapp.app.registry.settings['billy.metrics.enabled'] = 'false'
+        self.testapp.get('/metrics', status=404)
+
+    def test_backlog_cached(self):
+        self.create_transaction()
+        res = self.testapp.get('/metrics', status=200)
+        self.assertIn('billy_transaction_backlog{submit_status="staged"} 1',
+                      res.text)
+        self.create_transaction()
+        res = self.testapp.get('/metrics', status=200)
+        self.assertIn('billy_transaction_backlog{submit_status="staged"} 1',
+                      res.text)
+        # counted again once the cached one is gone
+        settings = self.testapp.app.registry.settings
+        settings['metrics_backlog_cache'].clear()
+        res = self.testapp.get('/metrics', status=200)
+        self.assertIn('billy_transaction_backlog{submit_status="staged"} 2',
+                      res.text)
+
+    def test_request_duration(self):
+        count, _ = REQUEST_DURATION.get(view='server_info', method='GET')
+        self.testapp.get('/', status=200)
+        self.testapp.get('/', status=200)
+        self.assertEqual(
+            REQUEST_DURATION.get(view='server_info', method='GET')[0],
+            count + 2,
+        )
+
+        count, _ = REQUEST_DURATION.get(
+            view='CompanyIndexResource',
+            method='POST',
+        )
+        self.testapp.post(
+            '/v1/companies',
+            dict(processor_key='MOCK_PROCESSOR_KEY'),
+            status=200,
+        )
+        self.assertEqual(
+            REQUEST_DURATION.get(view='CompanyIndexResource', method='POST')[0],
+            count + 1,
+        )
+
+    def test_process_succeeded(self):
+        transaction = self.create_transaction()
+        calls, _ = PROCESSOR_CALL_DURATION.get(operation='debit')
+        succeeded = TRANSACTIONS_PROCESSED.get(result='succeeded')
+        with db_transaction.manager:
+            self.transaction_model.process_one(transaction)
+        self.assertEqual(
+            PROCESSOR_CALL_DURATION.get(operation='debit')[0],
+            calls + 1,
+        )
+        self.assertEqual(
+            TRANSACTIONS_PROCESSED.get(result='succeeded'),
+            succeeded + 1,
+        )
+
+    def test_process_retried_and_failed(self):
+        self.model_factory.settings['billy.transaction.maximum_retry'] = 1
+        transaction = self.create_transaction()
+        errors = PROCESSOR_ERRORS.get(operation='debit')
+        retried = TRANSACTIONS_PROCESSED.get(result='retried')
+        failed = TRANSACTIONS_PROCESSED.get(result='failed')
+
+        def debit(transaction):
+            raise RuntimeError('Boom!')
+
+        self.dummy_processor.debit = debit
+        with db_transaction.manager:
+            self.transaction_model.process_one(transaction)
+        with db_transaction.manager:
+            self.transaction_model.process_one(transaction)
+        self.assertEqual(PROCESSOR_ERRORS.get(operation='debit'), errors + 2)
+        self.assertEqual(
+            TRANSACTIONS_PROCESSED.get(result='retried'),
+            retried + 1,
+        )
+        self.assertEqual(
+            TRANSACTIONS_PROCESSED.get(result='failed'),
+            failed + 1,
+        )
+
+    def test_invoices_yielded(self):
+        with db_transaction.manager:
+            subscription = self.subscription_model.create(
+                customer=self.customer,
+                plan=self.plan,
+            )
+        count = INVOICES_YIELDED.get()
+        with freeze_time('2013-08-30'):
+            with db_transaction.manager:
+                self.subscription_model.yield_invoices([subscription])
+        self.assertEqual(INVOICES_YIELDED.get(), count + 2)
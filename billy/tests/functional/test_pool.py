@@ -0,0 +1,95 @@
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+
+from billy.models.pool import engine_from_settings
+from billy.models.pool import InstrumentedQueuePool
+
+
+class TestPool(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_url = 'sqlite:///{}'.format(
+            os.path.join(self.temp_dir, 'billy.sqlite')
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def make_engine(self, **kwargs):
+        settings = {'sqlalchemy.url': self.db_url}
+        for key, value in kwargs.iteritems():
+            settings['sqlalchemy.' + key] = value
+        return engine_from_settings(settings, 'sqlalchemy.', 'primary')
+
+    def test_stats(self):
+        engine, stats = self.make_engine(
+            poolclass=QueuePool,
+            pool_size='1',
+            max_overflow='1',
+            pool_timeout='0',
+        )
+        self.assertIsInstance(engine.pool, InstrumentedQueuePool)
+        conn1 = engine.connect()
+        self.assertEqual(stats.in_use, 1)
+        conn2 = engine.connect()
+        self.assertEqual(stats.in_use, 2)
+        self.assertEqual(stats.overflows, 1)
+        with self.assertRaises(TimeoutError):
+            engine.connect()
+        conn1.close()
+        conn2.close()
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot['in_use'], 0)
+        self.assertEqual(snapshot['max_in_use'], 2)
+        self.assertEqual(snapshot['checkouts'], 2)
+        self.assertEqual(snapshot['connects'], 2)
+        self.assertEqual(snapshot['overflows'], 1)
+        self.assertEqual(snapshot['timeouts'], 1)
+        self.assertTrue(snapshot['checkout_seconds'] >= 0)
+
+        # the instrumented pool is kept after disposing
+        engine.dispose()
+        self.assertIsInstance(engine.pool, InstrumentedQueuePool)
+        engine.connect().close()
+        self.assertEqual(stats.checkouts, 3)
+
+    def test_pre_ping(self):
+        engine, stats = self.make_engine(
+            poolclass=QueuePool,
+            pool_pre_ping='true',
+        )
+        conn = engine.connect()
+        dbapi_connection = conn.connection.connection
+        conn.close()
+        # the database server closed the connection in the meantime
+        dbapi_connection.close()
+        conn = engine.connect()
+        self.assertEqual(conn.scalar('SELECT 1'), 1)
+        self.assertIsNot(conn.connection.connection, dbapi_connection)
+        conn.close()
+        self.assertEqual(stats.disconnects, 1)
+
+    def test_pool_settings(self):
+        engine, stats = self.make_engine(
+            poolclass=QueuePool,
+            pool_size='3',
+            max_overflow='4',
+            pool_recycle='60',
+        )
+        self.assertEqual(engine.pool.size(), 3)
+        self.assertEqual(engine.pool._max_overflow, 4)
+        self.assertEqual(engine.pool._recycle, 60)
+
+        # SQLite file databases open connections on demand
+        engine, stats = self.make_engine()
+        self.assertNotIsInstance(engine.pool, QueuePool)
+        engine.connect().close()
+        self.assertEqual(stats.checkouts, 1)
+        self.assertEqual(stats.in_use, 0)
@@ -5,12 +5,15 @@ import unittest
 import tempfile
 import shutil
 import textwrap
+import pstats
 import StringIO
 
 import mock
 import transaction as db_transaction
+from sqlalchemy.exc import IntegrityError
 from pyramid.paster import get_appsettings
 
+from billy.db import tables
 from billy.models import setup_database
 from billy.models.transaction import TransactionModel
 from billy.models.model_factory import ModelFactory
@@ -40,7 +43,7 @@ class TestProcessTransactions(unittest.TestCase):
         finally:
             sys.stdout = old_stdout
         expected = textwrap.dedent("""\
-        usage: process_transactions <config_uri>
+        usage: process_transactions [--profile=<pstats_file>] <config_uri>
         (example: "process_transactions development.ini")
         """)
         self.assertMultiLineEqual(usage_out.getvalue(), expected)
@@ -62,6 +65,234 @@ class TestProcessTransactions(unittest.TestCase):
         # ensure process_transaction method is called correctly
         process_transactions_method.assert_called_once()
 
+    @mock.patch('billy.scripts.process_transactions.log_query_stats')
+    def test_main_query_stats(self, log_query_stats_method):
+        cfg_path = os.path.join(self.temp_dir, 'config.ini')
+        with open(cfg_path, 'wt') as f:
+            f.write(textwrap.dedent("""\
+            [app:main]
+            use = egg:billy
+
+            sqlalchemy.url = sqlite:///%(here)s/billy.sqlite
+            billy.query_stats.batch_max_count = 10
+            billy.query_stats.batch_max_db_time = 500
+            """))
+        initializedb.main([initializedb.__file__, cfg_path])
+        process_transactions.main([process_transactions.__file__, cfg_path],
+                                  processor=DummyProcessor())
+        names = []
+        for call in log_query_stats_method.call_args_list:
+            _, name, stats, max_count, max_seconds = call[0]
+            names.append(name)
+            self.assertEqual(max_count, 10)
+            self.assertEqual(max_seconds, 0.5)
+            self.assertTrue(stats.count > 0)
+        self.assertEqual(names, [
+            'CompanyModel.reconcile_pending',
+            'CustomerModel.reconcile_pending',
+            'CallbackEventConsumer.consume',
+            'SubscriptionModel.yield_invoices',
+            'TransactionModel.process_transactions',
+        ])
+
+    def test_main_billing_run(self):
+        dummy_processor = DummyProcessor()
+        cfg_path = os.path.join(self.temp_dir, 'config.ini')
+        profile_path = os.path.join(self.temp_dir, 'billy.pstats')
+        with open(cfg_path, 'wt') as f:
+            f.write(textwrap.dedent("""\
+            [app:main]
+            use = egg:billy
+
+            sqlalchemy.url = sqlite:///%(here)s/billy.sqlite
+            billy.transaction.maximum_retry = 0
+            """))
+        initializedb.main([initializedb.__file__, cfg_path])
+
+        settings = get_appsettings(cfg_path)
+        settings = setup_database({}, **settings)
+        session = settings['session']
+        factory = ModelFactory(
+            session=session,
+            processor_factory=lambda: dummy_processor,
+            settings=settings,
+        )
+        company_model = factory.create_company_model()
+        customer_model = factory.create_customer_model()
+        plan_model = factory.create_plan_model()
+        subscription_model = factory.create_subscription_model()
+        with db_transaction.manager:
+            company = company_model.create('my_secret_key')
+            plan = plan_model.create(
+                company=company,
+                plan_type=plan_model.types.DEBIT,
+                amount=10,
+                frequency=plan_model.frequencies.MONTHLY,
+            )
+            for _ in range(3):
+                customer = customer_model.create(company=company)
+                subscription_model.create(
+                    customer=customer,
+                    plan=plan,
+                    funding_instrument_uri='/v1/cards/tester',
+                )
+        session.remove()
+
+        debits = []
+
+        def debit(transaction):
+            debits.append(transaction.guid)
+            if len(debits) == 2:
+                raise RuntimeError('Boom!')
+            return dict(
+                processor_uri='MOCK_DEBIT_URI',
+                status=TransactionModel.statuses.SUCCEEDED,
+            )
+
+        dummy_processor.debit = debit
+        process_transactions.main(
+            [
+                process_transactions.__file__,
+                '--profile={}'.format(profile_path),
+                cfg_path,
+            ],
+            processor=dummy_processor,
+        )
+
+        billing_run = session.query(tables.BillingRun).one()
+        self.assertEqual(billing_run.invoices_yielded, 0)
+        self.assertEqual(billing_run.transactions_attempted, 3)
+        self.assertEqual(billing_run.transactions_succeeded, 2)
+        self.assertEqual(billing_run.transactions_retried, 0)
+        self.assertEqual(billing_run.transactions_failed, 1)
+        self.assertTrue(billing_run.process_seconds > 0)
+        self.assertTrue(billing_run.db_statements > 0)
+        self.assertTrue(billing_run.db_seconds > 0)
+        self.assertTrue(billing_run.processor_seconds >= 0)
+        self.assertTrue(billing_run.finished_at >= billing_run.started_at)
+        self.assertEqual(billing_run.profile_path, profile_path)
+        self.assertEqual(billing_run.error_message, None)
+        # make sure the profile can be loaded
+        pstats.Stats(profile_path)
+
+    def test_main_billing_run_with_error(self):
+        cfg_path = os.path.join(self.temp_dir, 'config.ini')
+        with open(cfg_path, 'wt') as f:
+            f.write(textwrap.dedent("""\
+            [app:main]
+            use = egg:billy
+
+            sqlalchemy.url = sqlite:///%(here)s/billy.sqlite
+            """))
+        initializedb.main([initializedb.__file__, cfg_path])
+        with mock.patch(
+            'billy.models.transaction.TransactionModel.process_transactions'
+        ) as process_transactions_method:
+            process_transactions_method.side_effect = RuntimeError('Boom!')
+            with self.assertRaises(RuntimeError):
+                process_transactions.main(
+                    [process_transactions.__file__, cfg_path],
+                    processor=DummyProcessor(),
+                )
+
+        settings = get_appsettings(cfg_path)
+        settings = setup_database({}, **settings)
+        billing_run = settings['session'].query(tables.BillingRun).one()
+        self.assertEqual(billing_run.error_message, 'RuntimeError: Boom!')
+        self.assertEqual(billing_run.transactions_attempted, 0)
+
+    def test_main_billing_run_with_db_error(self):
+        cfg_path = os.path.join(self.temp_dir, 'config.ini')
+        with open(cfg_path, 'wt') as f:
+            f.write(textwrap.dedent("""\
+            [app:main]
+            use = egg:billy
+
+            sqlalchemy.url = sqlite:///%(here)s/billy.sqlite
+            """))
+        initializedb.main([initializedb.__file__, cfg_path])
+
+        def yield_invoices(model):
+            # two companies with the same API key violate the unique
+            # constraint
+            for guid in ['CP1', 'CP2']:
+                model.session.add(tables.Company(
+                    guid=guid,
+                    api_key='MOCK_API_KEY',
+                    processor_key='MOCK_PROCESSOR_KEY',
+                    callback_key=guid,
+                ))
+            model.session.flush()
+
+        with mock.patch(
+            'billy.models.subscription.SubscriptionModel.yield_invoices',
+            autospec=True,
+        ) as yield_invoices_method:
+            yield_invoices_method.side_effect = yield_invoices
+            with self.assertRaises(IntegrityError):
+                process_transactions.main(
+                    [process_transactions.__file__, cfg_path],
+                    processor=DummyProcessor(),
+                )
+
+        settings = get_appsettings(cfg_path)
+        settings = setup_database({}, **settings)
+        session = settings['session']
+        billing_run = session.query(tables.BillingRun).one()
+        self.assertTrue(billing_run.error_message.startswith('IntegrityError'))
+        self.assertNotEqual(billing_run.yield_seconds, None)
+        self.assertEqual(session.query(tables.Company).count(), 0)
+
+    def test_main_billing_run_with_early_error(self):
+        cfg_path = os.path.join(self.temp_dir, 'config.ini')
+        with open(cfg_path, 'wt') as f:
+            f.write(textwrap.dedent("""\
+            [app:main]
+            use = egg:billy
+
+            sqlalchemy.url = sqlite:///%(here)s/billy.sqlite
+            """))
+        initializedb.main([initializedb.__file__, cfg_path])
+        # the original error should be raised rather than a NameError from
+        # reading query stats of the run
+        with mock.patch(
+            'billy.scripts.process_transactions.record_queries'
+        ) as record_queries:
+            record_queries.side_effect = RuntimeError('Boom!')
+            with self.assertRaises(RuntimeError):
+                process_transactions.main(
+                    [process_transactions.__file__, cfg_path],
+                    processor=DummyProcessor(),
+                )
+
+        settings = get_appsettings(cfg_path)
+        settings = setup_database({}, **settings)
+        billing_run = settings['session'].query(tables.BillingRun).one()
+        self.assertEqual(billing_run.error_message, 'RuntimeError: Boom!')
+        self.assertEqual(billing_run.db_statements, 0)
+
+    def test_main_metrics_textfile(self):
+        cfg_path = os.path.join(self.temp_dir, 'config.ini')
+        metrics_path = os.path.join(self.temp_dir, 'billy.prom')
+        with open(cfg_path, 'wt') as f:
+            f.write(textwrap.dedent("""\
+            [app:main]
+            use = egg:billy
+
+            sqlalchemy.url = sqlite:///%(here)s/billy.sqlite
+            billy.metrics.textfile = {}
+            """.format(metrics_path)))
+        initializedb.main([initializedb.__file__, cfg_path])
+        process_transactions.main([process_transactions.__file__, cfg_path],
+                                  processor=DummyProcessor())
+        with open(metrics_path, 'rt') as f:
+            content = f.read()
+        self.assertIn('# TYPE billy_transactions_processed_total counter',
+                      content)
+        self.assertIn('billy_transaction_backlog{submit_status="staged"} 0',
+                      content)
+        self.assertFalse(os.path.exists(metrics_path + '.tmp'))
+
     def test_main_with_crash(self):
         dummy_processor = DummyProcessor()
         dummy_processor.debit = mock.Mock()
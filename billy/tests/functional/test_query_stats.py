@@ -0,0 +1,93 @@
+from __future__ import unicode_literals
+
+import mock
+import transaction as db_transaction
+
+from billy.models.query_stats import record_queries
+from billy.tests.functional.helper import ViewTestCase
+
+
+# Notice: time is not frozen here, so that database time can be measured
+class TestQueryStats(ViewTestCase):
+
+    def setUp(self):
+        super(TestQueryStats, self).setUp()
+        with db_transaction.manager:
+            self.company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+            for _ in range(3):
+                self.customer_model.create(company=self.company)
+        self.api_key = str(self.company.api_key)
+        self.testapp.app.registry.settings.update({
+            'billy.query_stats.enabled': 'true',
+            'billy.query_stats.headers': 'true',
+        })
+
+    def get(self, url):
+        self.testapp.session.expunge_all()
+        return self.testapp.get(
+            url,
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+
+    def test_headers(self):
+        # warm up the API key cache
+        self.get('/v1/customers')
+        statements = self.capture_queries(self.get, '/v1/customers')
+        res = self.get('/v1/customers')
+        self.assertEqual(
+            int(res.headers['X-Billy-Query-Count']),
+            len(statements),
+        )
+        self.assertTrue(float(res.headers['X-Billy-DB-Time']) > 0)
+
+        self.testapp.app.registry.settings['billy.query_stats.headers'] = (
+            'false'
+        )
+        res = self.get('/v1/customers')
+        self.assertNotIn('X-Billy-Query-Count', res.headers)
+
+    def test_disabled(self):
+        self.testapp.app.registry.settings['billy.query_stats.enabled'] = (
+            'false'
+        )
+        res = self.get('/v1/customers')
+        self.assertNotIn('X-Billy-Query-Count', res.headers)
+
+    @mock.patch('billy.api.query_stats.log_query_stats')
+    def test_thresholds(self, log_query_stats_method):
+        settings = self.testapp.app.registry.settings
+        settings['billy.query_stats.max_count'] = '100'
+        self.get('/v1/customers')
+        self.assertFalse(log_query_stats_method.called)
+
+        # the company is cached, listing customers takes only one query
+        settings['billy.query_stats.max_count'] = '0'
+        self.get('/v1/customers')
+        _, name, stats, max_count, max_seconds = (
+            log_query_stats_method.call_args[0]
+        )
+        self.assertEqual(name, 'GET /v1/customers (CustomerIndexResource)')
+        self.assertEqual(stats.count, 1)
+        self.assertIn('FROM customer', stats.format_statements())
+        self.assertEqual(max_count, 0)
+        self.assertEqual(max_seconds, None)
+
+        settings['billy.query_stats.max_count'] = ''
+        settings['billy.query_stats.max_db_time'] = '0.000001'
+        self.get('/v1/customers')
+        self.assertEqual(log_query_stats_method.call_count, 2)
+
+    def test_nested_scopes(self):
+        with record_queries() as outer:
+            self.customer_model.list_by_context(self.company).all()
+            with record_queries(max_statements=0) as inner:
+                self.customer_model.list_by_context(self.company).all()
+        self.assertEqual(outer.count, 2)
+        self.assertEqual(len(outer.statements), 2)
+        self.assertEqual(inner.count, 1)
+        self.assertEqual(inner.statements, [])
+        self.assertTrue(inner.exceeds(max_count=0))
+        self.assertFalse(inner.exceeds(max_count=1, max_seconds=10))
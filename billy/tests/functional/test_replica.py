@@ -0,0 +1,169 @@
+from __future__ import unicode_literals
+
+import mock
+import transaction as db_transaction
+from freezegun import freeze_time
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from billy.models.replica import Replica
+from billy.tests.functional.helper import ViewTestCase
+
+
+@freeze_time('2013-08-16')
+class TestReplica(ViewTestCase):
+
+    def setUp(self):
+        super(TestReplica, self).setUp()
+        with db_transaction.manager:
+            self.company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+            self.customer = self.customer_model.create(
+                company=self.company,
+            )
+        self.api_key = str(self.company.api_key)
+        self.customer_guid = self.customer.guid
+        # Notice: the replica shares the connection pool with the primary,
+        # so that it has the same in-memory database
+        self.replica = Replica(
+            self.settings['engine'].execution_options(),
+            max_lag=5,
+            check_interval=0,
+        )
+        self.testapp.app.registry.settings['replica'] = self.replica
+        self.testapp.session.remove()
+        self.testapp.session.configure(replica=self.replica)
+
+    def tearDown(self):
+        self.testapp.session.remove()
+        self.testapp.session.configure(replica=None)
+        super(TestReplica, self).tearDown()
+
+    def capture_engines(self, func, *args, **kwargs):
+        """Call the given function and return (statement, is_replica) of
+        SQL statements it executed
+
+        """
+        engine = self.settings['engine']
+        executed = []
+
+        def before_cursor_execute(
+            conn, cursor, statement, parameters, context, executemany
+        ):
+            executed.append((statement, conn.engine is self.replica.engine))
+
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            func(*args, **kwargs)
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        return executed
+
+    def request(self, method, url, params=None):
+        func = getattr(self.testapp, method)
+        return self.capture_engines(
+            func,
+            url,
+            params or {},
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+
+    def test_get_from_replica(self):
+        for url in [
+            '/v1/customers',
+            '/v1/customers/{}'.format(self.customer_guid),
+            '/v1/transactions/export',
+        ]:
+            executed = self.request('get', url)
+            self.assertTrue(executed)
+            for statement, is_replica in executed:
+                self.assertTrue(is_replica, statement)
+
+    def test_write_on_primary(self):
+        executed = self.request('post', '/v1/customers')
+        self.assertTrue(executed)
+        for statement, is_replica in executed:
+            self.assertFalse(is_replica, statement)
+        # the flag does not stay after the request
+        executed = self.capture_engines(
+            self.customer_model.get,
+            self.customer_guid,
+            with_lockmode='read',
+        )
+        self.assertFalse(executed[0][1])
+
+    def test_stay_on_primary_after_write(self):
+        session = self.testapp.session
+        session.expunge_all()
+        session().use_replica(True)
+        executed = self.capture_engines(
+            self.customer_model.get,
+            self.customer_guid,
+        )
+        self.assertEqual([is_replica for _, is_replica in executed], [True])
+
+        # rows locked for update are read from the primary, so are the
+        # following reads
+        session.expunge_all()
+        executed = self.capture_engines(
+            self.customer_model.get,
+            self.customer_guid,
+            with_lockmode='update',
+        )
+        self.assertEqual([is_replica for _, is_replica in executed], [False])
+        session.expunge_all()
+        executed = self.capture_engines(
+            self.customer_model.get,
+            self.customer_guid,
+        )
+        self.assertEqual([is_replica for _, is_replica in executed], [False])
+
+        def write_and_read():
+            with db_transaction.manager:
+                customer = self.customer_model.get(self.customer_guid)
+                customer.processor_uri = 'NEW_CUSTOMER_URI'
+                session.flush()
+                session.expunge_all()
+                self.customer_model.get(self.customer_guid)
+
+        session.expunge_all()
+        session().use_replica(True)
+        executed = self.capture_engines(write_and_read)
+        self.assertEqual(executed[0][1], True)
+        self.assertIn('UPDATE customer', executed[1][0])
+        for statement, is_replica in executed[1:]:
+            self.assertFalse(is_replica, statement)
+
+    def test_staleness_fallback(self):
+        url = '/v1/customers'
+        with mock.patch.object(self.replica, 'lag') as lag_method:
+            lag_method.return_value = 10
+            for _, is_replica in self.request('get', url):
+                self.assertFalse(is_replica)
+            lag_method.return_value = 1
+            for _, is_replica in self.request('get', url):
+                self.assertTrue(is_replica)
+            lag_method.side_effect = OperationalError('SELECT', {}, None)
+            for _, is_replica in self.request('get', url):
+                self.assertFalse(is_replica)
+
+    def test_check_interval(self):
+        now = [0]
+        replica = Replica(
+            self.replica.engine,
+            max_lag=5,
+            check_interval=10,
+            timer=lambda: now[0],
+        )
+        with mock.patch.object(replica, 'lag') as lag_method:
+            lag_method.return_value = 10
+            self.assertFalse(replica.usable())
+            lag_method.return_value = 0
+            now[0] = 9
+            self.assertFalse(replica.usable())
+            now[0] = 10
+            self.assertTrue(replica.usable())
+            self.assertEqual(lag_method.call_count, 2)
+        self.assertEqual(replica.lag(), 0)
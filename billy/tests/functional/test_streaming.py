@@ -0,0 +1,151 @@
+from __future__ import unicode_literals
+
+import mock
+import transaction as db_transaction
+from freezegun import freeze_time
+from webtest import TestApp
+
+from billy import main
+from billy.api.utils import RecordStream
+from billy.tests.functional.helper import ViewTestCase
+
+
+@freeze_time('2013-08-16')
+class TestStreamingList(ViewTestCase):
+
+    def setUp(self):
+        super(TestStreamingList, self).setUp()
+        with db_transaction.manager:
+            self.company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+            self.customer = self.customer_model.create(
+                company=self.company,
+            )
+            for i in range(5):
+                self.invoice_model.create(
+                    customer=self.customer,
+                    amount=100 + i,
+                    funding_instrument_uri='/v1/cards/tester',
+                )
+        self.api_key = str(self.company.api_key)
+
+    def get(self, url, chunk_size):
+        self.testapp.app.registry.settings['api.json.stream_chunk_size'] = (
+            chunk_size
+        )
+        return self.testapp.get(
+            url,
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+
+    def test_streamed_list(self):
+        for url in [
+            '/v1/transactions?limit=4',
+            '/v1/transactions?limit=5',
+            '/v1/transactions?limit=10',
+            '/v1/transactions?limit=10&offset=3',
+            '/v1/customers/{}/invoices?limit=10'.format(self.customer.guid),
+        ]:
+            expected = self.get(url, chunk_size=0)
+            res = self.get(url, chunk_size=2)
+            self.assertEqual(res.content_type, 'application/json')
+            self.assertEqual(res.json, expected.json)
+            self.assertEqual(res.body, expected.body)
+
+    def test_streamed_list_with_cursor(self):
+        expected = self.get('/v1/transactions?limit=5', chunk_size=0)
+        expected_guids = [item['guid'] for item in expected.json['items']]
+
+        res = self.get('/v1/transactions?limit=3&cursor=', chunk_size=2)
+        guids = [item['guid'] for item in res.json['items']]
+        next_cursor = res.json['next_cursor']
+        self.assertNotEqual(next_cursor, None)
+
+        res = self.get(
+            '/v1/transactions?limit=3&cursor={}'.format(next_cursor),
+            chunk_size=2,
+        )
+        guids.extend(item['guid'] for item in res.json['items'])
+        self.assertEqual(res.json['next_cursor'], None)
+        self.assertEqual(guids, expected_guids)
+
+    def test_streamed_list_with_records_deleted_in_between(self):
+        url = '/v1/transactions?limit=10&offset=1'
+        expected = self.get(url, chunk_size=0)
+        expected_guids = [item['guid'] for item in expected.json['items']]
+        Transaction = self.transaction_model.TABLE
+        fetch = RecordStream._fetch
+        calls = []
+
+        def fetch_chunk(stream, context, offset, limit, cursor):
+            calls.append((offset, cursor))
+            # records of the first chunk are deleted before the second one
+            # is fetched, they should not make the offset skip any records
+            if len(calls) == 2:
+                self.testapp.session.execute(
+                    Transaction.__table__.delete()
+                    .where(Transaction.guid.in_(expected_guids[:2]))
+                )
+            return fetch(stream, context, offset, limit, cursor)
+
+        with mock.patch.object(
+            RecordStream,
+            '_fetch',
+            autospec=True,
+            side_effect=fetch_chunk,
+        ):
+            res = self.get(url, chunk_size=2)
+        guids = [item['guid'] for item in res.json['items']]
+        self.assertEqual(guids, expected_guids)
+        # only the first chunk is fetched by offset
+        self.assertEqual(calls[0][0], 1)
+        self.assertEqual(set(call[0] for call in calls[1:]), set([0]))
+
+    def test_streamed_empty_list(self):
+        res = self.get('/v1/plans?limit=10', chunk_size=2)
+        self.assertEqual(res.json['items'], [])
+        expected = self.get('/v1/plans?limit=10', chunk_size=0)
+        self.assertEqual(res.body, expected.body)
+
+    def test_streamed_list_with_bad_cursor(self):
+        self.testapp.app.registry.settings['api.json.stream_chunk_size'] = 2
+        self.testapp.get(
+            '/v1/transactions?limit=10&cursor=BAD',
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=400,
+        )
+
+
+@freeze_time('2013-08-16')
+class TestCompactJSON(ViewTestCase):
+
+    def setUp(self):
+        super(TestCompactJSON, self).setUp()
+        settings = dict(self.settings)
+        settings['api.json.pretty_print'] = 'false'
+        self.testapp = TestApp(main({}, **settings))
+        self.testapp.session = self.settings['session']
+        with db_transaction.manager:
+            self.company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+            for _ in range(3):
+                self.customer_model.create(
+                    company=self.company,
+                )
+        self.api_key = str(self.company.api_key)
+
+    def test_compact_output(self):
+        settings = self.testapp.app.registry.settings
+        for chunk_size in [0, 2]:
+            settings['api.json.stream_chunk_size'] = chunk_size
+            res = self.testapp.get(
+                '/v1/customers?limit=10',
+                extra_environ=dict(REMOTE_USER=self.api_key),
+                status=200,
+            )
+            self.assertNotIn(b'\n', res.body)
+            self.assertNotIn(b', ', res.body)
+            self.assertEqual(len(res.json['items']), 3)
@@ -274,6 +274,25 @@ class TestSubscriptionViews(ViewTestCase):
             status=400,
         )
 
+    def test_create_subscription_to_a_pending_customer(self):
+        with db_transaction.manager:
+            customer = self.customer_model.create(
+                company=self.company,
+                pending=True,
+            )
+
+        self.testapp.post(
+            '/v1/subscriptions',
+            dict(
+                customer_guid=customer.guid,
+                plan_guid=self.plan.guid,
+                amount='123',
+                funding_instrument_uri='MOCK_CARD_URI',
+            ),
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=400,
+        )
+
     def test_create_subscription_with_none_amount(self):
         res = self.testapp.post(
             '/v1/subscriptions',
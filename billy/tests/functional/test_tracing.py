@@ -0,0 +1,159 @@
+from __future__ import unicode_literals
+
+import mock
+import transaction as db_transaction
+
+from billy.models.executor import TransactionExecutor
+from billy.models.tracing import TracedModel
+from billy.models.model_factory import ModelFactory
+from billy.utils.tracing import Tracer
+from billy.tests.functional.helper import ViewTestCase
+
+
+class TestTracing(ViewTestCase):
+
+    def setUp(self):
+        self.spans = []
+
+        def model_factory_func():
+            return self.model_factory
+
+        self.tracer = Tracer(exporter=self)
+        self.settings = {
+            'billy.processor_factory': lambda: self.dummy_processor,
+            'model_factory_func': model_factory_func,
+            'db_session_cleanup': False,
+            'tracer': self.tracer,
+        }
+        super(TestTracing, self).setUp()
+        with db_transaction.manager:
+            self.company = self.company_model.create(
+                processor_key='MOCK_PROCESSOR_KEY',
+            )
+        self.api_key = str(self.company.api_key)
+        del self.spans[:]
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def span_names(self):
+        return set(span.name for span in self.spans)
+
+    def assert_one_trace(self, spans):
+        trace_ids = set(span.trace_id for span in spans)
+        self.assertEqual(len(trace_ids), 1)
+        span_ids = set(span.span_id for span in spans)
+        roots = [span for span in spans if span.parent_id is None]
+        self.assertEqual(len(roots), 1)
+        for span in spans:
+            if span.parent_id is not None:
+                self.assertIn(span.parent_id, span_ids)
+        return roots[0]
+
+    def test_request(self):
+        self.testapp.post(
+            '/v1/customers',
+            dict(processor_uri='MOCK_CUSTOMER_URI'),
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+        root = self.assert_one_trace(self.spans)
+        self.assertEqual(root.name, 'CustomerIndexResource')
+        self.assertEqual(root.attributes['method'], 'POST')
+        self.assertEqual(root.attributes['status'], 200)
+        names = self.span_names()
+        self.assertIn('CustomerModel.create', names)
+        self.assertIn('DummyProcessor.validate_customer', names)
+        self.assertIn('SQL', names)
+        # spans are exported when they finish, the root is the last one
+        self.assertIs(self.spans[-1], root)
+        create_span = [
+            span for span in self.spans if span.name == 'CustomerModel.create'
+        ][0]
+        sql_spans = [
+            span for span in self.spans
+            if span.name == 'SQL' and span.parent_id == create_span.span_id
+        ]
+        self.assertTrue(sql_spans)
+        self.assertIn('statement', sql_spans[0].attributes)
+
+    def test_error(self):
+        def create_customer(customer):
+            raise RuntimeError('Boom!')
+
+        self.dummy_processor.create_customer = create_customer
+        with self.assertRaises(RuntimeError):
+            self.testapp.post(
+                '/v1/customers',
+                extra_environ=dict(REMOTE_USER=self.api_key),
+            )
+        errors = dict(
+            (span.name, span.error) for span in self.spans if span.error
+        )
+        self.assertEqual(
+            errors['DummyProcessor.create_customer'],
+            'RuntimeError: Boom!',
+        )
+        self.assertEqual(
+            errors['CustomerIndexResource'],
+            'RuntimeError: Boom!',
+        )
+
+    def test_sample_rate(self):
+        self.tracer.sample_rate = 0
+        self.testapp.get('/', status=200)
+        self.testapp.get(
+            '/v1/customers',
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=200,
+        )
+        self.assertEqual(self.spans, [])
+
+    def test_executor(self):
+        with db_transaction.manager:
+            customer = self.customer_model.create(company=self.company)
+            invoice = self.invoice_model.create(
+                customer=customer,
+                amount=100,
+                funding_instrument_uri='/v1/cards/tester',
+            )
+            transaction_guid = invoice.transactions[0].guid
+        del self.spans[:]
+
+        executor = TransactionExecutor(
+            session=self.testapp.session,
+            processor_factory=lambda: self.dummy_processor,
+            settings=self.settings,
+        )
+        # Notice: workers cannot see the in-memory database of this thread,
+        # so we process the submitted transactions here
+        with mock.patch.object(executor, '_ensure_started'):
+            with self.tracer.span('submit') as parent:
+                executor.submit([transaction_guid])
+        guids, trace_context = executor.queue.get()
+        executor.process(guids, trace_context=trace_context)
+
+        root = self.assert_one_trace(self.spans)
+        self.assertIs(root, parent)
+        process_span = [
+            span for span in self.spans
+            if span.name == 'TransactionExecutor.process'
+        ][0]
+        self.assertEqual(process_span.parent_id, parent.span_id)
+        self.assertIn('DummyProcessor.debit', self.span_names())
+        self.assertIn('TransactionModel.process_transactions',
+                      self.span_names())
+
+    def test_disabled(self):
+        factory = ModelFactory(
+            session=self.testapp.session,
+            settings=dict(tracer=Tracer()),
+        )
+        self.assertNotIsInstance(
+            factory.create_company_model(),
+            TracedModel,
+        )
+        self.assertIsInstance(
+            self.model_factory.create_company_model(),
+            TracedModel,
+        )
@@ -59,6 +59,7 @@ class TestTransactionViews(ViewTestCase):
         self.assertEqual(res.json['failures'], [])
         self.assertEqual(res.json['processor_uri'], None)
         self.assertEqual(res.json['invoice_guid'], transaction.invoice_guid)
+        self.assertEqual(transaction.company_guid, self.company.guid)
 
     def test_transaction_list_by_company(self):
         guids = [self.transaction.guid]
@@ -84,6 +85,45 @@ class TestTransactionViews(ViewTestCase):
         result_guids = [item['guid'] for item in items]
         self.assertEqual(set(result_guids), set(guids[5:8]))
 
+    def test_transaction_list_by_company_with_cursor(self):
+        guids = [self.transaction.guid]
+        with db_transaction.manager:
+            for i in range(9):
+                # some of them share the same created_at
+                with freeze_time('2013-08-16 00:00:{:02}'.format(i // 2 + 1)):
+                    transaction = self.transaction_model.create(
+                        invoice=self.invoice,
+                        transaction_type=self.transaction_model.types.DEBIT,
+                        amount=10 * i,
+                        funding_instrument_uri='/v1/cards/tester',
+                    )
+                    guids.append(transaction.guid)
+
+        result_guids = []
+        cursor = ''
+        pages = 0
+        while cursor is not None:
+            res = self.testapp.get(
+                '/v1/transactions',
+                dict(cursor=cursor, limit=3),
+                extra_environ=dict(REMOTE_USER=self.api_key),
+                status=200,
+            )
+            result_guids.extend(item['guid'] for item in res.json['items'])
+            cursor = res.json['next_cursor']
+            pages += 1
+        self.assertEqual(len(result_guids), 10)
+        self.assertEqual(set(result_guids), set(guids))
+        self.assertEqual(pages, 4)
+
+    def test_transaction_list_with_bad_cursor(self):
+        self.testapp.get(
+            '/v1/transactions',
+            dict(cursor='BAD_CURSOR'),
+            extra_environ=dict(REMOTE_USER=self.api_key),
+            status=400,
+        )
+
     def test_transaction_list_by_company_with_bad_api_key(self):
         self.testapp.get(
             '/v1/transactions',
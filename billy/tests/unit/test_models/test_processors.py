@@ -24,6 +24,7 @@ class TestPaymentProcessorModel(unittest.TestCase):
         for method_name in [
             'configure_api_key',
             'callback',
+            'get_callback_event_id',
             'register_callback',
             'validate_customer',
             'validate_funding_instrument',
@@ -131,6 +132,26 @@ class TestBalancedProcessorModel(ModelTestCase):
         self.assertEqual(events[0].status, self.transaction_model.statuses.SUCCEEDED)
         self.assertEqual(events[0].occurred_at, event.occurred_at)
 
+    def make_http_error(self, status_code):
+        response = mock.Mock(status_code=status_code, data={})
+        return balanced.exc.HTTPError(mock.Mock(response=response))
+
+    def test_callback_with_balanced_error(self):
+        Event = mock.Mock()
+        payload = self.make_callback_payload()
+        processor = self.make_one(event_cls=Event)
+
+        # the event is invalid
+        Event.fetch.side_effect = self.make_http_error(404)
+        with self.assertRaises(InvalidCallbackPayload):
+            processor.callback(self.company, payload)
+
+        # Balanced is unavailable, the error should not fail the event
+        for status_code in [500, 503]:
+            Event.fetch.side_effect = self.make_http_error(status_code)
+            with self.assertRaises(balanced.exc.HTTPError):
+                processor.callback(self.company, payload)
+
     def test_callback_without_meta_guid(self):
         event = self.make_event()
         event.entity['entity_type'][0]['meta'] = {}
@@ -165,6 +186,57 @@ class TestBalancedProcessorModel(ModelTestCase):
         with self.assertRaises(DuplicateEventError):
             self._do_callback('EV_ID_1', 'succeeded', now)
 
+    def test_duplicate_event_keeps_unit_of_work(self):
+        now = utc_now()
+        self._do_callback('EV_ID_1', 'succeeded', now)
+        with db_transaction.manager:
+            self.transaction_model.update(self.transaction)
+            # the duplicate event should not roll back other changes in
+            # the same database transaction
+            with self.assertRaises(DuplicateEventError):
+                self.transaction_model.add_event(
+                    transaction=self.transaction,
+                    processor_id='EV_ID_1',
+                    status=self.transaction_model.statuses.SUCCEEDED,
+                    occurred_at=now,
+                )
+            self.assertIn(self.transaction, self.transaction_model.session)
+        self.assertEqual(self.transaction.events.count(), 1)
+        self.assertEqual(self.transaction.last_event_occurred_at, now)
+
+    def test_add_event_reads_locked_transaction(self):
+        time1 = utc_now()
+        time2 = time1 + datetime.timedelta(seconds=10)
+        ts = self.transaction_model.statuses
+        Transaction = self.transaction_model.TABLE
+        with db_transaction.manager:
+            transaction = self.transaction_model.get(self.transaction.guid)
+            self.assertEqual(transaction.last_event_occurred_at, None)
+            # a newer event is applied by someone else after the transaction
+            # is loaded in this session
+            self.transaction_model.session.execute(
+                Transaction.__table__.update()
+                .where(Transaction.guid == transaction.guid)
+                .values(status=ts.FAILED, last_event_occurred_at=time2)
+            )
+            self.transaction_model.add_event(
+                transaction=transaction,
+                processor_id='EV_ID_1',
+                status=ts.SUCCEEDED,
+                occurred_at=time1,
+            )
+        self.assertEqual(self.transaction.status, ts.FAILED)
+        self.assertEqual(self.transaction.last_event_occurred_at, time2)
+
+    def test_locked_get_keeps_changes(self):
+        with db_transaction.manager:
+            transaction = self.transaction_model.get(self.transaction.guid)
+            transaction.processor_uri = 'MOCK_URI'
+            self.transaction_model.get(transaction.guid,
+                                       with_lockmode='update')
+            self.assertEqual(transaction.processor_uri, 'MOCK_URI')
+        self.assertEqual(self.transaction.processor_uri, 'MOCK_URI')
+
     def test_callback_only_latest_event_affects_status(self):
         time1 = utc_now()
         time2 = time1 + datetime.timedelta(seconds=10)
@@ -185,6 +257,7 @@ class TestBalancedProcessorModel(ModelTestCase):
         # occurred_at time is earlier than EV_ID3, so it should never affect
         # the status of transaction and invoice
         assert_status('EV_ID_2', 'succeeded', time2, vs.FAILED, ts.FAILED)
+        self.assertEqual(self.transaction.last_event_occurred_at, time3)
 
         # ensure events are generated correctly and in right order
         for event, (expected_ev_id, expected_status, expected_time) in zip(
@@ -198,6 +271,13 @@ class TestBalancedProcessorModel(ModelTestCase):
             self.assertEqual(event.status, expected_status)
             self.assertEqual(event.occurred_at, expected_time)
 
+    def test_get_callback_event_id(self):
+        processor = self.make_one()
+        payload = self.make_callback_payload()
+        self.assertEqual(processor.get_callback_event_id(payload), payload['id'])
+        with self.assertRaises(InvalidCallbackPayload):
+            processor.get_callback_event_id(dict(foo='bar'))
+
     def test_callback_with_other_company(self):
         with db_transaction.manager:
             other_company = self.company_model.create('MOCK_PROCESSOR_KEY')
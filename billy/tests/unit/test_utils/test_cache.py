@@ -0,0 +1,66 @@
+from __future__ import unicode_literals
+import unittest
+
+from billy.utils.cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000
+
+        def timer():
+            return self.now
+
+        self.timer = timer
+
+    def make_one(self, *args, **kwargs):
+        kwargs.setdefault('timer', self.timer)
+        return TTLCache(*args, **kwargs)
+
+    def test_get_and_set(self):
+        cache = self.make_one()
+        self.assertEqual(cache.get('foo'), None)
+        self.assertEqual(cache.get('foo', 'default'), 'default')
+        cache.set('foo', 'bar')
+        self.assertEqual(cache.get('foo'), 'bar')
+        cache.set('foo', 'baz')
+        self.assertEqual(cache.get('foo'), 'baz')
+        self.assertEqual(len(cache), 1)
+
+    def test_expire(self):
+        cache = self.make_one(ttl=60)
+        cache.set('foo', 'bar')
+        self.now += 59
+        self.assertEqual(cache.get('foo'), 'bar')
+        self.now += 1
+        self.assertEqual(cache.get('foo'), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_evict_least_recently_used(self):
+        cache = self.make_one(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # a is the most recently used one now
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_invalidate(self):
+        cache = self.make_one()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.invalidate('a')
+        cache.invalidate('not exist')
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), 2)
+        cache.clear()
+        self.assertEqual(cache.get('b'), None)
+
+    def test_disabled(self):
+        for kwargs in [dict(max_size=0), dict(ttl=0)]:
+            cache = self.make_one(**kwargs)
+            cache.set('a', 1)
+            self.assertEqual(cache.get('a'), None)
@@ -0,0 +1,91 @@
+from __future__ import unicode_literals
+import unittest
+
+from billy.utils.metrics import Registry
+
+
+class TestMetrics(unittest.TestCase):
+
+    def make_one(self):
+        return Registry()
+
+    def test_counter(self):
+        registry = self.make_one()
+        counter = registry.counter('calls_total', 'Calls', labels=('op', ))
+        self.assertEqual(counter.get(op='debit'), 0)
+        counter.inc(op='debit')
+        counter.inc(2, op='debit')
+        counter.inc(op='credit')
+        self.assertEqual(counter.get(op='debit'), 3)
+        self.assertEqual(counter.get(op='credit'), 1)
+        with self.assertRaises(ValueError):
+            counter.inc(operation='debit')
+        with self.assertRaises(ValueError):
+            counter.inc()
+
+    def test_gauge(self):
+        registry = self.make_one()
+        gauge = registry.gauge('backlog', 'Backlog')
+        gauge.set(5)
+        gauge.inc()
+        self.assertEqual(gauge.get(), 6)
+        gauge.set(0)
+        self.assertEqual(gauge.get(), 0)
+
+    def test_histogram(self):
+        registry = self.make_one()
+        histogram = registry.histogram(
+            'latency_seconds',
+            'Latency',
+            buckets=(0.1, 1.0),
+        )
+        self.assertEqual(histogram.get(), (0, 0.0))
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(0.5)
+        histogram.observe(3)
+        self.assertEqual(histogram.get(), (4, 3.65))
+        with histogram.time():
+            pass
+        self.assertEqual(histogram.get()[0], 5)
+
+    def test_register_same_name(self):
+        registry = self.make_one()
+        counter = registry.counter('calls_total', 'Calls')
+        self.assertIs(registry.counter('calls_total', 'Calls'), counter)
+        self.assertIs(registry.get('calls_total'), counter)
+
+    def test_render(self):
+        registry = self.make_one()
+        counter = registry.counter(
+            'calls_total',
+            'Calls by operation',
+            labels=('op', ),
+        )
+        histogram = registry.histogram(
+            'latency_seconds',
+            'Latency',
+            labels=('view', ),
+            buckets=(0.1, 1.0),
+        )
+        registry.gauge('backlog', 'Backlog').set(7)
+        counter.inc(op='debit')
+        counter.inc(op='say "hi"\n')
+        histogram.observe(0.5, view='index')
+        histogram.observe(2.5, view='index')
+        self.assertMultiLineEqual(registry.render(), (
+            '# HELP backlog Backlog\n'
+            '# TYPE backlog gauge\n'
+            'backlog 7\n'
+            '# HELP calls_total Calls by operation\n'
+            '# TYPE calls_total counter\n'
+            'calls_total{op="debit"} 1\n'
+            'calls_total{op="say \\"hi\\"\\n"} 1\n'
+            '# HELP latency_seconds Latency\n'
+            '# TYPE latency_seconds histogram\n'
+            'latency_seconds_bucket{view="index",le="0.1"} 0\n'
+            'latency_seconds_bucket{view="index",le="1"} 1\n'
+            'latency_seconds_bucket{view="index",le="+Inf"} 2\n'
+            'latency_seconds_sum{view="index"} 3\n'
+            'latency_seconds_count{view="index"} 2\n'
+        ))
@@ -0,0 +1,135 @@
+from __future__ import unicode_literals
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import threading
+
+from billy.utils.tracing import Tracer
+from billy.utils.tracing import JSONLinesExporter
+from billy.utils.tracing import current_span
+
+
+class ListExporter(object):
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+class TestTracer(unittest.TestCase):
+
+    def make_one(self, *args, **kwargs):
+        kwargs.setdefault('exporter', ListExporter())
+        return Tracer(*args, **kwargs)
+
+    def test_nested_spans(self):
+        tracer = self.make_one()
+        with tracer.span('root', foo='bar') as root:
+            self.assertIs(current_span(), root)
+            with tracer.span('child') as child:
+                self.assertIs(current_span(), child)
+            with tracer.span('child2') as child2:
+                pass
+            self.assertIs(current_span(), root)
+        self.assertEqual(current_span(), None)
+
+        self.assertEqual(tracer.exporter.spans, [child, child2, root])
+        self.assertEqual(root.parent_id, None)
+        self.assertEqual(root.attributes, dict(foo='bar'))
+        self.assertEqual(child.parent_id, root.span_id)
+        self.assertEqual(child2.parent_id, root.span_id)
+        self.assertEqual(child.trace_id, root.trace_id)
+        self.assertEqual(len(root.trace_id), 32)
+        self.assertEqual(len(root.span_id), 16)
+        self.assertTrue(root.duration >= child.duration)
+
+    def test_error(self):
+        tracer = self.make_one()
+        with self.assertRaises(ValueError):
+            with tracer.span('root') as root:
+                raise ValueError('Boom!')
+        self.assertEqual(root.error, 'ValueError: Boom!')
+        self.assertEqual(current_span(), None)
+
+    def test_disabled(self):
+        tracer = Tracer()
+        self.assertFalse(tracer.enabled)
+        with tracer.span('root') as root:
+            self.assertEqual(root, None)
+            self.assertEqual(current_span(), None)
+
+    def test_sampling(self):
+        values = [0.5, 0.05]
+        tracer = self.make_one(sample_rate=0.1, random=values.pop)
+        with tracer.span('sampled') as sampled:
+            with tracer.span('child'):
+                pass
+        with tracer.span('not_sampled') as not_sampled:
+            # children of a trace which is not sampled are not sampled too
+            with tracer.span('child') as child:
+                self.assertFalse(child.sampled)
+        self.assertTrue(sampled.sampled)
+        self.assertFalse(not_sampled.sampled)
+        self.assertEqual(
+            [span.name for span in tracer.exporter.spans],
+            ['child', 'sampled'],
+        )
+
+    def test_context_in_other_thread(self):
+        tracer = self.make_one()
+        spans = []
+
+        def work(context):
+            with tracer.span('work', parent=context) as span:
+                spans.append(span)
+
+        with tracer.span('root') as root:
+            thread = threading.Thread(
+                target=work,
+                args=(tracer.current_context(), ),
+            )
+            thread.start()
+            thread.join()
+        self.assertEqual(spans[0].trace_id, root.trace_id)
+        self.assertEqual(spans[0].parent_id, root.span_id)
+        self.assertEqual(tracer.current_context(), None)
+
+    def test_export_error(self):
+        class BrokenExporter(object):
+            def export(self, span):
+                raise IOError('Disk full')
+
+        tracer = self.make_one(exporter=BrokenExporter())
+        with tracer.span('root'):
+            pass
+
+
+class TestJSONLinesExporter(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_export(self):
+        path = os.path.join(self.temp_dir, 'traces.jsonl')
+        exporter = JSONLinesExporter(path)
+        tracer = Tracer(exporter=exporter)
+        with tracer.span('root', method='GET') as root:
+            with tracer.span('child') as child:
+                pass
+        exporter.close()
+        with open(path, 'rt') as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([line['name'] for line in lines], ['child', 'root'])
+        self.assertEqual(lines[0]['span_id'], child.span_id)
+        self.assertEqual(lines[0]['parent_id'], root.span_id)
+        self.assertEqual(lines[1]['trace_id'], root.trace_id)
+        self.assertEqual(lines[1]['attributes'], dict(method='GET'))
+        self.assertEqual(lines[1]['error'], None)
+        self.assertEqual(lines[1]['duration'], root.duration)
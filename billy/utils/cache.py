@@ -0,0 +1,64 @@
+from __future__ import unicode_literals
+import time
+import threading
+import collections
+
+
+class TTLCache(object):
+    """A thread-safe cache which holds at most `max_size` values, each of
+    them expires `ttl` seconds after it was set, and the least recently used
+    one gets evicted when the cache is full
+
+    """
+
+    def __init__(self, max_size=1000, ttl=60, timer=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.timer = timer
+        self._values = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Get value of given key, return default if there is no such value
+        or it is expired
+
+        """
+        with self._lock:
+            try:
+                expire_at, value = self._values.pop(key)
+            except KeyError:
+                return default
+            if expire_at <= self.timer():
+                return default
+            # move it to the end as the most recently used one
+            self._values[key] = (expire_at, value)
+            return value
+
+    def set(self, key, value):
+        """Set value of given key
+
+        """
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._values.pop(key, None)
+            while len(self._values) >= self.max_size:
+                self._values.popitem(last=False)
+            self._values[key] = (self.timer() + self.ttl, value)
+
+    def invalidate(self, key):
+        """Remove value of given key from the cache
+
+        """
+        with self._lock:
+            self._values.pop(key, None)
+
+    def clear(self):
+        """Remove all values from the cache
+
+        """
+        with self._lock:
+            self._values.clear()
+
+    def __len__(self):
+        return len(self._values)
@@ -0,0 +1,227 @@
+from __future__ import unicode_literals
+import time
+import bisect
+import threading
+import contextlib
+
+#: default upper bounds of histogram buckets in seconds
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def _escape(value):
+    return (
+        unicode(value)
+        .replace('\\', '\\\\')
+        .replace('\n', '\\n')
+        .replace('"', '\\"')
+    )
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, _escape(value)) for name, value in pairs
+    ) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return unicode(int(value))
+    return repr(value) if isinstance(value, float) else unicode(value)
+
+
+class Metric(object):
+    """Base class of metrics, values are kept by label values
+
+    """
+
+    TYPE = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(
+                'Labels of {} should be {}, got {}'
+                .format(self.name, self.label_names, sorted(labels))
+            )
+        return tuple(unicode(labels[name]) for name in self.label_names)
+
+    def clear(self):
+        """Remove all values
+
+        """
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        """Return (suffix, label values, extra labels, value) of samples
+
+        """
+        raise NotImplementedError
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.help),
+            '# TYPE {} {}'.format(self.name, self.TYPE),
+        ]
+        for suffix, label_values, extra, value in self.samples():
+            lines.append('{}{}{} {}'.format(
+                self.name,
+                suffix,
+                _format_labels(self.label_names, label_values, extra),
+                _format_value(value),
+            ))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """A value which only goes up
+
+    """
+
+    TYPE = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [('', key, (), value) for key, value in values]
+
+
+class Gauge(Counter):
+    """A value which can go up and down
+
+    """
+
+    TYPE = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """Distribution of observed values in buckets
+
+    """
+
+    TYPE = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(
+                key,
+                ([0] * (len(self.buckets) + 1), 0.0),
+            )
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe seconds the block takes
+
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+    def get(self, **labels):
+        """Return (count, sum) of observed values
+
+        """
+        counts, total = self._values.get(
+            self._key(labels),
+            ([0], 0.0),
+        )
+        return sum(counts), total
+
+    def samples(self):
+        with self._lock:
+            values = sorted(
+                (key, (list(counts), total))
+                for key, (counts, total) in self._values.items()
+            )
+        samples = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'), ), counts):
+                cumulative += count
+                samples.append((
+                    '_bucket',
+                    key,
+                    [('le', _format_value(float(bound)))],
+                    cumulative,
+                ))
+            samples.append(('_sum', key, (), total))
+            samples.append(('_count', key, (), cumulative))
+        return samples
+
+
+class Registry(object):
+    """A set of metrics rendered together in Prometheus text format
+
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Register a metric and return it, the metric registered already
+        with the same name is returned instead if there is one
+
+        """
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def get(self, name):
+        return self._metrics[name]
+
+    def render(self):
+        """Render all metrics in Prometheus text exposition format
+
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        return ''.join(metric.render() + '\n' for metric in metrics)
+
+
+#: the process-wide registry
+REGISTRY = Registry()
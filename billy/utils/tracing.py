@@ -0,0 +1,223 @@
+from __future__ import unicode_literals
+import json
+import time
+import random
+import logging
+import threading
+import contextlib
+import collections
+
+_local = threading.local()
+
+#: context of a span for making child spans, it can be passed to other
+#  threads for continuing the trace there
+SpanContext = collections.namedtuple(
+    'SpanContext',
+    ['trace_id', 'span_id', 'sampled'],
+)
+
+
+def _new_id(bits):
+    return '{:0{}x}'.format(random.getrandbits(bits), bits // 4)
+
+
+def _span_stack():
+    stack = getattr(_local, 'spans', None)
+    if stack is None:
+        stack = _local.spans = []
+    return stack
+
+
+def current_span():
+    """Return the innermost active span of current thread, or None
+
+    """
+    stack = getattr(_local, 'spans', None)
+    if not stack:
+        return None
+    return stack[-1]
+
+
+class Span(object):
+    """A timed operation in a trace, spans of a trace which is not sampled
+    are not exported, and they have no ids
+
+    """
+
+    def __init__(
+        self,
+        tracer,
+        name,
+        trace_id=None,
+        parent_id=None,
+        sampled=True,
+        attributes=None,
+    ):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.span_id = _new_id(64) if sampled else None
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.start_time = time.time()
+        self.end_time = None
+
+    @property
+    def context(self):
+        return SpanContext(self.trace_id, self.span_id, self.sampled)
+
+    @property
+    def duration(self):
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def finish(self, error=None):
+        """Finish the span and export it if it is sampled
+
+        """
+        self.end_time = time.time()
+        if error is not None:
+            self.error = '{}: {}'.format(type(error).__name__, error)
+        if self.sampled:
+            self.tracer.export(self)
+
+    def to_dict(self):
+        return dict(
+            trace_id=self.trace_id,
+            span_id=self.span_id,
+            parent_id=self.parent_id,
+            name=self.name,
+            start_time=self.start_time,
+            duration=self.duration,
+            attributes=self.attributes,
+            error=self.error,
+        )
+
+
+class Tracer(object):
+    """Tracer makes spans and passes finished ones to the exporter, tracing
+    is disabled when there is no exporter. Whether a trace is recorded is
+    decided at its root span, by `sample_rate`
+
+    """
+
+    def __init__(
+        self,
+        exporter=None,
+        sample_rate=1.0,
+        random=random.random,
+        logger=None,
+    ):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.random = random
+        self.logger = logger or logging.getLogger(__name__)
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    def current_context(self):
+        """Return context of current span for continuing the trace in other
+        threads, or None if there is no active span
+
+        """
+        span = current_span()
+        if span is None:
+            return None
+        return span.context
+
+    def start_span(self, name, parent=None, **attributes):
+        """Start a span as a child of the parent (a span or a context,
+        current span by default) without making it current, it should be
+        finished by calling `finish`
+
+        """
+        if parent is None:
+            parent = current_span()
+        if parent is None:
+            sampled = self.random() < self.sample_rate
+            trace_id = _new_id(128) if sampled else None
+            parent_id = None
+        else:
+            sampled = parent.sampled
+            trace_id = parent.trace_id
+            parent_id = parent.span_id
+        return Span(
+            tracer=self,
+            name=name,
+            trace_id=trace_id,
+            parent_id=parent_id,
+            sampled=sampled,
+            attributes=attributes,
+        )
+
+    @contextlib.contextmanager
+    def span(self, name, parent=None, **attributes):
+        """Run the block in a new span, the span is current span of the
+        thread in the block, None is given if tracing is disabled
+
+        """
+        if not self.enabled:
+            yield None
+            return
+        span = self.start_span(name, parent, **attributes)
+        stack = _span_stack()
+        stack.append(span)
+        error = None
+        try:
+            yield span
+        except Exception, e:
+            error = e
+            raise
+        finally:
+            stack.remove(span)
+            span.finish(error)
+
+    def wrap(self, name, func):
+        """Wrap the function for running it in a span with given name
+
+        """
+        def traced(*args, **kwargs):
+            with self.span(name):
+                return func(*args, **kwargs)
+        return traced
+
+    def export(self, span):
+        # tracing should never fail the operation it traces
+        try:
+            self.exporter.export(span)
+        except Exception:
+            self.logger.error('Failed to export span %s', span.name,
+                              exc_info=True)
+
+
+class JSONLinesExporter(object):
+    """Exporter appends spans to a file as JSON lines
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), sort_keys=True) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'ab')
+            self._file.write(line.encode('utf8'))
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None